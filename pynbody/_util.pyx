@@ -338,5 +338,90 @@ cpdef int is_sorted(int_or_float[:] A):
                 return 0
         return -1
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def segmented_moments(np.ndarray[fused_float, ndim=1] values, np.ndarray[fused_float_2, ndim=1] weights,
+                      np.ndarray[fused_int, ndim=1] indices, np.ndarray[fused_int_2, ndim=2] boundaries,
+                      int num_threads=-1):
+    """Calculate moments of values over segments of an index list, e.g. for all halos in a catalogue at once.
+
+    Segment i consists of values[indices[boundaries[i,0]:boundaries[i,1]]]. Returns, for each segment, the sum of
+    the weights, the weighted sum of the values, the weighted sum of the squared values, and the minimum and maximum
+    values (NaN for empty segments). If weights is empty, all weights are taken to be one. Segments are processed in
+    parallel."""
+    cdef Py_ssize_t nseg = boundaries.shape[0]
+    cdef Py_ssize_t i, j
+    cdef np.int64_t p
+    cdef bint weighted = len(weights) > 0
+    cdef double w, x, sum_w, sum_wx, sum_wx2, min_x, max_x
+
+    cdef np.ndarray[np.float64_t, ndim=1] out_sum_w = np.zeros(nseg)
+    cdef np.ndarray[np.float64_t, ndim=1] out_sum_wx = np.zeros(nseg)
+    cdef np.ndarray[np.float64_t, ndim=1] out_sum_wx2 = np.zeros(nseg)
+    cdef np.ndarray[np.float64_t, ndim=1] out_min = np.empty(nseg)
+    cdef np.ndarray[np.float64_t, ndim=1] out_max = np.empty(nseg)
+
+    if weighted:
+        assert len(weights) == len(values)
+
+    if num_threads <= 0:
+        num_threads = config['number_of_threads']
+
+    for i in prange(nseg, nogil=True, schedule='dynamic', chunksize=64, num_threads=num_threads):
+        sum_w = 0.0
+        sum_wx = 0.0
+        sum_wx2 = 0.0
+        min_x = cmath.INFINITY
+        max_x = -cmath.INFINITY
+        for j in range(boundaries[i, 0], boundaries[i, 1]):
+            p = indices[j]
+            x = values[p]
+            if weighted:
+                w = weights[p]
+            else:
+                w = 1.0
+            sum_w = sum_w + w
+            sum_wx = sum_wx + w * x
+            sum_wx2 = sum_wx2 + w * x * x
+            if x < min_x:
+                min_x = x
+            if x > max_x:
+                max_x = x
+        out_sum_w[i] = sum_w
+        out_sum_wx[i] = sum_wx
+        out_sum_wx2[i] = sum_wx2
+        if boundaries[i, 1] > boundaries[i, 0]:
+            out_min[i] = min_x
+            out_max[i] = max_x
+        else:
+            out_min[i] = cmath.NAN
+            out_max[i] = cmath.NAN
+
+    return out_sum_w, out_sum_wx, out_sum_wx2, out_min, out_max
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def assign_segment_values(np.ndarray[fused_int, ndim=1] target, np.ndarray[fused_int_2, ndim=1] indices,
+                          np.ndarray[fused_int_3, ndim=2] boundaries, np.ndarray[np.int64_t, ndim=1] segment_order,
+                          np.ndarray[np.int64_t, ndim=1] values):
+    """For i in order, with k = segment_order[i], set target[indices[boundaries[k,0]:boundaries[k,1]]] = values[i].
+
+    Segments are written in the order given, so where segments overlap the one written last wins. The caller is
+    responsible for ensuring that all indices are within the bounds of target."""
+    cdef Py_ssize_t n = len(segment_order)
+    cdef Py_ssize_t i, j, k
+    cdef np.int64_t value
+
+    assert len(values) == n
+
+    with nogil:
+        for i in range(n):
+            k = segment_order[i]
+            value = values[i]
+            for j in range(boundaries[k, 0], boundaries[k, 1]):
+                target[indices[j]] = value
+
 __all__ = ['grid_gen','find_boundaries', 'sum', 'sum_if_gt', 'sum_if_lt',
-           'binary_search', 'is_sorted']
+           'binary_search', 'is_sorted', 'segmented_moments',
+           'assign_segment_values']
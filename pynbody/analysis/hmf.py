@@ -811,7 +811,14 @@ def simulation_halo_mass_function(snapshot,
         warnings.warn("Halo finder masses not provided. Calculating them (might take a while...)")
 
         if mass_def=="halo_finder":
-            masses = np.array([h['mass'].sum().in_units('1 h**-1 Msol') for h in halo_catalogue])
+            try:
+                if subsample_catalogue is None:
+                    masses = halo_catalogue.reduce('mass')
+                else:
+                    masses = halo_catalogue_underlying.reduce('mass')[::subsample_catalogue]
+                masses = np.asarray(masses.in_units('1 h**-1 Msol'))
+            except NotImplementedError:
+                masses = np.array([h['mass'].sum().in_units('1 h**-1 Msol') for h in halo_catalogue])
         else:
             raise KeyError("Only halo finder mass is supported in this calculation for now")
 
@@ -176,7 +176,7 @@ class Profile:
                 self.min = data['min']
                 self.nbins = data['nbins']
                 self._profiles = data['profiles']
-                self.binind = data['binind']
+                self._set_bin_index_from_binind(data['binind'])
 
                 logger.info("Loaded profile from %s" % filename)
 
@@ -263,11 +263,10 @@ class Profile:
         self._properties['dr'].units = self['rbins'].units
         self._properties['dr'].sim = self.sim
 
-        self.binind = []
         if len(self._x) > 0:
             self.partbin = np.digitize(self._x, self['bin_edges'])
         else:
-            self.partbin = np.array([])
+            self.partbin = np.array([], dtype=np.intp)
 
         assert self.ndim in [2, 3]
         if self.ndim == 2:
@@ -277,17 +276,66 @@ class Profile:
             self._binsize = 4. / 3. * np.pi * (self['bin_edges'][1:] ** 3 -
                                                self['bin_edges'][:-1] ** 3)
 
-        # sort the partbin array
-        from bisect import bisect
-        sortind = self.partbin.argsort()
-        sort_pind = self.partbin[sortind]
+        # sort the particles by bin. A stable sort keeps the particles within each bin in their original order;
+        # for small integer types numpy implements this as a radix sort, which is much faster
+        sortind = self.partbin.astype(self._bin_number_dtype()).argsort(kind='stable')
 
-        # create the bin index arrays
-        prev_index = bisect(sort_pind, 0)
-        for i in range(self.nbins):
-            new_index = bisect(sort_pind, i + 1)
-            self.binind.append(np.sort(sortind[prev_index:new_index]))
-            prev_index = new_index
+        # partbin is 1 for particles in the first bin, through to nbins for the last bin; find where each starts
+        # in the sorted list, along with the end of the last bin
+        bin_offsets = np.searchsorted(self.partbin[sortind], np.arange(1, self.nbins + 2))
+
+        self._bin_particles = sortind[bin_offsets[0]:bin_offsets[-1]]
+        self._bin_offsets = bin_offsets - bin_offsets[0]
+        self.binind = [self._bin_particles[start:end]
+                       for start, end in zip(self._bin_offsets[:-1], self._bin_offsets[1:])]
+
+    def _bin_number_dtype(self):
+        """Return the smallest integer type that can hold all bin numbers, including the out-of-range values"""
+        if self.nbins + 2 <= np.iinfo(np.uint16).max:
+            return np.uint16
+        else:
+            return np.intp
+
+    def _set_bin_index_from_binind(self, binind):
+        """Reconstruct the sorted bin index from a list of per-bin particle index arrays"""
+        self.binind = binind
+        if len(binind) > 0:
+            self._bin_particles = np.concatenate(binind).astype(np.intp)
+        else:
+            self._bin_particles = np.array([], dtype=np.intp)
+        self._bin_offsets = np.concatenate(([0], np.cumsum([len(b) for b in binind]))).astype(np.intp)
+
+    def _sort_by_bin(self, values):
+        """Return the values for the particles in the profile, gathered into bin order.
+
+        The result can be passed to _sum_by_bin or _median_by_bin."""
+        return values[self._bin_particles]
+
+    def _sum_by_bin(self, sorted_values):
+        """Return the sum over each bin of values that have been gathered by _sort_by_bin"""
+        result = np.zeros((self.nbins,) + sorted_values.shape[1:])
+        starts = self._bin_offsets[:-1]
+        nonempty = starts < self._bin_offsets[1:]
+        if nonempty.any():
+            # because the empty bins are omitted, each reduction runs to the start of the next non-empty bin,
+            # i.e. to the end of the bin in question
+            result[nonempty] = np.add.reduceat(sorted_values, starts[nonempty], axis=0, dtype=np.float64)
+        return result
+
+    def _median_by_bin(self, sorted_values):
+        """Return the median over each bin of values that have been gathered by _sort_by_bin, or nan for empty bins"""
+        counts = np.diff(self._bin_offsets)
+        bin_number = np.repeat(np.arange(self.nbins, dtype=self._bin_number_dtype()), counts)
+        # sort by value, then (stably) by bin, so that values end up sorted within each bin. This is considerably
+        # faster than np.lexsort, because the second sort is a radix sort on small integers.
+        order = np.argsort(sorted_values)
+        order = order[bin_number[order].argsort(kind='stable')]
+        sorted_values = sorted_values[order]
+        result = np.empty(self.nbins)
+        result[:] = np.nan
+        nonempty = counts > 0
+        result[nonempty] = sorted_values[self._bin_offsets[:-1][nonempty] + counts[nonempty] // 2]
+        return result
 
     def __len__(self):
         """Returns the number of bins used in this profile object"""
@@ -346,38 +394,29 @@ class Profile:
             raise KeyError(name + " is not a valid profile")
 
     def _auto_profile(self, name, dispersion=False, rms=False, median=False):
-        result = np.zeros(self.nbins)
-
         # force derivation of array if necessary:
         self.sim[name]
 
-        for i in range(self.nbins):
-            subs = self.sim[self.binind[i]]
-            name_array = subs[name].view(np.ndarray)
-            mass_array = subs[self._weight_by].view(np.ndarray)
-
-            if dispersion:
-                sq_mean = (name_array ** 2 * mass_array).sum() / \
-                    self['weight_fn'][i]
-                mean_sq = (
-                    (name_array * mass_array).sum() / self['weight_fn'][i]) ** 2
-                try:
-                    result[i] = math.sqrt(sq_mean - mean_sq)
-                except ValueError:
+        with self.sim.immediate_mode:
+            name_array = self._sort_by_bin(self.sim[name].view(np.ndarray))
+
+        if median:
+            result = self._median_by_bin(name_array)
+        else:
+            with self.sim.immediate_mode:
+                mass_array = self._sort_by_bin(self.sim[self._weight_by].view(np.ndarray))
+            weight = self['weight_fn'].view(np.ndarray)
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                if dispersion:
+                    sq_mean = self._sum_by_bin(name_array ** 2 * mass_array) / weight
+                    mean_sq = (self._sum_by_bin(name_array * mass_array) / weight) ** 2
                     # sq_mean<mean_sq occasionally from numerical roundoff
-                    result[i] = 0
-
-            elif rms:
-                result[i] = np.sqrt(
-                    (name_array ** 2 * mass_array).sum() / self['weight_fn'][i])
-            elif median:
-                if len(subs) == 0:
-                    result[i] = np.nan
+                    result = np.sqrt(np.maximum(sq_mean - mean_sq, 0))
+                elif rms:
+                    result = np.sqrt(self._sum_by_bin(name_array ** 2 * mass_array) / weight)
                 else:
-                    sorted_name = sorted(name_array)
-                    result[i] = sorted_name[int(np.floor(0.5 * len(subs)))]
-            else:
-                result[i] = (name_array * mass_array).sum() / self['weight_fn'][i]
+                    result = self._sum_by_bin(name_array * mass_array) / weight
 
         result = result.view(array.SimArray)
         result.units = self.sim[name].units
@@ -549,8 +588,7 @@ def weight_fn(self, weight_by=None):
     with self.sim.immediate_mode:
         pmass = self.sim[weight_by].view(np.ndarray)
 
-    for i in range(self.nbins):
-        mass[i] = (pmass[self.binind[i]]).sum()
+    mass[:] = self._sum_by_bin(self._sort_by_bin(pmass))
 
     mass.sim = self.sim
     mass.units = self.sim[weight_by].units
@@ -1042,3 +1080,287 @@ class QuantileProfile(Profile):
         result.units = self.sim[name].units
         result.sim = self.sim
         return result
+
+
+class StreamingProfile:
+
+    """
+
+    A profile which is accumulated by streaming through a snapshot in chunks of particles, so that the
+    snapshot never needs to be held in memory in its entirety.
+
+    Weighted means, rms values and dispersions are calculated exactly from running sums in each bin. Medians
+    and other quantiles are estimated from a uniform random sample of particles in each bin, of at most
+    *quantile_sample_size* particles.
+
+    Because all particles are visited only once, the quantities to profile must be specified in advance, and
+    the bins cannot depend on the particle distribution (i.e. *rmax* must be given, and 'equaln' binning is
+    not available).
+
+    For Tipsy and GadgetHDF files, chunks of up to *chunk_size* particles are partially loaded from disk in
+    turn, with the same loading options as *sim*. For RAMSES outputs each CPU's domain is loaded in turn,
+    regardless of *chunk_size*. For other formats, the snapshot is processed in slices, but all arrays used
+    are loaded into memory.
+
+    **Input**:
+
+    *sim* : a filename, or a snapshot loaded from disk. If a snapshot is given, it should not already have the
+            required arrays loaded (otherwise there is no benefit over using :class:`Profile`).
+
+    *quantities* : a list of the particle arrays to profile, e.g. ['vr', 'temp']. For each quantity, the
+                   profile provides the weighted mean (e.g. 'vr'), rms ('vr_rms'), dispersion ('vr_disp') and
+                   median ('vr_med'). Derived arrays may be used.
+
+    **Optional Keywords**:
+
+    *ndim* (default = 3): specifies whether it's a 2D or 3D profile - in the
+                       2D case, the bins are generated in the xy plane
+
+    *type* (default = 'lin'): specifies whether bins should be spaced linearly ('lin') or
+                            logarithmically ('log')
+
+    *rmin* (default = 0 for linear bins): minimum radial value to consider. Must be given for 'log' bins.
+
+    *rmax*: maximum radial value to consider. Must be given unless *bins* is specified.
+
+    *nbins* (default = 100): number of bins
+
+    *bins* : array like - predefined bin edges in units of binning quantity.
+
+    *weight_by* (default = 'mass'): the array to use for weighting means, rms values and dispersions
+
+    *family*: if specified, only particles of this family are included
+
+    *cen*, *vcen*: if specified, the position and velocity about which to calculate the profile, in the
+                   units of each chunk (i.e. the file's units unless *physical_units* is True)
+
+    *physical_units* (default = False): if True, each chunk is converted to physical units before being
+                                        profiled
+
+    *chunk_size* (default = 10000000): the maximum number of particles to load at once, where the format
+                                       supports it
+
+    *quantile_sample_size* (default = 10000): the maximum number of particles per bin retained to estimate
+                                              medians and other quantiles. If 0, quantiles are not available.
+
+    **Usage:**
+
+    >>> p = pynbody.analysis.profile.StreamingProfile("path/to/snapshot", ['vr'], rmax=100.0, nbins=50)
+    >>> p['density']
+    >>> p['vr_disp']
+    >>> p.quantile('vr', 0.9)
+
+    """
+
+    def __init__(self, sim, quantities=(), ndim=3, type='lin', nbins=100, rmin=None, rmax=None, bins=None,
+                 weight_by='mass', family=None, cen=None, vcen=None, physical_units=False,
+                 chunk_size=10000000, quantile_sample_size=10000):
+
+        if not isinstance(sim, pynbody.snapshot.SimSnap):
+            sim = pynbody.load(sim)
+
+        self.sim = sim
+        self.ndim = ndim
+        self.type = type
+        self.nbins = nbins if bins is None else len(bins) - 1
+        self._quantities = list(quantities)
+        self._weight_by = weight_by
+        self._quantile_sample_size = quantile_sample_size
+        self._bin_spec = {'rmin': rmin, 'rmax': rmax, 'bins': bins}
+        self._properties = {}
+        self._profiles = {}
+        self._units = None
+
+        self._n = np.zeros(self.nbins, dtype=np.int64)
+        self._sum_weight = np.zeros(self.nbins)
+        self._sums = {name: np.zeros(self.nbins) for name in self._quantities}
+        self._sums_sq = {name: np.zeros(self.nbins) for name in self._quantities}
+
+        self._sample_bin = np.zeros(0, dtype=np.intp)
+        self._sample_key = np.zeros(0)
+        self._sample_values = {name: np.zeros(0) for name in self._quantities}
+
+        self._random = np.random.default_rng()
+
+        for i, chunk in enumerate(sim._iterate_chunks_from_disk(chunk_size)):
+            if family is not None:
+                chunk = chunk[family]
+            if len(chunk) == 0:
+                continue
+            logger.info("StreamingProfile processing chunk %d with %d particles" % (i, len(chunk)))
+            if physical_units:
+                chunk.physical_units()
+            if cen is not None:
+                pynbody.transformation.inverse_translate(chunk, cen)
+            if vcen is not None:
+                pynbody.transformation.inverse_v_translate(chunk, vcen)
+            self._accumulate(chunk)
+
+        if self._units is None:
+            raise ValueError("No particles found from which to construct a profile")
+
+        self._finalise()
+
+    def _setup_bins(self, x, chunk):
+        rmin, rmax, bins = self._bin_spec['rmin'], self._bin_spec['rmax'], self._bin_spec['bins']
+
+        def to_x_units(value):
+            if isinstance(value, str):
+                return units.Unit(value).ratio(x.units, **chunk.conversion_context())
+            return value
+
+        rmin, rmax = to_x_units(rmin), to_x_units(rmax)
+
+        if bins is not None:
+            bin_edges = np.asarray(bins)
+        elif rmax is None:
+            raise ValueError("StreamingProfile requires rmax or bins to be specified")
+        elif self.type == 'log':
+            if rmin is None:
+                raise ValueError("StreamingProfile requires rmin to be specified for logarithmic bins")
+            bin_edges = np.logspace(np.log10(rmin), np.log10(rmax), num=self.nbins + 1)
+        elif self.type == 'lin':
+            bin_edges = np.linspace(rmin or 0.0, rmax, num=self.nbins + 1)
+        else:
+            raise RuntimeError("Bin type must be one of: lin, log")
+
+        self.min = bin_edges.min()
+        self.max = bin_edges.max()
+        self._properties['bin_edges'] = array.SimArray(bin_edges, x.units)
+
+    def _accumulate(self, chunk):
+        x = ((chunk['pos'][:, 0:self.ndim] ** 2).sum(axis=1)) ** (1, 2)
+
+        if self._units is None:
+            self._setup_bins(x, chunk)
+            self._units = {name: chunk[name].units for name in self._quantities}
+            self._units[self._weight_by] = chunk[self._weight_by].units
+
+        partbin = np.digitize(x.view(np.ndarray), self['bin_edges'].view(np.ndarray)) - 1
+        in_range = (partbin >= 0) & (partbin < self.nbins)
+        partbin = partbin[in_range]
+
+        weight = chunk[self._weight_by].view(np.ndarray)[in_range]
+
+        self._n += np.bincount(partbin, minlength=self.nbins)
+        self._sum_weight += np.bincount(partbin, weight, minlength=self.nbins)
+
+        values = {}
+        for name in self._quantities:
+            values[name] = chunk[name].view(np.ndarray)[in_range]
+            if values[name].ndim != 1:
+                raise ValueError("StreamingProfile can only profile 1D arrays, but %r is not 1D" % name)
+            self._sums[name] += np.bincount(partbin, weight * values[name], minlength=self.nbins)
+            self._sums_sq[name] += np.bincount(partbin, weight * values[name] ** 2, minlength=self.nbins)
+
+        if len(self._quantities) > 0 and self._quantile_sample_size > 0:
+            self._update_sample(partbin, values)
+
+    def _update_sample(self, partbin, values):
+        """Maintain a uniform random sample of particles in each bin, by giving each particle a random key and
+        keeping those with the smallest keys in each bin"""
+        key = self._random.uniform(size=len(partbin))
+
+        # quickly discard particles that cannot displace any in an already-full bin
+        threshold = np.full(self.nbins, np.inf)
+        full = np.bincount(self._sample_bin, minlength=self.nbins) >= self._quantile_sample_size
+        if full.any():
+            threshold[full] = 0.0
+            np.maximum.at(threshold, self._sample_bin[full[self._sample_bin]], self._sample_key[full[self._sample_bin]])
+        candidate = key < threshold[partbin]
+
+        sample_bin = np.concatenate((self._sample_bin, partbin[candidate]))
+        sample_key = np.concatenate((self._sample_key, key[candidate]))
+
+        order = np.lexsort((sample_key, sample_bin))
+        sorted_bin = sample_bin[order]
+        rank_in_bin = np.arange(len(order)) - np.searchsorted(sorted_bin, sorted_bin)
+        keep = order[rank_in_bin < self._quantile_sample_size]
+
+        self._sample_bin = sample_bin[keep]
+        self._sample_key = sample_key[keep]
+        for name in self._quantities:
+            self._sample_values[name] = np.concatenate((self._sample_values[name], values[name][candidate]))[keep]
+
+    def _finalise(self):
+        bin_edges = self['bin_edges']
+        self._properties['rbins'] = 0.5 * (bin_edges[:-1] + bin_edges[1:])
+        self._properties['dr'] = np.gradient(self['rbins']).view(array.SimArray)
+        self._properties['dr'].units = self['rbins'].units
+
+        if self.ndim == 2:
+            self._binsize = np.pi * (bin_edges[1:] ** 2 - bin_edges[:-1] ** 2)
+        else:
+            self._binsize = 4. / 3. * np.pi * (bin_edges[1:] ** 3 - bin_edges[:-1] ** 3)
+
+        self._profiles['n'] = self._n
+        weight = array.SimArray(self._sum_weight, self._units[self._weight_by])
+        self._profiles['weight_fn'] = weight
+        if self._weight_by == 'mass':
+            self._profiles['mass'] = weight
+            self._profiles['density'] = weight / self._binsize
+            self._profiles['mass_enc'] = weight.cumsum()
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for name in self._quantities:
+                mean = self._sums[name] / self._sum_weight
+                sq_mean = self._sums_sq[name] / self._sum_weight
+                self._profiles[name] = array.SimArray(mean, self._units[name])
+                self._profiles[name + "_rms"] = array.SimArray(np.sqrt(sq_mean), self._units[name])
+                # sq_mean<mean**2 occasionally from numerical roundoff
+                self._profiles[name + "_disp"] = array.SimArray(np.sqrt(np.maximum(sq_mean - mean ** 2, 0)),
+                                                                self._units[name])
+                if self._quantile_sample_size > 0:
+                    self._profiles[name + "_med"] = self.quantile(name, 0.5)
+
+        for v in self._profiles.values():
+            if isinstance(v, array.SimArray):
+                v.sim = self.sim
+
+    def quantile(self, name, q):
+        """Return an estimate of the *q* quantile (0<=q<=1) of the named quantity in each bin.
+
+        The estimate is calculated from the random sample of particles retained in each bin; bins with no
+        particles give nan."""
+        if self._quantile_sample_size == 0:
+            raise ValueError("Quantiles are not available because quantile_sample_size is 0")
+
+        values = self._sample_values[name]
+        order = np.lexsort((values, self._sample_bin))
+        values = values[order]
+        counts = np.bincount(self._sample_bin, minlength=self.nbins)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+
+        result = np.empty(self.nbins)
+        result[:] = np.nan
+        nonempty = counts > 0
+        # use the same convention as for the medians in Profile
+        index = offsets[:-1][nonempty] + np.minimum(np.floor(q * counts[nonempty]).astype(np.intp),
+                                                    counts[nonempty] - 1)
+        result[nonempty] = values[index]
+
+        result = array.SimArray(result, self._units[name])
+        result.sim = self.sim
+        return result
+
+    def __getitem__(self, name):
+        """Return the profile of a given kind"""
+        if name in self._properties:
+            return self._properties[name]
+        elif name in self._profiles:
+            return self._profiles[name]
+        else:
+            raise KeyError(name + " is not a valid profile; the StreamingProfile must be constructed with "
+                                  "the required quantities in advance")
+
+    def __len__(self):
+        """Returns the number of bins used in this profile object"""
+        return self.nbins
+
+    def __repr__(self):
+        return ("<StreamingProfile: " + str(self.ndim) + "D ; " + self.type + " ; " +
+                str(list(self.keys())) + ">")
+
+    def keys(self):
+        """Returns a listing of available profile types"""
+        return list(self._profiles.keys())
@@ -647,7 +647,12 @@ class SimArray(np.ndarray):
                                      **(self.conversion_context()))
             logger.debug("Converting %s units from %s to %s; ratio = %.3e" %
                          (self.name, self.units, new_unit, ratio))
-            self *= ratio
+            sim = self.sim
+            if sim is not None:
+                with sim.converting_units:
+                    self *= ratio
+            else:
+                self *= ratio
             self.units = new_unit
 
     def write(self, **kwargs):
@@ -23,6 +23,7 @@ in your simulation, see the `bridge tutorial
 import weakref
 
 import numpy as np
+import scipy.sparse
 
 from . import _bridge
 
@@ -72,8 +73,9 @@ class Bridge:
 
         Parameters min_index and max_index are the minimum and maximum halo
         numbers to be matched (in both ends of the bridge). If max_index is
-        too large, the catalogue matching can take prohibitively long (it
-        scales as max_index^2).
+        None, all halos are matched. The matching uses a sparse transfer matrix,
+        so that memory use scales with the number of particles and the number of
+        distinct pairs of halos sharing particles, rather than with max_index^2.
 
         This routine currently uses particle number as a proxy for mass, so that the
         main simulation data does not need to be loaded.
@@ -97,7 +99,7 @@ class Bridge:
         """
         fuzzy_matches = self.fuzzy_match_catalog(min_index, max_index, threshold, groups_1, groups_2, use_family)
 
-        identification = np.zeros(max_index+1,dtype=int)
+        identification = np.zeros(len(fuzzy_matches),dtype=int)
 
         for i,row in enumerate(fuzzy_matches):
             if len(row)>0:
@@ -131,23 +133,27 @@ class Bridge:
             A list of lists, where the first index corresponds to the halo number in groups_1. See above for details.
         """
 
-        transfer_matrix = self.catalog_transfer_matrix(min_index,max_index,groups_1,groups_2,use_family,only_family)
+        transfer_matrix = self.catalog_transfer_matrix(min_index,max_index,groups_1,groups_2,use_family,only_family,
+                                                       sparse=True)
 
         output = [[]]*min_index
-        for row in transfer_matrix:
+        for row_start, row_end in zip(transfer_matrix.indptr[:-1], transfer_matrix.indptr[1:]):
             this_row_matches = []
+            row = transfer_matrix.data[row_start:row_end]
             if row.sum()>0:
+                columns = transfer_matrix.indices[row_start:row_end]
                 frac_particles_transferred = np.array(row,dtype=float)/row.sum()
                 above_threshold = np.where(frac_particles_transferred>threshold)[0]
                 above_threshold = above_threshold[np.argsort(frac_particles_transferred[above_threshold])[::-1]]
                 for column in above_threshold:
-                    this_row_matches.append((column+min_index, frac_particles_transferred[column]))
+                    this_row_matches.append((columns[column]+min_index, frac_particles_transferred[column]))
 
             output.append(this_row_matches)
 
         return output
 
-    def catalog_transfer_matrix(self, min_index=1, max_index=30, groups_1=None, groups_2=None,use_family=None,only_family=None):
+    def catalog_transfer_matrix(self, min_index=1, max_index=30, groups_1=None, groups_2=None,use_family=None,only_family=None,
+                                sparse=False):
         """Return a max_index x max_index matrix with the number of particles transferred from
         the row group in groups_1 to the column group in groups_2.
 
@@ -156,12 +162,17 @@ class Bridge:
 
         Arguments:
             min_index -- minimum halo number to be matched
-            max_index -- maximum halo number to be matched
+            max_index -- maximum halo number to be matched (default: 30). If None, the largest halo number
+                         in either catalogue is used.
             groups_1 -- Halos object for the first catalogue (default: None, in which case it is obtained from the start point of the bridge)
             groups_2 -- Halos object for the second catalogue (default: None, in which case it is obtained from the end point of the bridge)
             use_family -- only match particles of this family (default: None, in which case all particles are matched)
             only_family -- only match particles of this family, like use_family, but try not even to load data about
                            other particles (thus saving memory). Don't specify use_family if you specify only_family.
+            sparse -- if True, return a scipy.sparse.csr_matrix rather than a dense numpy array. The sparse matrix
+                      requires memory proportional to the number of particles and the number of non-zero entries,
+                      whereas the dense matrix requires memory proportional to (max_index-min_index+1)^2. Use this
+                      to match entire catalogues.
         """
 
         if only_family is not None:
@@ -209,15 +220,36 @@ class Bridge:
             g2 = groups_2.get_group_array(family=only_family)[restriction_end_indices]
 
         if max_index is None:
-            max_index = max(len(groups_1), len(groups_2))
+            max_index = max(g1.max(initial=0), g2.max(initial=0))
         if min_index is None:
             min_index = min(g1.min(),g2.min())
 
-        transfer_matrix = _bridge.match(g1, g2, min_index, max_index)
+        if sparse:
+            transfer_matrix = _sparse_match(g1, g2, min_index, max_index)
+        else:
+            transfer_matrix = _bridge.match(g1, g2, min_index, max_index)
 
         return transfer_matrix
 
 
+def _sparse_match(group_list_1, group_list_2, imin, imax):
+    """Equivalent to _bridge.match, but returning a scipy.sparse.csr_matrix"""
+    group_list_1 = np.asarray(group_list_1, dtype=np.int64)
+    group_list_2 = np.asarray(group_list_2, dtype=np.int64)
+    assert len(group_list_1) == len(group_list_2)
+
+    mask = (group_list_1 >= imin) & (group_list_1 <= imax) & (group_list_2 >= imin) & (group_list_2 <= imax)
+    rows = group_list_1[mask] - imin
+    columns = group_list_2[mask] - imin
+    n = imax + 1 - imin
+
+    # duplicate (row, column) entries are summed on conversion, giving the particle counts
+    transfer_matrix = scipy.sparse.coo_matrix((np.ones(len(rows), dtype=np.int64), (rows, columns)),
+                                              shape=(n, n)).tocsr()
+    transfer_matrix.sum_duplicates()
+    return transfer_matrix
+
+
 class OrderBridge(Bridge):
 
     """An OrderBridge uses integer arrays in two simulations
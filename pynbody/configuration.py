@@ -72,6 +72,18 @@ def _get_basic_config_from_parser(config_parser):
         'general', 'gravity_calculation_mode')
     config['disk-fit-function'] = config_parser.get('general', 'disk-fit-function')
 
+    cache_path = config_parser.get('derived-array-cache', 'path')
+    config['derived-array-cache'] = {
+        'enabled': config_parser.getboolean('derived-array-cache', 'enabled'),
+        'path': None if cache_path == 'None' else cache_path,
+        'max-size-mb': float(config_parser.get('derived-array-cache', 'max-size-mb'))
+    }
+
+    config['halo-cache'] = {
+        'max-halos': int(config_parser.get('halo-cache', 'max-halos')),
+        'max-size-mb': float(config_parser.get('halo-cache', 'max-size-mb'))
+    }
+
     return config
 
 def _setup_logger(config):
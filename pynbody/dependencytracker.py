@@ -55,3 +55,19 @@ class DependencyTracker:
 
     def get_dependents(self, name):
         return self._dependencies.get(name, set())
+
+    def get_dependencies(self, name):
+        with self._calculation_lock:
+            return {other for other, dependents in self._dependencies.items() if name in dependents}
+
+    def get_all_dependencies(self, name):
+        """Return the dependencies of name, including indirect ones (dependencies of dependencies, etc)"""
+        with self._calculation_lock:
+            result = set()
+            to_visit = [name]
+            while to_visit:
+                for other in self.get_dependencies(to_visit.pop()):
+                    if other not in result and other != name:
+                        result.add(other)
+                        to_visit.append(other)
+            return result
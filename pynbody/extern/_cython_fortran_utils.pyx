@@ -354,6 +354,77 @@ cdef class FortranFile:
         return data
 
 
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def scan_records(self, INT64_t count, INT64_t records_per_item, object int_records):
+        """Scan through a sequence of items, each made of the same number of records,
+        returning the position of each item and some integer values stored in it.
+
+        This is equivalent to calling `tell`, `read_int`/`read_int64` and `skip`
+        repeatedly from python, but much faster when there are many items.
+
+        Parameters
+        ----------
+        count : int
+            The number of items to scan, starting at the current position
+        records_per_item : int
+            The number of records making up each item
+        int_records : iterable of int
+            The (zero-based) indices, within an item, of records holding a single
+            int32 or int64 value to be returned
+
+        Returns
+        -------
+        offsets : numpy.ndarray
+            The position in the file at which each item starts, of shape (count,)
+        values : numpy.ndarray
+            The int64 values read from the requested records, of shape (count, len(int_records))
+
+        Examples
+        --------
+        >>> f = FortranFile("fort.3")
+        >>> offsets, values = f.scan_records(100, 4, [0, 2])
+        """
+        cdef INT64_t i, j, nint = len(int_records)
+        cdef INT32_t s1, s2, value32
+        cdef INT64_t value64
+        cdef np.ndarray[INT64_t, ndim=1] offsets = np.empty(count, dtype=np.int64)
+        cdef np.ndarray[INT64_t, ndim=2] values = np.empty((count, nint), dtype=np.int64)
+        cdef np.ndarray[INT64_t, ndim=1] value_index = np.empty(records_per_item, dtype=np.int64)
+
+        if self._closed:
+            raise ValueError("Read of closed file.")
+
+        value_index[:] = -1
+        for j, record in enumerate(int_records):
+            if record < 0 or record >= records_per_item:
+                raise ValueError("Record index %s is out of range" % record)
+            value_index[record] = j
+
+        for i in range(count):
+            offsets[i] = ftell(self.cfile)
+            for j in range(records_per_item):
+                if fread(&s1, INT32_SIZE, 1, self.cfile) != 1:
+                    raise IOError("Unexpected end of file while scanning item %s" % i)
+                if value_index[j] < 0:
+                    fseek(self.cfile, s1, SEEK_CUR)
+                elif s1 == INT32_SIZE:
+                    fread(&value32, INT32_SIZE, 1, self.cfile)
+                    values[i, value_index[j]] = value32
+                elif s1 == INT64_SIZE:
+                    fread(&value64, INT64_SIZE, 1, self.cfile)
+                    values[i, value_index[j]] = value64
+                else:
+                    raise ValueError("Expected a single int32 or int64 in record %s of item %s, got %s bytes"
+                                     % (j, i, s1))
+                fread(&s2, INT32_SIZE, 1, self.cfile)
+
+                if s1 != s2:
+                    raise IOError('Sizes do not agree in the header and footer for '
+                                  'this record - check header dtype. Got %s and %s' % (s1, s2))
+
+        return offsets, values
+
     cpdef INT64_t tell(self) except -1:
         """Return current stream position."""
         cdef INT64_t pos
@@ -21,6 +21,40 @@ from .. import family, units
 from . import geometry_selection
 
 
+def _has_usable_kdtree(sim):
+    """Returns True if a KDTree is available for *sim*, either built for it directly or for its ancestor"""
+    return hasattr(sim, "kdtree") or hasattr(sim.ancestor, "kdtree")
+
+
+def _particles_in_sphere_from_kdtree(sim, cen, radius):
+    """Return the sorted indices of particles in *sim* within the given sphere, using a KDTree.
+
+    If *sim* does not have its own tree, the tree of its ancestor is searched and the results restricted to the
+    particles in *sim*, which avoids building a new tree for every subview."""
+    if hasattr(sim, "kdtree"):
+        return np.sort(sim.kdtree.particles_in_sphere(cen, radius))
+
+    ancestor = sim.ancestor
+    in_ancestor = ancestor.kdtree.particles_in_sphere(cen, radius)
+    index_list = sim.get_index_list(ancestor)
+
+    if len(index_list) > 1 and (np.diff(index_list) < 0).any():
+        order = np.argsort(index_list)
+        index_list = index_list[order]
+    else:
+        order = None
+
+    offsets = np.searchsorted(index_list, in_ancestor)
+    found = offsets < len(index_list)
+    found[found] = index_list[offsets[found]] == in_ancestor[found]
+    offsets = offsets[found]
+
+    if order is not None:
+        offsets = order[offsets]
+
+    return np.sort(offsets)
+
+
 class Filter:
 
     def __init__(self):
@@ -198,7 +232,7 @@ class Sphere(Filter):
 
         wrap = self._get_wrap_in_position_units(sim)
 
-        return geometry_selection.selection(np.asarray(pos),'sphere',(cen[0], cen[1], cen[2], radius), wrap)
+        return geometry_selection.selection(np.ascontiguousarray(pos),'sphere',(cen[0], cen[1], cen[2], radius), wrap)
 
     def _get_cen_and_radius_as_float(self, pos):
         radius = self.radius
@@ -211,9 +245,9 @@ class Sphere(Filter):
         return cen, radius
 
     def where(self, sim):
-        if hasattr(sim, "kdtree"):
+        if _has_usable_kdtree(sim):
             cen, radius = self._get_cen_and_radius_as_float(sim["pos"])
-            return (np.sort(sim.kdtree.particles_in_sphere(cen, radius)),)
+            return (_particles_in_sphere_from_kdtree(sim, cen, radius),)
         else:
             return super().where(sim)
 
@@ -266,7 +300,7 @@ class Cuboid(Filter):
 
     def _get_mask(self, pos, boundaries, wrap):
         x1, y1, z1, x2, y2, z2 = boundaries
-        return geometry_selection.selection(pos, 'cube', (x1, y1, z1, x2, y2, z2), wrap).view(dtype=bool)
+        return geometry_selection.selection(np.ascontiguousarray(pos), 'cube', (x1, y1, z1, x2, y2, z2), wrap).view(dtype=bool)
 
     def _get_boundaries(self, sim, wrap=None):
         if wrap is None:
@@ -293,16 +327,16 @@ class Cuboid(Filter):
 
     def where(self, sim):
 
-        if hasattr(sim, "kdtree"):
+        if _has_usable_kdtree(sim):
             # KDTree doesn't currently natively find cuboid regions, so we get the bounding sphere
             # and the search for the cuboid within that
             cuboid_boundaries = self._get_boundaries(sim)
             cen, radius = self._get_bounding_sphere(cuboid_boundaries)
-            in_sphere_particles = sim.kdtree.particles_in_sphere(cen, radius)
+            in_sphere_particles = _particles_in_sphere_from_kdtree(sim, cen, radius)
             pos = sim["pos"][in_sphere_particles]
             wrap = self._get_wrap_in_position_units(sim)
             mask = self._get_mask(pos, cuboid_boundaries, wrap)
-            return np.sort(in_sphere_particles[mask]),
+            return in_sphere_particles[mask],
         else:
             return super().where(sim)
 
@@ -21,6 +21,7 @@ from __future__ import annotations
 
 import copy
 import logging
+import os
 import warnings
 import weakref
 from typing import TYPE_CHECKING, Iterable
@@ -28,7 +29,8 @@ from typing import TYPE_CHECKING, Iterable
 import numpy as np
 from numpy.typing import NDArray
 
-from .. import iter_subclasses, snapshot, util
+from .. import _util, array, config, iter_subclasses, snapshot, util
+from .details.halo_cache import HaloCache
 from .details.iord_mapping import make_iord_to_offset_mapper
 from .details.number_mapping import MonotonicHaloNumberMapper, create_halo_number_mapper
 from .details.particle_indices import HaloParticleIndices
@@ -51,6 +53,10 @@ class Halo(snapshot.subsnap.IndexedSubSnap):
 
     """
     Generic class representing a halo.
+
+    A halo is a view onto its particles in the base snapshot, so it shares arrays with that snapshot. As a result,
+    the first access to an array that is not yet in memory loads it for the whole base snapshot. To read only the
+    halo's own particles from disk, use :meth:`HaloCatalogue.load_copy` instead.
     """
 
     def __init__(self, halo_number, properties, halo_catalogue, *args, **kwa):
@@ -142,13 +148,41 @@ class HaloCatalogue(snapshot.util.ContainerWithPhysicalUnitsOption,
     the same as particle IDs or 'iord's which are the particle IDs stored in the simulation file. To aid converting
     between iords/IDs (which are used by many halo finder outputs) and pynbody's particle indices, call
     _init_iord_to_fpos, which creates a mapper as _iord_to_fpos. See details/iord_mapping.py for more information.
+
+    Halos returned by h[i] are views onto the base snapshot, so arrays accessed through them are loaded for the
+    whole snapshot. Pipelines that process many halos without ever loading the full snapshot should instead use
+    load_copy, which reads only the halo's particles from disk where the snapshot format supports it.
     """
 
     def __init__(self, sim, number_mapper):
         self._base: weakref[snapshot.SimSnap] = weakref.ref(sim)
         self.number_mapper: MonotonicHaloNumberMapper = number_mapper
         self._index_lists: HaloParticleIndices | None = None
-        self._cached_halos: dict[int, Halo] = {}
+        self._cached_halos: HaloCache = self._make_halo_cache()
+        self._group_array: np.ndarray | None = None
+        self._group_array_sidecar: str | None = None
+
+    @staticmethod
+    def _make_halo_cache() -> HaloCache:
+        max_halos = config['halo-cache']['max-halos']
+        max_size_mb = config['halo-cache']['max-size-mb']
+        return HaloCache(max_halos=None if max_halos < 0 else max_halos,
+                         max_bytes=None if max_size_mb < 0 else int(max_size_mb * 1024 ** 2))
+
+    def set_halo_cache_limits(self, max_halos=None, max_size_mb=None):
+        """Set the limits on the number of halos, and total size of their index arrays, that are kept alive
+
+        Halos beyond these limits are discarded in least-recently-used order. Pass None for no limit. The
+        hit and miss counts of the cache are available as the ``hits`` and ``misses`` attributes of
+        ``halo_cache``."""
+        self._cached_halos.max_halos = max_halos
+        self._cached_halos.max_bytes = None if max_size_mb is None else int(max_size_mb * 1024 ** 2)
+        self._cached_halos._evict()
+
+    @property
+    def halo_cache(self) -> HaloCache:
+        """The cache of recently accessed Halo objects"""
+        return self._cached_halos
 
     def load_all(self):
         """Loads all halos, which is normally more efficient if a large fraction of them will be accessed."""
@@ -194,6 +228,132 @@ class HaloCatalogue(snapshot.util.ContainerWithPhysicalUnitsOption,
         .number_mapper object; or access individual property dictionaries by halo number using get_properties_one_halo."""
         return {}
 
+    _reduction_ops = ('sum', 'mean', 'std', 'min', 'max')
+
+    # Shorthand names accepted by compute_properties, mapping to (array name, operation, weight)
+    _standard_properties = {
+        'mass': ('mass', 'sum', None),
+        'com': ('pos', 'mean', 'mass'),
+        'com_vel': ('vel', 'mean', 'mass'),
+    }
+
+    def reduce(self, array_name, op='sum', weight=None, family=None) -> array.SimArray:
+        """Reduce a particle array over every halo at once, returning one value per halo
+
+        The result is ordered by halo index, i.e. aligned with ``number_mapper``, and carries units. For example,
+        ``h.reduce('mass')`` gives the mass of every halo, and ``h.reduce('pos', 'mean', weight='mass')`` the centre
+        of mass of every halo. This is much faster than iterating over halos.
+
+        Parameters
+        ----------
+        array_name : str
+            The name of the array to reduce. Multi-dimensional arrays are reduced column by column.
+        op : str
+            One of 'sum', 'mean', 'std' (standard deviation), 'min' or 'max'.
+        weight : str, optional
+            The name of an array to weight by. For 'sum', the weighted sum is returned.
+        family : pynbody.family.Family, optional
+            If specified, only particles of this family contribute.
+        """
+        return self._reductions_from_moments(self._get_halo_moments(array_name, weight, family),
+                                             array_name, op, weight, family)
+
+    def compute_properties(self, properties, family=None) -> dict:
+        """Compute several properties for every halo at once, returning a dictionary of arrays aligned with
+        ``number_mapper``
+
+        Each item in *properties* is either one of the names 'mass', 'com' (centre of mass) or 'com_vel' (centre of
+        mass velocity), or a tuple (array_name, op) or (array_name, op, weight) as accepted by :meth:`reduce`, in
+        which case the key in the returned dictionary is ``array_name + "_" + op``. Properties requiring the same
+        array and weight share a single pass over the particles."""
+        results = {}
+        moments = {}
+        for prop in properties:
+            if isinstance(prop, str):
+                key = prop
+                array_name, op, weight = self._standard_properties[prop]
+            else:
+                array_name, op, weight = (tuple(prop) + (None,))[:3]
+                key = array_name + "_" + op
+            if (array_name, weight) not in moments:
+                moments[(array_name, weight)] = self._get_halo_moments(array_name, weight, family)
+            results[key] = self._reductions_from_moments(moments[(array_name, weight)], array_name, op, weight,
+                                                         family)
+        return results
+
+    def _get_reduction_indices(self, family):
+        index_lists = self._get_all_particle_indices_cached()
+        indices = np.asarray(index_lists.particle_index_list)
+        boundaries = np.asarray(index_lists.particle_index_list_boundaries)
+
+        if family is not None:
+            fam_slice = self.base._get_family_slice(family)
+            in_family = (indices >= fam_slice.start) & (indices < fam_slice.stop)
+            num_in_family_before = np.concatenate(([0], np.cumsum(in_family)))
+            boundaries = num_in_family_before[boundaries]
+            indices = indices[in_family] - fam_slice.start
+
+        if indices.dtype not in (np.int32, np.int64):
+            indices = indices.astype(np.int64)
+        if boundaries.dtype not in (np.int32, np.int64):
+            boundaries = boundaries.astype(np.int64)
+        return indices, boundaries
+
+    def _get_halo_moments(self, array_name, weight, family):
+        """Return a list, with one entry per column of the named array, of the moments over each halo"""
+        sim = self.base if family is None else self.base[family]
+        indices, boundaries = self._get_reduction_indices(family)
+
+        values = sim[array_name].view(np.ndarray)
+        if weight is None:
+            weights = np.empty(0)
+        else:
+            weights = self._as_float_array(sim[weight].view(np.ndarray))
+
+        if values.ndim == 1:
+            columns = [values]
+        else:
+            columns = [values[:, i] for i in range(values.shape[1])]
+
+        return [_util.segmented_moments(self._as_float_array(column), weights, indices, boundaries)
+                for column in columns]
+
+    @staticmethod
+    def _as_float_array(ar):
+        if ar.dtype in (np.float32, np.float64):
+            return ar
+        else:
+            return ar.astype(np.float64)
+
+    def _reductions_from_moments(self, moments, array_name, op, weight, family):
+        if op not in self._reduction_ops:
+            raise ValueError(f"Unknown reduction {op!r}; must be one of {self._reduction_ops}")
+
+        columns = []
+        for sum_w, sum_wx, sum_wx2, min_x, max_x in moments:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                if op == 'sum':
+                    columns.append(sum_wx)
+                elif op == 'mean':
+                    columns.append(sum_wx / sum_w)
+                elif op == 'std':
+                    mean = sum_wx / sum_w
+                    columns.append(np.sqrt(np.maximum(sum_wx2 / sum_w - mean ** 2, 0)))
+                elif op == 'min':
+                    columns.append(min_x)
+                else:
+                    columns.append(max_x)
+
+        result = array.SimArray(columns[0] if len(columns) == 1 else np.stack(columns, axis=1))
+
+        sim = self.base if family is None else self.base[family]
+        result_units = sim[array_name].units
+        if op == 'sum' and weight is not None:
+            result_units = result_units * sim[weight].units
+        result.units = result_units
+        result.sim = self.base
+        return result
+
     def _get_particle_indices_one_halo(self, halo_number) -> NDArray[int]:
         """Get the index list for a single halo, given a halo_number.
 
@@ -217,9 +377,7 @@ class HaloCatalogue(snapshot.util.ContainerWithPhysicalUnitsOption,
             # if not, the default implementation will populate _cached_index_lists
 
     def _get_halo_cached(self, halo_number) -> Halo:
-        if halo_number not in self._cached_halos:
-            self._cached_halos[halo_number] = self._get_halo(halo_number)
-        return self._cached_halos[halo_number]
+        return self._cached_halos.get(halo_number, self._get_halo)
 
     def _get_halo(self, halo_number) -> Halo:
         return Halo(halo_number, self.get_properties_one_halo(halo_number), self, self.base,
@@ -288,20 +446,73 @@ class HaloCatalogue(snapshot.util.ContainerWithPhysicalUnitsOption,
         """Return an array with an integer for each particle in the simulation
         indicating which halo that particle is associated with. If there are multiple
         levels (i.e. subhalos), the number returned corresponds to the lowest level, i.e.
-        the smallest subhalo."""
-        self.load_all()
-        number_per_particle = self._index_lists.get_halo_number_per_particle(len(self.base), self.number_mapper)
+        the smallest subhalo.
+
+        The array is calculated once and then cached by the catalogue, so it is returned read-only. It is stored
+        as 32-bit integers if the halo numbers allow. To keep the array between sessions, see
+        :meth:`set_group_array_sidecar`."""
+        if self._group_array is None:
+            self._group_array = self._load_or_calculate_group_array()
+            self._group_array.flags.writeable = False
         if family is not None:
-            return number_per_particle[self.base._get_family_slice(family)]
+            return self._group_array[self.base._get_family_slice(family)]
+        else:
+            return self._group_array
+
+    def set_group_array_sidecar(self, filename):
+        """Store the group array in the specified .npy file, or read it from there if it already exists
+
+        The file is not checked for consistency with the catalogue beyond its length, so it must be deleted if the
+        halo catalogue changes. Pass None to stop using a sidecar file."""
+        self._group_array_sidecar = None if filename is None else str(filename)
+        self._group_array = None
+
+    def _load_or_calculate_group_array(self):
+        sidecar = self._group_array_sidecar
+        if sidecar is not None and os.path.exists(sidecar):
+            group_array = np.load(sidecar, mmap_mode='r')
+            if len(group_array) == len(self.base):
+                return group_array
+            logger.warning("Group array in %s does not match the length of the simulation; recalculating", sidecar)
+
+        group_array = self._calculate_group_array()
+
+        if sidecar is not None:
+            np.save(sidecar, group_array)
+        return group_array
+
+    def _calculate_group_array(self):
+        self.load_all()
+        return self._index_lists.get_halo_number_per_particle(len(self.base), self.number_mapper,
+                                                             dtype=self._group_array_dtype())
+
+    def _group_array_dtype(self):
+        """Return the smallest integer type that can hold all halo numbers and the -1 used for unassigned
+        particles, from the types supported by the bridge matching code"""
+        if len(self.number_mapper) == 0:
+            return np.int32
+        halo_numbers = np.asarray(self.number_mapper.all_numbers)
+        int32_info = np.iinfo(np.int32)
+        if halo_numbers.min() >= int32_info.min and halo_numbers.max() <= int32_info.max:
+            return np.int32
         else:
-            return number_per_particle
+            return np.int64
 
     def load_copy(self, halo_number):
         """Load a fresh SimSnap with only the particles in specified halo
 
-        This relies on the underlying SimSnap being capable of partial loading."""
+        Unlike a Halo, whose arrays are loaded for the whole of the base snapshot when first accessed, arrays in
+        the copy are read from disk only for the halo's own particles. This makes it suitable for pipelines that
+        process many halos in turn without ever loading the full snapshot. The halo properties are copied into
+        the returned snapshot's properties.
+
+        This relies on the underlying SimSnap being capable of partial loading with *take* (currently Tipsy,
+        GadgetHDF and SWIFT)."""
         from .. import load
-        return load(self.base.filename, take=self._get_particle_indices_one_halo_using_list_if_available(halo_number))
+        f = load(self.base.filename, take=self._get_particle_indices_one_halo_using_list_if_available(halo_number))
+        f.properties.update(self.get_properties_one_halo(halo_number))
+        f.properties['halo_number'] = halo_number
+        return f
 
     def physical_units(self, distance='kpc', velocity='km s^-1', mass='Msol', persistent=True, convert_parent=False):
         """
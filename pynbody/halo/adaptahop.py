@@ -4,12 +4,17 @@ from typing import Sequence
 
 import numpy as np
 
-from .. import array, units
+from .. import array, config, config_parser, units, util
 from ..extern.cython_fortran_utils import FortranFile
 from . import HaloCatalogue, logger
 from .details import iord_mapping, number_mapping
 from .details.particle_indices import HaloParticleIndices
 
+_cache_offsets = config_parser.getboolean('AdaptaHOPCatalogue', 'CacheOffsets')
+
+# maximum number of bytes read from the brick file at once by each thread when loading all halos
+_max_block_bytes = 64 * 1024 ** 2
+
 unit_length = units.Unit("Mpc")
 unit_vel = units.Unit("km s**-1")
 unit_mass = 1e11 * units.Unit("Msol")
@@ -167,6 +172,9 @@ class BaseAdaptaHOPCatalogue(HaloCatalogue):
     def _get_halo_numbers_and_file_offsets(self):
         """
         Compute the offset in the brick file of each halo.
+
+        The brick file is scanned in compiled code. If CacheOffsets is set in the [AdaptaHOPCatalogue] section of
+        the configuration, the result is saved alongside the brick file and reused next time.
         """
 
         with FortranFile(self._fname) as fpu:
@@ -175,47 +183,146 @@ class BaseAdaptaHOPCatalogue(HaloCatalogue):
             nhalos = self._headers["nhalos"]
             nsubs = self._headers["nsubs"]
 
-            self._halo_numbers = np.empty(nhalos + nsubs, dtype=int)
-            self._file_offsets = np.empty(nhalos + nsubs, dtype=self._length_type)
-            self._npart = np.empty(nhalos + nsubs, dtype=self._length_type)
+            index = self._load_offset_index(nhalos + nsubs)
 
-            Nskip = len(self._halo_attributes)
-            if self._read_contamination:
-                Nskip += len(self._halo_attributes_contam)
+            if index is None:
+                Nskip = len(self._halo_attributes)
+                if self._read_contamination:
+                    Nskip += len(self._halo_attributes_contam)
 
-            for i in range(nhalos + nsubs):
-                self._file_offsets[i] = fpu.tell()
-                if self._longint:
-                    npart = fpu.read_int64()
-                else:
-                    npart = fpu.read_int()
-                self._npart[i] = npart
-                fpu.skip(1)  # skip over fortran field with ids of parts
-                self._halo_numbers[i] = fpu.read_int()
-                fpu.skip(Nskip) # skip over attributes
+                # each halo consists of the number of particles, their ids, the halo id, then the attributes
+                file_offsets, values = fpu.scan_records(nhalos + nsubs, 3 + Nskip, [0, 2])
+                index = file_offsets, values[:, 0], values[:, 1]
+                self._save_offset_index(*index)
 
-    def _get_all_particle_indices(self):
-        particle_ids = np.empty(self._npart.sum(), dtype=self._length_type)
-        particle_slices = np.empty((len(self), 2), dtype=self._length_type)
-        start = 0
+        file_offsets, npart, halo_numbers = index
+        self._file_offsets = np.asarray(file_offsets, dtype=np.int64)
+        self._npart = np.asarray(npart, dtype=self._length_type)
+        self._halo_numbers = np.asarray(halo_numbers, dtype=int)
 
-        with FortranFile(self._fname) as fpu:
-            for i in range(len(self)):
-                fpu.seek(self._file_offsets[i])
-                if self._longint:
-                    npart = fpu.read_int64()
-                else:
-                    npart = fpu.read_int()
+    def _offset_index_filename(self):
+        if not _cache_offsets:
+            return None
+        return self._fname + ".offsets.npz"
+
+    def _offset_index_validation(self):
+        """Return values that must match between a saved offset index and the brick file for it to be reused"""
+        stat = os.stat(self._fname)
+        return {'file_size': stat.st_size, 'file_mtime': stat.st_mtime,
+                'longint': self._longint, 'read_contamination': self._read_contamination}
+
+    def _load_offset_index(self, nhalos):
+        filename = self._offset_index_filename()
+        if filename is None or not os.path.exists(filename):
+            return None
 
-                stop = start+npart
-                particle_ids[start:stop] = self._iord_to_fpos.map_ignoring_order(self._read_member_helper(fpu, npart))
-                particle_slices[i] = [start, stop]
-                start = stop
+        try:
+            with np.load(filename) as data:
+                for k, v in self._offset_index_validation().items():
+                    if data[k] != v:
+                        logger.debug("AdaptaHOP offset index %s is out of date", filename)
+                        return None
+                if len(data['file_offsets']) != nhalos:
+                    return None
+                return data['file_offsets'], data['npart'], data['halo_numbers']
+        except (OSError, ValueError, KeyError):
+            logger.warning("Unable to read AdaptaHOP offset index from %s; regenerating it", filename)
+            return None
+
+    def _save_offset_index(self, file_offsets, npart, halo_numbers):
+        filename = self._offset_index_filename()
+        if filename is None:
+            return
+
+        try:
+            tmp_filename = filename + ".tmp.npz"
+            np.savez(tmp_filename, file_offsets=file_offsets, npart=npart, halo_numbers=halo_numbers,
+                     **self._offset_index_validation())
+            os.replace(tmp_filename, filename)
+        except OSError:
+            logger.warning("Unable to save AdaptaHOP offset index to %s", filename)
+
+    def _get_all_particle_indices(self):
+        npart = self._npart.astype(np.int64)
+        boundaries = np.concatenate(([0], np.cumsum(npart)))
+        if len(self) == 0:
+            return HaloParticleIndices(np.empty(0, dtype=np.int64), np.empty((0, 2), dtype=np.int64))
+
+        itemsize = self._get_member_itemsize()
+        npart_record_size = 8 if self._longint else 4
+
+        # the member ids of each halo follow its particle count record and their own record header
+        payload_starts = self._file_offsets + (npart_record_size + 8) + 4
+        iords = np.empty(boundaries[-1], dtype=np.int32 if itemsize == 4 else np.int64)
+
+        num_threads = max(min(config['number_of_threads'], len(self)), 1)
+        thread_ranges = np.linspace(0, len(self), num_threads + 1).astype(np.int64)
+        util.thread_map(self._read_members_for_halo_range, thread_ranges[:-1], thread_ranges[1:],
+                        [payload_starts] * num_threads, [itemsize] * num_threads, [iords] * num_threads,
+                        [boundaries] * num_threads)
+
+        if isinstance(self._iord_to_fpos, iord_mapping.IordToOffsetDense):
+            particle_ids = self._iord_to_fpos.map_ignoring_order(iords)
+        else:
+            # the sparse mapper only preserves the order of sorted input
+            iord_order = np.argsort(iords)
+            particle_ids = np.empty(len(iords), dtype=np.int64)
+            particle_ids[iord_order] = self._iord_to_fpos.map_ignoring_order(iords[iord_order])
 
-        assert stop == len(particle_ids)
         assert (particle_ids < len(self.base)).all()
 
-        return HaloParticleIndices(particle_ids, particle_slices)
+        return HaloParticleIndices(particle_ids, np.vstack((boundaries[:-1], boundaries[1:])).T)
+
+    def _get_member_itemsize(self):
+        """Return the size in bytes of each particle id in the member lists, detecting it from the first
+        non-empty halo"""
+        nonempty = np.where(self._npart > 0)[0]
+        if len(nonempty) == 0:
+            return 4
+        index = nonempty[0]
+        with FortranFile(self._fname) as fpu:
+            fpu.seek(self._file_offsets[index])
+            fpu.skip(1)
+            self._read_member_helper(fpu, self._npart[index])
+        return np.dtype(self.base._iord_dtype).itemsize
+
+    def _read_members_for_halo_range(self, start, stop, payload_starts, itemsize, iords, boundaries):
+        """Read the member ids for halos start to stop-1 into iords, in blocks of contiguous halos"""
+        npart = np.diff(boundaries)
+        payload_nbytes = npart * itemsize
+        words_per_id = itemsize // 4
+
+        with open(self._fname, 'rb') as f:
+            while start < stop:
+                block_start = self._file_offsets[start]
+                block_stop = np.searchsorted(payload_starts[start:stop] + payload_nbytes[start:stop],
+                                             block_start + _max_block_bytes, side='right') + start
+                block_stop = max(block_stop, start + 1)
+                block_nbytes = payload_starts[block_stop - 1] + payload_nbytes[block_stop - 1] - block_start
+
+                words = np.empty((block_nbytes + 3) // 4, dtype=np.int32)
+                f.seek(block_start)
+                if f.readinto(memoryview(words).cast('B')[:block_nbytes]) != block_nbytes:
+                    raise OSError("Unexpected end of AdaptaHOP brick file")
+
+                # all records in the brick file are made of 4- or 8-byte values, so are aligned to 4 bytes
+                payload_byte_starts = payload_starts[start:block_stop] - block_start
+                payload_word_starts = payload_byte_starts // 4
+                if (payload_byte_starts % 4 != 0).any() or \
+                        (words[payload_word_starts - 1] != payload_nbytes[start:block_stop]).any():
+                    raise RuntimeError("Could not read iord!")
+
+                block_npart = npart[start:block_stop]
+                within_halo = np.arange(block_npart.sum()) - np.repeat(boundaries[start:block_stop] - boundaries[start],
+                                                                       block_npart)
+                word_index = np.repeat(payload_word_starts, block_npart) + within_halo * words_per_id
+                if words_per_id == 1:
+                    values = words[word_index]
+                else:
+                    values = np.stack((words[word_index], words[word_index + 1]), axis=1).view(np.int64).ravel()
+
+                iords[boundaries[start]:boundaries[block_stop]] = values
+                start = block_stop
 
     def _get_particle_indices_one_halo(self, halo_number):
         halo_index = self.number_mapper.number_to_index(halo_number)
@@ -6,14 +6,17 @@ import warnings
 
 import numpy as np
 
-from .. import snapshot, util
+from .. import config_parser, snapshot, util
 from . import HaloCatalogue, HaloParticleIndices, logger
+from .details.iord_mapping import IordToOffsetSparse
 from .details.number_mapping import (
     NonMonotonicHaloNumberMapper,
     SimpleHaloNumberMapper,
     create_halo_number_mapper,
 )
 
+_binary_sidecar_default = config_parser.getboolean('AHFCatalogue', 'BinarySidecar')
+
 
 class AHFCatalogue(HaloCatalogue):
 
@@ -23,7 +26,7 @@ class AHFCatalogue(HaloCatalogue):
 
     def __init__(self, sim, make_grp=None, get_all_parts=None, use_iord=None, ahf_basename=None,
                  dosort=None, only_stat=None, write_fpos=True, halo_numbers='file-order',
-                 ignore_missing_substructure=True,
+                 ignore_missing_substructure=True, binary_sidecar=None,
                  **kwargs):
         """Initialize an AHFCatalogue.
 
@@ -54,6 +57,12 @@ class AHFCatalogue(HaloCatalogue):
                             raise an exception if the substructure file is
                             missing or corrupt. If False, it will raise an exception.
 
+        *binary_sidecar*: if True, the AHF_particles and AHF_halos files are converted once into a binary
+                          form (AHF_members.npy and AHF_index.npz alongside them), which is memory-mapped
+                          on subsequent loads instead of parsing the text. The binary files are regenerated
+                          whenever the text files change. If None, the behaviour is determined by the
+                          BinarySidecar option in the [AHFCatalogue] section of the configuration.
+
         Deprecated kwargs:
 
         *make_grp*: if True a 'grp' array is created in the underlying
@@ -85,6 +94,7 @@ class AHFCatalogue(HaloCatalogue):
         self._use_iord = use_iord
         self._only_stat = only_stat
         self._try_writing_fpos = write_fpos
+        self._use_binary_sidecar = _binary_sidecar_default if binary_sidecar is None else binary_sidecar
 
         if only_stat:
             warnings.warn(DeprecationWarning("only_stat keyword is deprecated; instead, use the catalogue's get_dummy_halo method"))
@@ -97,7 +107,8 @@ class AHFCatalogue(HaloCatalogue):
         self._determine_format_revision_from_filename()
 
         logger.info("AHFCatalogue loading halo properties")
-        self._load_ahf_halo_properties(self._ahfBasename + 'halos')
+        if not (self._use_binary_sidecar and self._load_binary_sidecar()):
+            self._load_ahf_halo_properties(self._ahfBasename + 'halos')
 
         if dosort:
             warnings.warn(DeprecationWarning("dosort keyword is deprecated; instead pass halo_numbers='length-order-v1'"))
@@ -298,15 +309,138 @@ class AHFCatalogue(HaloCatalogue):
             data[np.where(g_mask)] -= ns
         return data
 
+    def _binary_sidecar_filenames(self):
+        return self._ahfBasename + 'members.npy', self._ahfBasename + 'index.npz'
+
+    def _text_file_validation(self):
+        """Return the sizes and modification times of the AHF text files, which must match those recorded in
+        a binary sidecar for it to be used"""
+        validation = {}
+        for extension in 'halos', 'particles':
+            filename = self._ahfBasename + extension
+            if not os.path.exists(filename):
+                filename += '.gz'
+            stat = os.stat(filename)
+            validation[extension + '_size'] = stat.st_size
+            validation[extension + '_mtime'] = stat.st_mtime
+        return validation
+
+    def _load_binary_sidecar(self):
+        """Load the halo properties and memory-map the member array from the binary sidecar, if it is up to date.
+
+        Returns True if successful."""
+        members_filename, index_filename = self._binary_sidecar_filenames()
+        if not (os.path.exists(members_filename) and os.path.exists(index_filename)):
+            return False
+
+        try:
+            with np.load(index_filename) as index:
+                for k, v in self._text_file_validation().items():
+                    if index[k] != v:
+                        logger.info("AHF binary sidecar %s is out of date", index_filename)
+                        return False
+                offsets = index['offsets']
+                property_table = index['properties']
+            members = np.load(members_filename, mmap_mode='r')
+        except (OSError, ValueError, KeyError):
+            logger.warning("Unable to read AHF binary sidecar %s; regenerating it", index_filename)
+            return False
+
+        if len(offsets) != len(property_table) + 1 or offsets[-1] != len(members):
+            logger.warning("AHF binary sidecar %s is inconsistent; regenerating it", index_filename)
+            return False
+
+        self._set_halo_properties_from_table(property_table)
+        self._sidecar_members = members
+        self._sidecar_offsets = offsets
+        return True
+
+    def _set_halo_properties_from_table(self, property_table):
+        self._halo_property_table = property_table
+        self._num_halos = len(property_table)
+        # copies, since some properties are subsequently remapped in place
+        self._halo_properties = {k: np.array(property_table[k]) for k in property_table.dtype.names}
+
+    def _get_sidecar_members(self):
+        """Return the AHF particle IDs of all halos as a flat array, and the offsets of each halo within it,
+        converting the AHF_particles file to the binary sidecar if necessary"""
+        if not hasattr(self, '_sidecar_members'):
+            self._convert_particles_to_binary()
+        return self._sidecar_members, self._sidecar_offsets
+
+    def _convert_particles_to_binary(self):
+        logger.info("AHFCatalogue converting particles file to binary")
+        with util.open_(self._ahfBasename + 'particles', 'rt') as f:
+            # the first value on each line is either the number of halos, a number of particles in a halo, or a
+            # particle ID
+            values = np.loadtxt(f, usecols=0, dtype=np.int64, ndmin=1)
+
+        npart = np.asarray(self._halo_properties['npart'], dtype=np.int64)
+        assert values[0] == len(npart)
+
+        offsets = np.concatenate(([0], np.cumsum(npart)))
+        header_positions = 1 + np.arange(len(npart)) + offsets[:-1]
+        assert (values[header_positions] == npart).all()
+        assert len(values) == 1 + len(npart) + offsets[-1]
+
+        is_member = np.ones(len(values), dtype=bool)
+        is_member[0] = False
+        is_member[header_positions] = False
+
+        self._sidecar_members = values[is_member]
+        self._sidecar_offsets = offsets
+        self._write_binary_sidecar()
+
+    def _write_binary_sidecar(self):
+        members_filename, index_filename = self._binary_sidecar_filenames()
+        try:
+            # the index is written last, so that its presence implies the member array is complete
+            tmp_filename = members_filename + ".tmp.npy"
+            np.save(tmp_filename, self._sidecar_members)
+            os.replace(tmp_filename, members_filename)
+
+            tmp_filename = index_filename + ".tmp.npz"
+            np.savez(tmp_filename, offsets=self._sidecar_offsets, properties=self._halo_property_table,
+                     **self._text_file_validation())
+            os.replace(tmp_filename, index_filename)
+        except OSError:
+            logger.warning("Unable to write AHF binary sidecar %s", index_filename)
+
+    def _sidecar_members_to_particle_indices(self, members, offsets):
+        """Convert AHF particle IDs for one or more consecutive halos into pynbody particle indices, sorted
+        within each halo"""
+        data = np.array(members, dtype=int)
+        if self._is_new_format:
+            if self._use_iord and isinstance(self._iord_to_fpos, IordToOffsetSparse):
+                # the sparse mapper only preserves the order of sorted input
+                order = np.argsort(data)
+                data[order] = self._ahf_to_pynbody_particle_ids(data[order])
+            else:
+                data = self._ahf_to_pynbody_particle_ids(data)
+
+        halo_index = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        return data[np.lexsort((data, halo_index))]
+
     def _get_particle_indices_one_halo(self, halo_number):
-        fpos = self._get_file_positions()
         file_index = self.number_mapper.number_to_index(halo_number)
+        if self._use_binary_sidecar:
+            members, offsets = self._get_sidecar_members()
+            start, stop = offsets[file_index], offsets[file_index + 1]
+            return self._sidecar_members_to_particle_indices(members[start:stop], [0, stop - start])
+
+        fpos = self._get_file_positions()
         with util.open_(self._ahfBasename + 'particles') as f:
             f.seek(fpos[file_index],0)
             ids = self._load_ahf_particle_block(f, nparts=self._halo_properties['npart'][file_index])
         return ids
 
     def _get_all_particle_indices(self):
+        if self._use_binary_sidecar:
+            members, offsets = self._get_sidecar_members()
+            particle_ids = self._sidecar_members_to_particle_indices(members, offsets)
+            return HaloParticleIndices(particle_ids=particle_ids,
+                                       boundaries=np.vstack((offsets[:-1], offsets[1:])).T)
+
         boundaries = np.cumsum(np.concatenate(([0], self._halo_properties['npart'])))
         boundaries = np.vstack((boundaries[:-1], boundaries[1:])).T
         particle_ids = np.empty(boundaries[-1,1], dtype=int)
@@ -367,6 +501,17 @@ class AHFCatalogue(HaloCatalogue):
         for key in keys:
             self._halo_properties[key] = np.array(self._halo_properties[key])
 
+        if self._use_binary_sidecar:
+            self._set_halo_properties_from_table(self._make_property_table(self._halo_properties))
+
+    @staticmethod
+    def _make_property_table(halo_properties):
+        property_table = np.empty(len(next(iter(halo_properties.values()), [])),
+                                  dtype=[(k, v.dtype) for k, v in halo_properties.items()])
+        for k, v in halo_properties.items():
+            property_table[k] = v
+        return property_table
+
     def _load_ahf_substructure(self, filename):
         with util.open_(filename) as f:
             lines = f.readlines()
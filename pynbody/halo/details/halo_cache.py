@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import collections
+from typing import Callable, Iterator
+
+import numpy as np
+
+
+class HaloCache:
+    """A least-recently-used cache of Halo objects, bounded by number and by the size of their index arrays.
+
+    Each halo holds index arrays into the base snapshot (and possibly further family-level arrays), so keeping
+    every halo ever accessed alive makes iterating over a large catalogue run out of memory. This cache evicts the
+    least recently used halos once either limit is exceeded. A limit of None means no limit.
+    """
+
+    def __init__(self, max_halos: int | None = None, max_bytes: int | None = None):
+        self.max_halos = max_halos
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._halos: collections.OrderedDict = collections.OrderedDict()
+        self._sizes: dict = {}
+
+    def get(self, halo_number, factory: Callable):
+        """Return the cached halo with the given number, calling *factory(halo_number)* to create it if needed"""
+        try:
+            halo = self._halos[halo_number]
+        except KeyError:
+            self.misses += 1
+            halo = factory(halo_number)
+            self._insert(halo_number, halo)
+        else:
+            self.hits += 1
+            self._halos.move_to_end(halo_number)
+        return halo
+
+    def _insert(self, halo_number, halo):
+        size = self._index_nbytes(halo)
+        self._halos[halo_number] = halo
+        self._sizes[halo_number] = size
+        self.nbytes += size
+        self._evict()
+
+    def _evict(self):
+        # the most recently inserted halo is always retained, even if it alone exceeds the limits
+        while len(self._halos) > 1 and self._over_limit():
+            halo_number, _ = self._halos.popitem(last=False)
+            self.nbytes -= self._sizes.pop(halo_number)
+
+    def _over_limit(self):
+        if self.max_halos is not None and len(self._halos) > self.max_halos:
+            return True
+        if self.max_bytes is not None and self.nbytes > self.max_bytes:
+            return True
+        return False
+
+    @staticmethod
+    def _index_nbytes(halo) -> int:
+        """Return the number of bytes held in the index arrays of a halo"""
+        nbytes = np.asarray(getattr(halo, '_slice', ())).nbytes
+        for indices in getattr(halo, '_family_indices', {}).values():
+            nbytes += np.asarray(indices).nbytes
+        return nbytes
+
+    def clear(self):
+        self._halos.clear()
+        self._sizes.clear()
+        self.nbytes = 0
+
+    def __contains__(self, halo_number) -> bool:
+        return halo_number in self._halos
+
+    def __len__(self) -> int:
+        return len(self._halos)
+
+    def values(self) -> Iterator:
+        return iter(list(self._halos.values()))
+
+    def __repr__(self):
+        return (f"<HaloCache of {len(self)} halos ({self.nbytes} bytes of indices); "
+                f"{self.hits} hits, {self.misses} misses>")
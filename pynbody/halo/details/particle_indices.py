@@ -3,6 +3,8 @@ from typing import Any
 import numpy as np
 from numpy import typing as npt
 
+from ... import _util
+
 
 class HaloParticleIndices:
     def __init__(self, particle_ids: npt.NDArray[int] = None, boundaries: np.ndarray[(Any, 2), int] = None):
@@ -33,19 +35,41 @@ class HaloParticleIndices:
     def get_halo_number_per_particle(self, sim_length, number_mapper, fill_value=-1, dtype=int):
         """Return an array of halo numbers, one per particle.
 
+        Where a particle belongs to more than one halo (e.g. a subhalo and its parent), the smallest halo wins.
+
         Requires a HaloNumberMapper to map halo indices to halo numbers"""
+        id_array = np.empty(sim_length, dtype=dtype)
+        id_array.fill(fill_value)
+
+        if len(self) == 0:
+            return id_array
+
         lengths = np.diff(self.particle_index_list_boundaries, axis=1).ravel()
         ordering = np.argsort(-lengths, kind='stable')
+        # writing the largest halos first means that smaller halos overwrite them
 
-        id_array = np.empty(sim_length, dtype=dtype)
-        id_array.fill(fill_value)
+        halo_numbers = np.asarray(number_mapper.index_to_number(ordering), dtype=np.int64)
+
+        indices = self._as_supported_int_array(self.particle_index_list)
+        boundaries = self._as_supported_int_array(self.particle_index_list_boundaries)
+        if len(indices) > 0 and (indices.min() < 0 or indices.max() >= sim_length):
+            raise IndexError("Halo particle indices are out of range for the simulation")
 
-        halo_numbers = number_mapper.index_to_number(ordering)
-        for halo_number, halo_index in zip(halo_numbers, ordering):
-            indexing_slice = self._get_index_slice_for_halo(halo_index)
-            id_array[self.particle_index_list[indexing_slice]] = halo_number
+        target = id_array if id_array.dtype in (np.int32, np.int64) else id_array.astype(np.int64)
+        _util.assign_segment_values(target, indices, boundaries, ordering.astype(np.int64), halo_numbers)
+
+        if target is not id_array:
+            id_array[:] = target
 
         return id_array
 
+    @staticmethod
+    def _as_supported_int_array(ar):
+        ar = np.asarray(ar)
+        if ar.dtype in (np.int32, np.int64):
+            return ar
+        else:
+            return ar.astype(np.int64)
+
     def __len__(self):
         return len(self.particle_index_list_boundaries)
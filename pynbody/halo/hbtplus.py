@@ -11,6 +11,22 @@ from . import HaloCatalogue, HaloParticleIndices
 from .details import number_mapping
 
 
+def _vlen_dataset_to_csr(dataset, dtype=None) -> tuple[NDArray[int], NDArray]:
+    """Read a variable-length HDF5 dataset in one go, returning (offsets, values) in compressed sparse row form
+
+    The entries for row i are values[offsets[i]:offsets[i+1]]."""
+    rows = dataset[:]
+    if dtype is None:
+        dtype = h5py.check_vlen_dtype(dataset.dtype) or np.int64
+    lengths = np.fromiter((len(r) for r in rows), dtype=np.int64, count=len(rows))
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    if len(rows) > 0:
+        values = np.concatenate(rows).astype(dtype, copy=False)
+    else:
+        values = np.empty(0, dtype=dtype)
+    return offsets, values
+
+
 class HBTPlusCatalogue(HaloCatalogue):
     def __init__(self, sim, halo_numbers=None, hbt_filename=None):
         """Initialize a HBTPlusCatalogue object.
@@ -31,6 +47,7 @@ class HBTPlusCatalogue(HaloCatalogue):
             hbt_filename = self._infer_hbt_filename(sim)
 
         self._file = h5py.File(hbt_filename, 'r')
+        self._subhalos = self._file["Subhalos"][:]
 
         num_halos = int(self._file["NumberOfSubhalosInAllFiles"][0])
         if int(self._file["NumberOfFiles"][0])>1:
@@ -39,9 +56,9 @@ class HBTPlusCatalogue(HaloCatalogue):
         if halo_numbers is None:
             number_mapper = number_mapping.SimpleHaloNumberMapper(0, num_halos)
         elif halo_numbers == 'track':
-            number_mapper = number_mapping.create_halo_number_mapper(self._file["Subhalos"]["TrackId"])
+            number_mapper = number_mapping.create_halo_number_mapper(self._subhalos["TrackId"])
         elif halo_numbers == 'length-order':
-            osort = np.argsort(-self._file["Subhalos"]["Nbound"][:])
+            osort = np.argsort(-self._subhalos["Nbound"])
             number_mapper = number_mapping.NonMonotonicHaloNumberMapper(osort, ordering=True, start_index=0)
         else:
             raise ValueError(f"Invalid value for halo_numbers: {halo_numbers}")
@@ -73,11 +90,13 @@ class HBTPlusCatalogue(HaloCatalogue):
 
 
     def _setup_parents(self):
+        self._children_offsets, self._children = _vlen_dataset_to_csr(self._file["NestedSubhalos"], np.intp)
+
         parents = np.empty(len(self), dtype=np.intp)
         parents.fill(-1)
-        for i in range(len(self)):
-            for child in self._file["NestedSubhalos"][i]:
-                parents[child] = self.number_mapper.index_to_number(i)
+        if len(self._children) > 0:
+            parent_index = np.repeat(np.arange(len(self)), np.diff(self._children_offsets))
+            parents[self._children] = self.number_mapper.index_to_number(parent_index)
 
         self._parents = parents
 
@@ -89,16 +108,18 @@ class HBTPlusCatalogue(HaloCatalogue):
 
     def _get_all_particle_indices(self) -> HaloParticleIndices | tuple[np.ndarray, np.ndarray]:
         self._init_iord_to_fpos()
-        indices = np.empty(self._file["Subhalos"]["Nbound"].sum(),
-                           dtype=self._file["SubhaloParticles"][0].dtype)
-        boundaries = np.empty((len(self._file["SubhaloParticles"]), 2),
-                              dtype=np.intp)
-        start = 0
-        for i, halo_parts in enumerate(self._file['SubhaloParticles']):
-            end = start + len(halo_parts)
-            indices[start:end] = np.sort(self._iord_to_fpos.map_ignoring_order(halo_parts))
-            boundaries[i] = (start,end)
-            start = end
+        offsets, iords = _vlen_dataset_to_csr(self._file["SubhaloParticles"])
+
+        # map all iords at once; the mapper only preserves the order of sorted input, so sort and then scatter back
+        iord_order = np.argsort(iords)
+        indices = np.empty(len(iords), dtype=np.int64)
+        indices[iord_order] = self._iord_to_fpos.map_ignoring_order(iords[iord_order])
+
+        # sort the particles within each halo
+        halo_index = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        indices = indices[np.lexsort((indices, halo_index))]
+
+        boundaries = np.vstack((offsets[:-1], offsets[1:])).T
         return indices, boundaries
 
     def with_groups_from(self, other: HaloCatalogue) -> HaloCatalogue:
@@ -118,22 +139,24 @@ class HBTPlusCatalogue(HaloCatalogue):
     def get_properties_one_halo(self, halo_number) -> dict:
         index = self.number_mapper.number_to_index(halo_number)
         result = {}
-        for k in self._file["Subhalos"].dtype.names:
-            result[k] = self._file["Subhalos"][k][index]
+        for k in self._subhalos.dtype.names:
+            result[k] = self._subhalos[k][index]
         result['children'] = self._get_children_one_halo(index)
         result['parent'] = self._parents[index]
         return result
 
     def get_properties_all_halos(self, with_units=True) -> dict:
         result = {}
-        for k in self._file["Subhalos"].dtype.names:
-            result[k] = np.asarray(self._file["Subhalos"][k])
-        result['children'] = [self._get_children_one_halo(i) for i in range(len(self))]
+        for k in self._subhalos.dtype.names:
+            result[k] = self._subhalos[k].copy()
+        children = self.number_mapper.index_to_number(self._children) if len(self._children) > 0 else self._children
+        result['children'] = np.split(children, self._children_offsets[1:-1])
         result['parent'] = self._parents
         return result
 
     def _get_children_one_halo(self, index) -> NDArray[int]:
-        return self.number_mapper.index_to_number(self._file["NestedSubhalos"][index])
+        return self.number_mapper.index_to_number(
+            self._children[self._children_offsets[index]:self._children_offsets[index + 1]])
 
 
 
@@ -161,13 +184,15 @@ class HBTPlusCatalogueWithGroups(HaloCatalogue):
 
         self._hbt_cat = hbt_cat
         self._group_cat = group_cat
-        self._hbt_host_groups = np.asarray(hbt_cat._file["Subhalos"]["HostHaloId"])
+        self._hbt_host_groups = hbt_cat._subhalos["HostHaloId"]
         if self._hbt_host_groups.max() >= len(group_cat):
             raise ValueError("The HBT+ catalogue contains host groups that are not in the group catalogue")
-        self._children = [[] for _ in range(len(group_cat))]
-        for p in range(len(hbt_cat)):
-            self._children[self._hbt_host_groups[p]].append(p)
-        self._children = [np.array(c) for c in self._children]
+
+        # group the HBT+ halos by host; those with no host (HostHaloId of -1) are not children of any group
+        with_host = np.where(self._hbt_host_groups >= 0)[0]
+        hosts = self._hbt_host_groups[with_host]
+        by_host = with_host[np.argsort(hosts, kind='stable')]
+        self._children = np.split(by_host, np.searchsorted(np.sort(hosts), np.arange(1, len(group_cat))))
 
         super().__init__(group_cat.base, group_cat.number_mapper)
 
@@ -6,13 +6,17 @@ KDTree
 Provides access to nearest neighbour lists and smoothing lengths.
 
 """
+import hashlib
+import json
 import logging
+import os
+import pathlib
 import time
 import warnings
 
 import numpy as np
 
-from .. import array as ar, config, util
+from .. import array as ar, config, units, util
 from . import kdmain
 
 logger = logging.getLogger("pynbody.kdtree")
@@ -32,6 +36,19 @@ KDNode = np.dtype([
     ('pUpper', np.intp)
 ])
 
+def positions_checksum(pos, leafsize, boxsize, chunk_size=1000000):
+    """Return a checksum identifying a tree built on the given positions with the given parameters.
+
+    This is used to detect whether a tree stored on disk (see :meth:`KDTree.save`) is still valid for a
+    snapshot. The positions are hashed in chunks, so that no large temporary copies are made."""
+    h = hashlib.sha1()
+    pos = np.asarray(pos)
+    h.update(json.dumps({'shape': pos.shape, 'dtype': pos.dtype.str,
+                         'leafsize': int(leafsize), 'boxsize': float(boxsize)}).encode())
+    for i in range(0, len(pos), chunk_size):
+        h.update(np.ascontiguousarray(pos[i:i+chunk_size]).data)
+    return h.hexdigest()
+
 class KDTree:
     """KDTree can be used for smoothing, interpolating and geometrical queries.
 
@@ -131,7 +148,96 @@ class KDTree:
 
         return self
 
+    _saved_nodes_filename = "kdnodes.npy"
+    _saved_offsets_filename = "particle_offsets.npy"
+    _saved_meta_filename = "meta.json"
+
+    def save(self, path, checksum=None):
+        """Save the tree to the directory *path*, so that it can later be reloaded with :meth:`load`.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            The directory in which to store the tree. It is created if it does not exist; any tree
+            previously stored there is overwritten.
+        checksum : str, optional
+            A checksum of the positions on which the tree was built (see :func:`positions_checksum`),
+            which is verified when the tree is reloaded.
+        """
+        path = pathlib.Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        meta_path = path / self._saved_meta_filename
+
+        # the metadata is removed first and written last, so that a partially-written tree is never loaded
+        meta_path.unlink(missing_ok=True)
+
+        for filename, data in ((self._saved_nodes_filename, self.kdnodes),
+                               (self._saved_offsets_filename, self.particle_offsets)):
+            tmp_path = path / (filename + ".tmp")
+            with open(tmp_path, 'wb') as f:
+                np.save(f, data)
+            os.replace(tmp_path, path / filename)
+
+        meta = {'leafsize': self.leafsize, 'boxsize': self.boxsize, 'num_particles': len(self.particle_offsets),
+                'checksum': checksum}
+        tmp_path = path / (self._saved_meta_filename + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+        logger.info("Saved KDTree to %s" % path)
+
+    @classmethod
+    def load(cls, path, pos, mass, checksum=None, num_threads=None, boxsize=None):
+        """Load a tree previously stored with :meth:`save`.
+
+        The node and particle ordering arrays are memory-mapped rather than read into memory.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            The directory in which the tree was stored.
+        pos : pynbody.array.SimArray
+            Particle positions, which must be the same as those on which the tree was built.
+        mass : pynbody.array.SimArray
+            Particle masses.
+        checksum : str, optional
+            If specified, the checksum recorded when the tree was saved must match this value.
+        num_threads : int, optional
+            Number of threads to use for operations on the tree.
+        boxsize : float, optional
+            Boxsize, which should match that used when building the tree.
+
+        Raises
+        ------
+        OSError
+            If no complete tree is stored at *path*.
+        ValueError
+            If the stored tree is not compatible with the specified positions or checksum.
+        """
+        path = pathlib.Path(path)
+        with open(path / cls._saved_meta_filename) as f:
+            meta = json.load(f)
+
+        if checksum is not None and meta['checksum'] != checksum:
+            raise ValueError("Stored KDTree was built on different particle positions")
 
+        if meta['num_particles'] != len(pos):
+            raise ValueError("Number of particles in stored KDTree does not match number of particles")
+
+        kdnodes = np.load(path / cls._saved_nodes_filename, mmap_mode='r')
+        particle_offsets = np.load(path / cls._saved_offsets_filename, mmap_mode='r')
+
+        if kdnodes.dtype != KDNode or particle_offsets.dtype != np.intp:
+            raise ValueError("Stored KDTree has an incompatible format")
+
+        if boxsize is None:
+            boxsize = meta['boxsize']
+
+        result = cls.deserialize(pos, mass, (meta['leafsize'], meta['boxsize'], kdnodes, particle_offsets),
+                                 num_threads=num_threads, boxsize=boxsize)
+        logger.info("Loaded KDTree from %s" % path)
+        return result
 
     def particles_in_sphere(self, center, radius):
         """Find particles within a sphere.
@@ -155,6 +261,76 @@ class KDTree:
         kdmain.nn_stop(self.kdtree, smx)
         return particle_ids
 
+    def _prepare_query_points(self, points):
+        if units.has_units(points) and units.has_units(self._pos):
+            points = points.in_units(self._pos.units, **self._pos.conversion_context())
+        points = np.ascontiguousarray(points, dtype=self._pos.dtype)
+        if points.ndim == 1:
+            points = points.reshape((1, 3))
+        return points
+
+    def _period(self):
+        return -1.0 if self.boxsize is None else float(self.boxsize)
+
+    def query(self, points, k=1):
+        """Find the *k* nearest particles to each of an array of points.
+
+        The points need not be particle positions; for example, they might be pixel centres, positions
+        along a skewer, or observation points. The search runs in parallel, using the number of threads
+        specified when the tree was created.
+
+        Parameters
+        ----------
+        points : array_like
+            Nx3 array of query positions. If this has units, it is converted into the units of the particle
+            positions.
+        k : int
+            Number of neighbours to find for each point.
+
+        Returns
+        -------
+        indices : numpy.ndarray
+            Nxk array of particle indices (relative to the snapshot on which the tree was built). Each row is
+            ordered from nearest to furthest.
+        distances : numpy.ndarray
+            Nxk array of the corresponding distances.
+        """
+        points = self._prepare_query_points(points)
+        indices = np.empty((len(points), int(k)), dtype=np.intp)
+        distances = np.empty((len(points), int(k)), dtype=self._pos.dtype)
+        kdmain.query_nearest(self.kdtree, points, int(k), self._period(), self.num_threads, indices, distances)
+        return indices, distances
+
+    def query_ball(self, points, radii):
+        """Find all particles within a given radius of each of an array of points.
+
+        The search runs in parallel, using the number of threads specified when the tree was created.
+
+        Parameters
+        ----------
+        points : array_like
+            Nx3 array of query positions. If this has units, it is converted into the units of the particle
+            positions.
+        radii : float or array_like
+            The search radius, either a single value or one per point.
+
+        Returns
+        -------
+        indptr : numpy.ndarray
+            Length N+1 array of offsets, in the same format as for a CSR sparse matrix: the particles found
+            for point ``i`` are ``indices[indptr[i]:indptr[i+1]]``.
+        indices : numpy.ndarray
+            Particle indices (relative to the snapshot on which the tree was built). Within each point's
+            results, the order is arbitrary.
+        distances : numpy.ndarray
+            The corresponding distances.
+        """
+        points = self._prepare_query_points(points)
+        if units.has_units(radii) and units.has_units(self._pos):
+            radii = radii.in_units(self._pos.units, **self._pos.conversion_context())
+        radii = np.ascontiguousarray(np.broadcast_to(radii, (len(points),)), dtype=self._pos.dtype)
+        return kdmain.query_ball(self.kdtree, points, radii, self._period(), self.num_threads)
+
     def nn(self, nn=None):
         """Generator of neighbour list.
 
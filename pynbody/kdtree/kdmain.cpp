@@ -11,6 +11,8 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <atomic>
+#include <thread>
 
 #include "kd.h"
 #include "smooth.h"
@@ -37,6 +39,8 @@ PyObject *get_arrayref(PyObject *self, PyObject *args);
 PyObject *get_node_count(PyObject *self, PyObject *args);
 
 PyObject *particles_in_sphere(PyObject *self, PyObject *args);
+PyObject *query_nearest(PyObject *self, PyObject *args);
+PyObject *query_ball(PyObject *self, PyObject *args);
 
 int getBitDepth(PyObject *check);
 
@@ -64,6 +68,8 @@ static PyMethodDef kdmain_methods[] = {
 
     {"particles_in_sphere", particles_in_sphere, METH_VARARGS,
      "particles_in_sphere"},
+    {"query_nearest", query_nearest, METH_VARARGS, "query_nearest"},
+    {"query_ball", query_ball, METH_VARARGS, "query_ball"},
 
     {"set_arrayref", set_arrayref, METH_VARARGS, "set_arrayref"},
     {"get_arrayref", get_arrayref, METH_VARARGS, "get_arrayref"},
@@ -632,6 +638,204 @@ template <typename Tf, typename Tq> struct typed_particles_in_sphere {
   }
 };
 
+/*==========================================================================*/
+/* Batched queries for arbitrary points                                     */
+/*==========================================================================*/
+
+#define QUERY_WORKUNIT 1024
+
+template <typename F>
+void run_query_threads(npy_intp nPoints, int num_threads, F processBlock) {
+  // Calls processBlock(start, end) for consecutive blocks of query points,
+  // with blocks distributed dynamically over num_threads threads
+  npy_intp nBlocks = (nPoints + QUERY_WORKUNIT - 1) / QUERY_WORKUNIT;
+  std::atomic<npy_intp> nextBlock(0);
+
+  auto worker = [&]() {
+    npy_intp block;
+    while ((block = nextBlock++) < nBlocks) {
+      npy_intp start = block * QUERY_WORKUNIT;
+      processBlock(block, start, std::min(start + QUERY_WORKUNIT, nPoints));
+    }
+  };
+
+  if (num_threads < 1)
+    num_threads = 1;
+  if (num_threads > nBlocks)
+    num_threads = nBlocks > 0 ? nBlocks : 1;
+
+  std::vector<std::thread> threads;
+  for (int i = 1; i < num_threads; ++i)
+    threads.emplace_back(worker);
+  worker();
+  for (auto &t : threads)
+    t.join();
+}
+
+bool get_query_context(PyObject *kdobj, PyObject *points, float period,
+                       KDContext **kd, float *fPeriod) {
+  *kd = static_cast<KDContext*>(PyCapsule_GetPointer(kdobj, NULL));
+  if (*kd == nullptr)
+    return false;
+
+  if (period <= 0)
+    period = std::numeric_limits<float>::max();
+  fPeriod[0] = fPeriod[1] = fPeriod[2] = period;
+
+  if (!smCheckFits(*kd, fPeriod)) {
+    PyErr_SetString(
+        PyExc_ValueError,
+        "The particles span a region larger than the specified boxsize");
+    return false;
+  }
+
+  if (PyArray_NDIM((PyArrayObject *)points) != 2 ||
+      PyArray_DIM((PyArrayObject *)points, 1) != 3) {
+    PyErr_SetString(PyExc_ValueError, "Query points must be an Nx3 array");
+    return false;
+  }
+
+  return true;
+}
+
+template <typename Tf, typename Tq> struct typed_query_nearest {
+  static PyObject *call(PyObject *self, PyObject *args) {
+    KDContext *kd;
+    PyObject *kdobj, *points, *outIndices, *outDistances;
+    npy_intp k;
+    float period, fPeriod[3];
+    int num_threads;
+
+    if (!PyArg_ParseTuple(args, "OOlfiOO", &kdobj, &points, &k, &period,
+                          &num_threads, &outIndices, &outDistances))
+      return nullptr;
+
+    if (checkArray<Tf>(points, "points", 0, true))
+      return nullptr;
+
+    if (!get_query_context(kdobj, points, period, &kd, fPeriod))
+      return nullptr;
+
+    npy_intp nPoints = PyArray_DIM((PyArrayObject *)points, 0);
+
+    if (k < 1 || k > kd->nActive) {
+      PyErr_SetString(PyExc_ValueError,
+                      "Number of neighbours must be between 1 and the "
+                      "number of particles in the tree");
+      return nullptr;
+    }
+
+    if (checkArray<npy_intp>(outIndices, "indices", nPoints, true) ||
+        checkArray<Tf>(outDistances, "distances", nPoints, true))
+      return nullptr;
+
+    if (PyArray_SIZE((PyArrayObject *)outIndices) != nPoints * k ||
+        PyArray_SIZE((PyArrayObject *)outDistances) != nPoints * k) {
+      PyErr_SetString(PyExc_ValueError, "Output arrays have the wrong size");
+      return nullptr;
+    }
+
+    const Tf *pPoints = static_cast<const Tf *>(PyArray_DATA((PyArrayObject *)points));
+    npy_intp *pIndices = static_cast<npy_intp *>(PyArray_DATA((PyArrayObject *)outIndices));
+    Tf *pDistances = static_cast<Tf *>(PyArray_DATA((PyArrayObject *)outDistances));
+
+    Py_BEGIN_ALLOW_THREADS;
+    run_query_threads(nPoints, num_threads, [&](npy_intp, npy_intp start, npy_intp end) {
+      std::vector<std::pair<Tf, npy_intp>> heap;
+      heap.reserve(k);
+      for (npy_intp i = start; i < end; ++i) {
+        kdQueryNearest<Tf>(kd, fPeriod, pPoints + 3 * i, k, heap);
+        // sort_heap leaves the closest neighbour first
+        std::sort_heap(heap.begin(), heap.end());
+        for (npy_intp j = 0; j < k; ++j) {
+          pIndices[i * k + j] = kd->particleOffsets[heap[j].second];
+          pDistances[i * k + j] = sqrt(heap[j].first);
+        }
+      }
+    });
+    Py_END_ALLOW_THREADS;
+
+    Py_INCREF(Py_None);
+    return Py_None;
+  }
+};
+
+template <typename Tf, typename Tq> struct typed_query_ball {
+  static PyObject *call(PyObject *self, PyObject *args) {
+    KDContext *kd;
+    PyObject *kdobj, *points, *radii;
+    float period, fPeriod[3];
+    int num_threads;
+
+    if (!PyArg_ParseTuple(args, "OOOfi", &kdobj, &points, &radii, &period,
+                          &num_threads))
+      return nullptr;
+
+    if (checkArray<Tf>(points, "points", 0, true))
+      return nullptr;
+
+    if (!get_query_context(kdobj, points, period, &kd, fPeriod))
+      return nullptr;
+
+    npy_intp nPoints = PyArray_DIM((PyArrayObject *)points, 0);
+
+    if (checkArray<Tf>(radii, "radii", nPoints, true))
+      return nullptr;
+
+    const Tf *pPoints = static_cast<const Tf *>(PyArray_DATA((PyArrayObject *)points));
+    const Tf *pRadii = static_cast<const Tf *>(PyArray_DATA((PyArrayObject *)radii));
+
+    npy_intp dims[1] = {nPoints + 1};
+    PyObject *indptr = PyArray_SimpleNew(1, dims, NPY_INTP);
+    npy_intp *pIndptr = static_cast<npy_intp *>(PyArray_DATA((PyArrayObject *)indptr));
+
+    npy_intp nBlocks = (nPoints + QUERY_WORKUNIT - 1) / QUERY_WORKUNIT;
+    std::vector<std::vector<npy_intp>> blockIndices(nBlocks);
+    std::vector<std::vector<Tf>> blockDist2(nBlocks);
+
+    Py_BEGIN_ALLOW_THREADS;
+    run_query_threads(nPoints, num_threads, [&](npy_intp block, npy_intp start, npy_intp end) {
+      for (npy_intp i = start; i < end; ++i) {
+        kdQueryBall<Tf>(kd, fPeriod, pPoints + 3 * i, pRadii[i], blockIndices[block], blockDist2[block]);
+        // for now, store the number of particles found; converted to offsets below
+        pIndptr[i + 1] = blockIndices[block].size();
+      }
+    });
+
+    // convert per-block cumulative counts into global offsets
+    pIndptr[0] = 0;
+    npy_intp blockOffset = 0;
+    for (npy_intp block = 0; block < nBlocks; ++block) {
+      npy_intp start = block * QUERY_WORKUNIT;
+      npy_intp end = std::min(start + QUERY_WORKUNIT, nPoints);
+      for (npy_intp i = start; i < end; ++i)
+        pIndptr[i + 1] += blockOffset;
+      blockOffset += blockIndices[block].size();
+    }
+    Py_END_ALLOW_THREADS;
+
+    dims[0] = pIndptr[nPoints];
+    PyObject *indices = PyArray_SimpleNew(1, dims, NPY_INTP);
+    PyObject *distances = PyArray_SimpleNew(1, dims, kd->nBitDepth == 64 ? NPY_DOUBLE : NPY_FLOAT);
+    npy_intp *pIndices = static_cast<npy_intp *>(PyArray_DATA((PyArrayObject *)indices));
+    Tf *pDistances = static_cast<Tf *>(PyArray_DATA((PyArrayObject *)distances));
+
+    Py_BEGIN_ALLOW_THREADS;
+    for (npy_intp block = 0; block < nBlocks; ++block) {
+      npy_intp offset = pIndptr[block * QUERY_WORKUNIT];
+      for (size_t j = 0; j < blockIndices[block].size(); ++j) {
+        pIndices[offset + j] = kd->particleOffsets[blockIndices[block][j]];
+        pDistances[offset + j] = sqrt(blockDist2[block][j]);
+      }
+      std::vector<npy_intp>().swap(blockIndices[block]);
+      std::vector<Tf>().swap(blockDist2[block]);
+    }
+    Py_END_ALLOW_THREADS;
+
+    return Py_BuildValue("NNN", indptr, indices, distances);
+  }
+};
+
 template <typename Tf, typename Tq> struct typed_populate {
   static PyObject *call(PyObject *self, PyObject *args) {
 
@@ -793,3 +997,11 @@ PyObject *populate(PyObject *self, PyObject *args) {
 PyObject *particles_in_sphere(PyObject *self, PyObject *args) {
   return type_dispatcher<typed_particles_in_sphere>(self, args);
 }
+
+PyObject *query_nearest(PyObject *self, PyObject *args) {
+  return type_dispatcher<typed_query_nearest>(self, args);
+}
+
+PyObject *query_ball(PyObject *self, PyObject *args) {
+  return type_dispatcher<typed_query_ball>(self, args);
+}
@@ -2,7 +2,9 @@
 #define SMOOTH_HINCLUDED
 
 #include "kd.h"
+#include <algorithm>
 #include <functional>
+#include <limits>
 #include <memory>
 #include <mutex>
 #include <stdbool.h>
@@ -191,6 +193,163 @@ npy_intp smBallGather(SMX smx, float fBall2, float *ri) {
   return (nCnt);
 }
 
+/*
+ ** Queries for arbitrary points, i.e. not necessarily the positions of particles
+ ** in the tree. Unlike smBallSearch/smBallGather, these do not require an SMX
+ ** context and therefore many can be run concurrently on the same tree.
+ **
+ ** The query position is passed both in the tree's precision (riT) and as
+ ** floats (ri); the latter are used for pruning cells, consistent with the
+ ** rest of the tree code.
+ */
+
+template <typename T> inline T kdImageShift(float s, float x, float period) {
+  // INTERSECT sets s to x, x + period or x - period; return the shift exactly
+  if (s > x)
+    return period;
+  else if (s < x)
+    return -(T)period;
+  else
+    return 0;
+}
+
+template <typename T>
+inline T kdPeriodicDelta(T dx, float period) {
+  if (period < std::numeric_limits<float>::max()) {
+    if (dx > 0.5 * period)
+      dx -= period;
+    else if (dx < -0.5 * period)
+      dx += period;
+  }
+  return dx;
+}
+
+template <typename T>
+void kdQueryNearest(KDContext *kd, const float *fPeriod, const T *riT,
+                    npy_intp k, std::vector<std::pair<T, npy_intp>> &heap) {
+  // On exit, heap contains the k nearest particles (tree-order indices) and
+  // their squared distances, as a max-heap keyed on distance.
+  KDNode *c = kd->kdNodes;
+  npy_intp *p = kd->particleOffsets;
+  npy_intp cell, cp, ct, pj;
+  T dx, dy, dz, fDist2;
+  float sx, sy, sz;
+  float lx = fPeriod[0], ly = fPeriod[1], lz = fPeriod[2];
+  float x = riT[0], y = riT[1], z = riT[2];
+  float fBall2 = std::numeric_limits<float>::max();
+
+  heap.clear();
+
+  auto consider = [&](npy_intp pj, T d2) {
+    if ((npy_intp)heap.size() < k) {
+      heap.emplace_back(d2, pj);
+      std::push_heap(heap.begin(), heap.end());
+    } else if (d2 < heap.front().first) {
+      std::pop_heap(heap.begin(), heap.end());
+      heap.back() = std::make_pair(d2, pj);
+      std::push_heap(heap.begin(), heap.end());
+    } else {
+      return;
+    }
+    if ((npy_intp)heap.size() == k)
+      fBall2 = std::nextafter((float)heap.front().first,
+                              std::numeric_limits<float>::max());
+  };
+
+  /*
+   ** First find the bucket containing the query point, which is likely
+   ** to contain close neighbours.
+   */
+  cell = ROOT;
+  while (cell < kd->nSplit) {
+    if ((float)riT[c[cell].iDim] < c[cell].fSplit)
+      cell = LOWER(cell);
+    else
+      cell = UPPER(cell);
+  }
+  for (pj = c[cell].pLower; pj <= c[cell].pUpper; ++pj) {
+    dx = kdPeriodicDelta<T>(riT[0] - GET2<T>(kd->pNumpyPos, p[pj], 0), lx);
+    dy = kdPeriodicDelta<T>(riT[1] - GET2<T>(kd->pNumpyPos, p[pj], 1), ly);
+    dz = kdPeriodicDelta<T>(riT[2] - GET2<T>(kd->pNumpyPos, p[pj], 2), lz);
+    consider(pj, dx * dx + dy * dy + dz * dz);
+  }
+
+  /*
+   ** Now work outwards through the tree, pruning cells that cannot contain
+   ** anything closer than the current k-th neighbour.
+   */
+  while (cell != ROOT) {
+    cp = SIBLING(cell);
+    ct = cp;
+    SETNEXT(ct, ROOT);
+    while (1) {
+      INTERSECT(c, cp, fBall2, lx, ly, lz, x, y, z, sx, sy, sz);
+      if (cp < kd->nSplit) {
+        cp = LOWER(cp);
+        continue;
+      } else {
+        T sxT = riT[0] + kdImageShift<T>(sx, x, lx), syT = riT[1] + kdImageShift<T>(sy, y, ly),
+          szT = riT[2] + kdImageShift<T>(sz, z, lz);
+        for (pj = c[cp].pLower; pj <= c[cp].pUpper; ++pj) {
+          dx = sxT - GET2<T>(kd->pNumpyPos, p[pj], 0);
+          dy = syT - GET2<T>(kd->pNumpyPos, p[pj], 1);
+          dz = szT - GET2<T>(kd->pNumpyPos, p[pj], 2);
+          fDist2 = dx * dx + dy * dy + dz * dz;
+          if (fDist2 <= fBall2)
+            consider(pj, fDist2);
+        }
+      }
+    GetNextCell:
+      SETNEXT(cp, ROOT);
+      if (cp == ct)
+        break;
+    }
+    cell = PARENT(cell);
+  }
+}
+
+template <typename T>
+void kdQueryBall(KDContext *kd, const float *fPeriod, const T *riT, T radius,
+                 std::vector<npy_intp> &indices, std::vector<T> &dist2) {
+  // Appends the tree-order indices and squared distances of all particles
+  // within radius of riT
+  KDNode *c = kd->kdNodes;
+  npy_intp *p = kd->particleOffsets;
+  npy_intp cp, pj;
+  T dx, dy, dz, fDist2;
+  T fBall2T = radius * radius;
+  float sx, sy, sz;
+  float lx = fPeriod[0], ly = fPeriod[1], lz = fPeriod[2];
+  float x = riT[0], y = riT[1], z = riT[2];
+  float fBall2 = std::nextafter((float)fBall2T, std::numeric_limits<float>::max());
+
+  cp = ROOT;
+  while (1) {
+    INTERSECT(c, cp, fBall2, lx, ly, lz, x, y, z, sx, sy, sz);
+    if (cp < kd->nSplit) {
+      cp = LOWER(cp);
+      continue;
+    } else {
+      T sxT = riT[0] + kdImageShift<T>(sx, x, lx), syT = riT[1] + kdImageShift<T>(sy, y, ly),
+        szT = riT[2] + kdImageShift<T>(sz, z, lz);
+      for (pj = c[cp].pLower; pj <= c[cp].pUpper; ++pj) {
+        dx = sxT - GET2<T>(kd->pNumpyPos, p[pj], 0);
+        dy = syT - GET2<T>(kd->pNumpyPos, p[pj], 1);
+        dz = szT - GET2<T>(kd->pNumpyPos, p[pj], 2);
+        fDist2 = dx * dx + dy * dy + dz * dz;
+        if (fDist2 <= fBall2T) {
+          indices.push_back(pj);
+          dist2.push_back(fDist2);
+        }
+      }
+    }
+  GetNextCell:
+    SETNEXT(cp, ROOT);
+    if (cp == ROOT)
+      break;
+  }
+}
+
 void initParticleList(SMX smx);
 
 PyObject *getReturnParticleList(SMX smx);
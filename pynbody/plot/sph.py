@@ -408,10 +408,9 @@ def image(sim, qty='rho', width="10 kpc", resolution=500, units=None, log=True,
                 sim["__one"] = np.ones_like(sim[qty])
                 sim["__one"].units = "1"
 
-            im = sph.render_image(sim, qty, width / 2, resolution, out_units=aunits, kernel=kernel,
-                                  z_camera=z_camera, **kwargs)
-            im2 = sph.render_image(sim, av_z, width / 2, resolution, kernel=kernel,
-                                   z_camera=z_camera, **kwargs)
+            # render the weighted quantity and the weights in a single pass over the particles
+            im, im2 = sph.render_images(sim, [qty, av_z], width / 2, resolution, out_units=[aunits, None],
+                                        kernel=kernel, z_camera=z_camera, **kwargs)
 
             top = sim.ancestor
 
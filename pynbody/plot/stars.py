@@ -14,7 +14,7 @@ import numpy as np
 
 from .. import array, filt, units, units as _units
 from ..analysis import angmom, profile
-from ..sph import Kernel2D, render_spherical_image
+from ..sph import Kernel2D, render_images, render_spherical_image
 from .sph import image
 
 logger = logging.getLogger('pynbody.plot.stars')
@@ -161,12 +161,14 @@ def render(sim, filename=None,
 		smf = filt.HighPass('smooth', str(starsize) + ' kpc')
 		sim.s[smf]['smooth'] = array.SimArray(starsize, 'kpc', sim=sim)
 
-	r = image(sim.s, qty=r_band + '_lum_den', width=width, log=False,
-			  units="pc^-2", clear=False, noplot=True, resolution=resolution) * r_scale
-	g = image(sim.s, qty=g_band + '_lum_den', width=width, log=False,
-			  units="pc^-2", clear=False, noplot=True, resolution=resolution) * g_scale
-	b = image(sim.s, qty=b_band + '_lum_den', width=width, log=False,
-			  units="pc^-2", clear=False, noplot=True, resolution=resolution) * b_scale
+	# render all three bands in a single pass over the particles
+	r, g, b = render_images(sim.s, [r_band + '_lum_den', g_band + '_lum_den', b_band + '_lum_den'],
+							float(width) / 2, resolution, out_units="pc^-2", kernel=Kernel2D())
+	for im in r, g, b:
+		im[np.isnan(im)] = 0.0
+	r = r * r_scale
+	g = g * g_scale
+	b = b * b_scale
 
 	# convert all channels to mag arcsec^-2
 
@@ -0,0 +1,236 @@
+"""
+derived_array_cache
+===================
+
+Implements an optional on-disk cache for derived arrays.
+
+Some derived arrays (notably ``smooth`` and ``rho``, which require a KD-tree neighbour search) are expensive to
+calculate for large snapshots. When the cache is enabled, the result of each derivation on a snapshot that was
+loaded from disk is stored in a sidecar directory, and subsequent sessions which ask for the same array on the
+same (unmodified) file read it back with a memory-mapped load rather than recalculating it.
+
+The cache is disabled by default. It is controlled by the ``[derived-array-cache]`` section of the configuration
+file, or at runtime through ``pynbody.config['derived-array-cache']``:
+
+* ``enabled``: set to True to switch the cache on;
+* ``path``: a directory in which to store cached arrays. If ``None``, a ``.pynbody-derived-cache`` directory is
+  created alongside each snapshot file;
+* ``max-size-mb``: the maximum total size of a cache directory. When this is exceeded, the least recently used
+  entries are deleted.
+
+A cached array is only reused if:
+
+* the snapshot file has the same path and modification time as when the array was stored;
+* the array is requested for the same family (or the whole snapshot), with the same particle slice;
+* every array that the original calculation depended on (as recorded by the
+  :class:`~pynbody.dependencytracker.DependencyTracker`) is still as it was when loaded from disk, i.e. has
+  not been modified in memory since. Unit conversions do not count as modifications.
+
+Conversely, an array is only stored if all its dependencies are in this pristine state, so that the
+cache never contains values that depend on transient in-memory modifications.
+
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import typing
+
+import numpy as np
+
+from .. import array, family, units
+
+if typing.TYPE_CHECKING:
+    from .simsnap import SimSnap
+
+logger = logging.getLogger('pynbody.snapshot.derived_array_cache')
+
+_sidecar_directory_name = ".pynbody-derived-cache"
+
+
+class DerivedArrayCache:
+    """Manages a directory of cached derived arrays, with least-recently-used eviction."""
+
+    def __init__(self, path, max_size_bytes):
+        """Initialise a cache stored in the directory *path*, limited in total size to *max_size_bytes*"""
+        self._path = pathlib.Path(path)
+        self._max_size_bytes = max_size_bytes
+
+    @classmethod
+    def for_snapshot(cls, sim: SimSnap) -> DerivedArrayCache | None:
+        """Return the cache to use for the given snapshot, or None if caching is not enabled or possible."""
+        from .. import config
+
+        settings = config['derived-array-cache']
+        if not settings['enabled']:
+            return None
+
+        if sim is not sim.ancestor or getattr(sim, 'partial_load', False):
+            return None
+
+        filename = _snapshot_path(sim)
+        if filename is None:
+            return None
+
+        if settings['path'] is None:
+            path = filename.parent / _sidecar_directory_name
+        else:
+            path = pathlib.Path(settings['path']).expanduser()
+
+        return cls(path, int(settings['max-size-mb'] * 1024 ** 2))
+
+    def retrieve(self, sim: SimSnap, name: str, fam: family.Family | None = None) -> array.SimArray | None:
+        """Return a cached result for derived array *name* (for family *fam*) of *sim*, or None if not available.
+
+        On success, the dependencies of the original calculation are reported to the snapshot's
+        dependency tracker, so that the returned array is invalidated in the normal way if those dependencies
+        later change."""
+
+        key = self._key(sim, name, fam)
+        if key is None:
+            return None
+
+        data_path, meta_path = self._paths_for_key(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            data = np.load(data_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+
+        if not all(_is_pristine(sim, d) for d in meta['dependencies']):
+            return None
+
+        try:
+            os.utime(data_path)  # mark as recently used
+        except OSError:
+            pass
+
+        logger.info("Retrieved derived array %s from cache %s" % (name, data_path))
+
+        for d in meta['dependencies']:
+            sim._dependency_tracker.touching(d)
+
+        result = data.view(array.SimArray)
+        if meta['units'] is not None:
+            result.units = units.Unit(meta['units'])
+        return result
+
+    def store(self, sim: SimSnap, name: str, fam: family.Family | None, result: np.ndarray):
+        """Store *result* as the derived array *name* (for family *fam*) of *sim*, if it is safe to do so."""
+
+        key = self._key(sim, name, fam)
+        if key is None:
+            return
+
+        dependencies = sorted(sim._dependency_tracker.get_all_dependencies(name))
+        if not all(_is_pristine(sim, d) for d in dependencies):
+            logger.info("Not caching derived array %s, because its dependencies have been modified" % name)
+            return
+
+        meta = {'name': name,
+                'family': fam.name if fam is not None else None,
+                'source': str(_snapshot_path(sim)),
+                'units': str(result.units) if units.has_units(result) else None,
+                'dependencies': dependencies}
+
+        data_path, meta_path = self._paths_for_key(key)
+
+        try:
+            self._path.mkdir(exist_ok=True, parents=True)
+            # write to temporary files and then move into place, so that a partially-written entry is never seen
+            # by another process
+            tmp_data_path = data_path.with_suffix(".tmp.npy")
+            tmp_meta_path = meta_path.with_suffix(".tmp.json")
+            np.save(tmp_data_path, np.asarray(result))
+            with open(tmp_meta_path, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp_meta_path, meta_path)
+            os.replace(tmp_data_path, data_path)
+        except OSError as e:
+            logger.warning("Unable to write derived array %s to cache %s: %s" % (name, self._path, e))
+            return
+
+        logger.info("Stored derived array %s in cache %s" % (name, data_path))
+        self._evict()
+
+    def _evict(self):
+        """Delete least-recently-used entries until the cache is within its size budget"""
+        entries = []
+        for data_path in self._path.glob("*.npy"):
+            if data_path.name.endswith(".tmp.npy"):
+                continue
+            try:
+                stat = data_path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, data_path))
+
+        total_size = sum(e[1] for e in entries)
+        entries.sort()
+        for _, size, data_path in entries:
+            if total_size <= self._max_size_bytes:
+                break
+            logger.info("Evicting %s from derived array cache" % data_path)
+            for p in data_path, data_path.with_suffix(".json"):
+                try:
+                    p.unlink()
+                except OSError:
+                    pass
+            total_size -= size
+
+    def _paths_for_key(self, key):
+        return self._path / (key + ".npy"), self._path / (key + ".json")
+
+    def _key(self, sim: SimSnap, name: str, fam: family.Family | None):
+        from .. import __version__, config
+
+        filename = _snapshot_path(sim)
+        try:
+            mtime = filename.stat().st_mtime_ns
+        except (OSError, AttributeError):
+            return None
+
+        if fam is None:
+            particle_range = (0, len(sim))
+        else:
+            sl = sim._get_family_slice(fam)
+            particle_range = (sl.start, sl.stop)
+
+        # the key includes anything other than the snapshot data that can affect the result of a derivation
+        key_data = {'source': str(filename),
+                    'mtime': mtime,
+                    'name': name,
+                    'family': fam.name if fam is not None else None,
+                    'particle_range': particle_range,
+                    'version': __version__,
+                    'sph': sorted((k, str(v)) for k, v in config['sph'].items()),
+                    'boxsize': str(sim.properties.get('boxsize', None))}
+
+        return hashlib.sha1(json.dumps(key_data).encode()).hexdigest()
+
+
+def _snapshot_path(sim: SimSnap) -> pathlib.Path | None:
+    filename = getattr(sim, '_filename', None)
+    if not filename:
+        return None
+    filename = pathlib.Path(filename)
+    if not filename.exists():
+        return None
+    return filename.resolve()
+
+
+def _is_pristine(sim: SimSnap, name: str) -> bool:
+    """Returns True if the named array is (or would be, once loaded or derived) as it is on disk."""
+    name = sim._array_name_1D_to_ND(name) or name
+    if name in sim._arrays_modified_since_load:
+        return False
+    if sim._find_deriving_function(name) is not None:
+        return True
+    if name in sim.loadable_keys():
+        return True
+    return any(name in sim.loadable_keys(fam) for fam in sim.families())
@@ -18,17 +18,29 @@ will be available from pynbody.
 Spanned files are supported. To load a range of files snap.0, snap.1, ... snap.n,
 pass the filename 'snap'. If you pass snap.0, only that particular file will
 be loaded.
+
+Reading from spanned files can be performed in parallel by a pool of worker
+processes, each filling its own part of the target array. The number of workers
+is set by ``parallel-read`` in the config.ini section [gadgethdf].
+
+Snapshots carrying an EAGLE-style Peano-Hilbert hash table can be loaded
+partially by passing a filter as *take_region*, in which case only the
+particles in hash cells intersecting the region are read from disk.
 """
 
 import configparser
 import functools
 import itertools
 import logging
+import multiprocessing
+import os
+import tempfile
 import warnings
 
 import numpy as np
 
 from .. import config_parser, family, units, util
+from ..array import shared
 from . import SimSnap, namemapper
 
 logger = logging.getLogger('pynbody.snapshot.gadgethdf')
@@ -38,6 +50,8 @@ try:
 except ImportError:
     h5py = None
 
+multiprocess_num = int(config_parser.get('gadgethdf', 'parallel-read'))
+
 _default_type_map = {}
 for x in family.family_names():
     try:
@@ -54,6 +68,88 @@ for hdf_groups in _default_type_map.values():
 
 
 
+# Tables defining the Peano-Hilbert curve used by Gadget (and hence by the EAGLE hash tables), indexed as
+# [rotation, x bit, y bit, z bit]
+_peano_quadrants = np.array([
+    [[[0, 7], [1, 6]], [[3, 4], [2, 5]]], [[[7, 4], [6, 5]], [[0, 3], [1, 2]]],
+    [[[4, 3], [5, 2]], [[7, 0], [6, 1]]], [[[3, 0], [2, 1]], [[4, 7], [5, 6]]],
+    [[[1, 0], [6, 7]], [[2, 3], [5, 4]]], [[[0, 3], [7, 4]], [[1, 2], [6, 5]]],
+    [[[3, 2], [4, 5]], [[0, 1], [7, 6]]], [[[2, 1], [5, 6]], [[3, 0], [4, 7]]],
+    [[[6, 1], [7, 0]], [[5, 2], [4, 3]]], [[[1, 2], [0, 3]], [[6, 5], [7, 4]]],
+    [[[2, 5], [3, 4]], [[1, 6], [0, 7]]], [[[5, 6], [4, 7]], [[2, 1], [3, 0]]],
+    [[[7, 6], [0, 1]], [[4, 5], [3, 2]]], [[[6, 5], [1, 2]], [[7, 4], [0, 3]]],
+    [[[5, 4], [2, 3]], [[6, 7], [1, 0]]], [[[4, 7], [3, 0]], [[5, 6], [2, 1]]],
+    [[[6, 7], [5, 4]], [[1, 0], [2, 3]]], [[[7, 0], [4, 3]], [[6, 1], [5, 2]]],
+    [[[0, 1], [3, 2]], [[7, 6], [4, 5]]], [[[1, 6], [2, 5]], [[0, 7], [3, 4]]],
+    [[[2, 3], [1, 0]], [[5, 4], [6, 7]]], [[[3, 4], [0, 7]], [[2, 5], [1, 6]]],
+    [[[4, 5], [7, 6]], [[3, 2], [0, 1]]], [[[5, 2], [6, 1]], [[4, 3], [7, 0]]]])
+_peano_rotxmap = np.array([4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 0, 1, 2, 3, 17, 18, 19, 16, 23, 20, 21, 22])
+_peano_rotymap = np.array([1, 2, 3, 0, 16, 17, 18, 19, 11, 8, 9, 10, 22, 23, 20, 21, 14, 15, 12, 13, 4, 5, 6, 7])
+_peano_rotx = np.array([3, 0, 0, 2, 2, 0, 0, 1])
+_peano_roty = np.array([0, 1, 1, 2, 2, 3, 3, 0])
+_peano_sense = np.array([-1, -1, -1, +1, +1, -1, -1, -1])
+
+
+def _peano_next_rotation():
+    """Tabulate the rotation to use at the next level, given the current rotation and quadrant"""
+    result = np.empty((24, 8), dtype=np.int64)
+    for rotation in range(24):
+        for quad in range(8):
+            r = rotation
+            for _ in range(_peano_rotx[quad]):
+                r = _peano_rotxmap[r]
+            for _ in range(_peano_roty[quad]):
+                r = _peano_rotymap[r]
+            result[rotation, quad] = r
+    return result
+
+_peano_next_rotation = _peano_next_rotation()
+
+
+def _peano_hilbert_key(x, y, z, bits):
+    """Return the Gadget Peano-Hilbert keys of the cells with integer coordinates x, y, z (each from 0 to
+    2**bits-1)"""
+    x, y, z = (np.asarray(q, dtype=np.int64) for q in (x, y, z))
+    key = np.zeros(x.shape, dtype=np.int64)
+    rotation = np.zeros(x.shape, dtype=np.int64)
+    sense = np.ones(x.shape, dtype=np.int64)
+    for i in range(bits - 1, -1, -1):
+        quad = _peano_quadrants[rotation, (x >> i) & 1, (y >> i) & 1, (z >> i) & 1]
+        key = (key << 3) + np.where(sense == 1, quad, 7 - quad)
+        sense *= _peano_sense[quad]
+        rotation = _peano_next_rotation[rotation, quad]
+    return key
+
+
+# The maximum refinement of the grid used to identify which hash cells intersect a region. If the hash table
+# is finer than this, whole blocks of hash cells are selected at once.
+_max_region_selection_bits = 7
+
+
+def _peano_key_ranges_intersecting_region(region, boxsize, bits):
+    """Return sorted, non-overlapping [start, stop) ranges of Peano-Hilbert keys whose cells intersect a region"""
+    level = min(bits, _max_region_selection_bits)
+    ncell = 2 ** level
+    cell_x, cell_y, cell_z = (q.ravel() for q in np.meshgrid(*([np.arange(ncell)] * 3), indexing='ij'))
+    centroids = (np.stack((cell_x, cell_y, cell_z), axis=1) + 0.5) * (boxsize / ncell)
+
+    intersecting = np.where(region.cubic_cell_intersection(centroids))[0]
+
+    # the curve is hierarchical, so each coarse cell corresponds to a contiguous range of fine keys
+    keys_per_cell = 8 ** (bits - level)
+    starts = np.sort(_peano_hilbert_key(cell_x[intersecting], cell_y[intersecting], cell_z[intersecting],
+                                        level)) * keys_per_cell
+    return _merge_contiguous_ranges(starts, starts + keys_per_cell)
+
+
+def _merge_contiguous_ranges(starts, stops):
+    """Merge sorted [start, stop) ranges which touch each other, returning the new starts and stops"""
+    if len(starts) == 0:
+        return starts, stops
+    new_range = np.concatenate(([True], starts[1:] != stops[:-1]))
+    return starts[new_range], stops[np.concatenate((new_range[1:], [True]))]
+
+
 class DummyHDFData:
 
     """A stupid class to allow emulation of mass arrays for particles
@@ -73,13 +169,58 @@ class DummyHDFData:
         target[:] = self.value
 
 
+# When loading with take, selected particles separated by fewer than this many unselected particles are read
+# from disk as a single hyperslab, from which the selected particles are then picked out in memory. No more than
+# _take_max_block_rows particles are read at once.
+_take_read_gap = 4096
+_take_max_block_rows = 1024 ** 2
+
+
+def _read_hdf_dataset_rows(dataset, rows, target):
+    """Read the specified rows of an HDF dataset into target.
+
+    *rows* must be sorted and unique. They index the first axis of target, which may differ from that of the dataset
+    if it stores a 3D array folded into 1D. Selecting scattered points or many small hyperslabs through HDF5 is
+    slow, so nearby rows are instead read together in blocks (see _take_read_gap)."""
+    if isinstance(dataset, DummyHDFData):
+        target[:] = dataset.value
+        return
+
+    if len(rows) == 0:
+        return
+
+    dataset_rows_per_row = max(int(np.prod(target.shape[1:], dtype=np.int64)) //
+                               int(np.prod(dataset.shape[1:], dtype=np.int64)), 1)
+    block_breaks = np.append(np.where(np.diff(rows) > _take_read_gap)[0] + 1, len(rows))
+
+    i = 0
+    while i < len(rows):
+        start = rows[i]
+        j = min(block_breaks[np.searchsorted(block_breaks, i, side='right')],
+                np.searchsorted(rows, start + _take_max_block_rows))
+        stop = rows[j - 1] + 1
+        block = dataset[start * dataset_rows_per_row:stop * dataset_rows_per_row]
+        target[i:j] = block.reshape((stop - start,) + target.shape[1:])[rows[i:j] - start]
+        i = j
+
+
+@shared.shared_array_remote
+def _read_hdf_dataset_into(target, filename, dataset_name):
+    """Read the named dataset from the named file into the shared-memory target array.
+
+    This runs in a worker process, so opens its own handle onto the file."""
+    with h5py.File(filename, 'r') as f:
+        dataset = f[dataset_name]
+        dataset.read_direct(target.reshape(dataset.shape))
+
+
 class GadgetHdfMultiFileManager:
     _nfiles_groupname = "Header"
     _nfiles_attrname = "NumFilesPerSnapshot"
     _size_from_hdf5_key = "ParticleIDs"
     _subgroup_name = None
 
-    def __init__(self, filename, mode='r') :
+    def __init__(self, filename, mode='r', take_region=None) :
         filename = str(filename)
         self._mode = mode
         if h5py.is_hdf5(filename):
@@ -94,6 +235,12 @@ class GadgetHdfMultiFileManager:
             self._filenames = [filename+"."+str(i)+".hdf5" for i in range(self._numfiles)]
 
         self._open_files = {}
+        self._hdf_vfile = None
+
+        if take_region is not None:
+            if mode != 'r':
+                raise ValueError("take_region can only be used when opening files read-only")
+            self._make_hdf_vfile_for_region(take_region)
 
     def __len__(self):
         return self._numfiles
@@ -115,11 +262,120 @@ class GadgetHdfMultiFileManager:
             return self._open_files[i]
 
     def iter_particle_groups_with_name(self, hdf_family_name):
-        for hdf in self:
+        if self._hdf_vfile is not None:
+            sources = [self._hdf_vfile]
+        else:
+            sources = self
+        for hdf in sources:
             if hdf_family_name in hdf:
                 if self._size_from_hdf5_key in hdf[hdf_family_name]:
                     yield hdf[hdf_family_name]
 
+    def _make_hdf_vfile_for_region(self, take_region):
+        """Make a virtual HDF5 file mapping onto those parts of the underlying files that lie in a region
+
+        The region is identified from an EAGLE-style Peano-Hilbert hash table, in which particles in each file
+        are sorted by the key of the hash cell in which they lie."""
+        file0 = self[0].parent
+        if 'HashTable' not in file0:
+            raise ValueError("take_region requires a snapshot with a Peano-Hilbert hash table, which this file "
+                             "does not have")
+        bits = int(file0['HashTable'].attrs['HashBits'])
+        boxsize = float(np.atleast_1d(file0['Header'].attrs['BoxSize'])[0])
+        region_starts, region_stops = _peano_key_ranges_intersecting_region(take_region, boxsize, bits)
+
+        sources = {}
+        for group_name in file0['HashTable']:
+            if isinstance(file0['HashTable'][group_name], h5py.Group):
+                sources[group_name] = self._generate_groups_and_slices_from_hash_table(group_name, region_starts,
+                                                                                      region_stops)
+        self._make_hdf_vfile_from_slices(sources)
+
+    def _make_hdf_vfile_from_slices(self, sources):
+        """Make a virtual HDF5 file mapping onto specified parts of the underlying files
+
+        *sources* is a dictionary mapping each particle group name onto a list of source groups, and a list of
+        the slices to take from each of them."""
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            tmpfile_path = os.path.join(tmpdirname, "nofile.hdf5")
+            with h5py.File(name=tmpfile_path, mode='w') as hdf_vfile:
+                # the header is needed e.g. to find particle masses stored in the MassTable
+                header = hdf_vfile.create_group('Header')
+                for k, v in self[0].parent['Header'].attrs.items():
+                    header.attrs[k] = v
+
+                for group_name, (source_groups, source_slices) in sources.items():
+                    if len(source_groups) > 0:
+                        target_group = hdf_vfile.create_group(group_name)
+                        self._make_hdf_group_with_slicing(source_groups, source_slices, target_group)
+
+            self._hdf_vfile = h5py.File(name=tmpfile_path, mode='r')
+            # on exiting the temporarydirectory context, the file/folder will be unlinked but we should
+            # be able to retain access for the lifetime of the hdf_vfile object
+
+    def _generate_groups_and_slices_from_hash_table(self, group_name, region_starts, region_stops):
+        table = self[0].parent['HashTable'][group_name]
+        first_key_in_file = table['FirstKeyInFile'][:].astype(np.int64)
+        last_key_in_file = table['LastKeyInFile'][:].astype(np.int64)
+        num_keys_in_file = table['NumKeysInFile'][:]
+
+        source_groups = []
+        source_slices = []
+
+        for i, hdf in enumerate(self):
+            if num_keys_in_file[i] == 0:
+                continue
+            first_key, last_key = first_key_in_file[i], last_key_in_file[i]
+
+            # find which of this file's hash cells are in the region, without tabulating the whole key space
+            in_region = np.zeros(last_key - first_key + 1, dtype=np.int64)
+            overlapping = (region_stops > first_key) & (region_starts <= last_key)
+            np.add.at(in_region, np.maximum(region_starts[overlapping], first_key) - first_key, 1)
+            ends = np.minimum(region_stops[overlapping], last_key + 1) - first_key
+            np.add.at(in_region, ends[ends < len(in_region)], -1)
+            in_region = np.cumsum(in_region) > 0
+
+            if not in_region.any():
+                continue
+
+            num_in_cell = hdf.parent['HashTable'][group_name]['NumParticleInCell'][:].astype(np.int64)
+            cell_stop = np.cumsum(num_in_cell)
+            cell_start = cell_stop - num_in_cell
+            take = in_region & (num_in_cell > 0)
+            starts, stops = _merge_contiguous_ranges(cell_start[take], cell_stop[take])
+
+            if len(starts) > 0:
+                source_groups.append(hdf[group_name])
+                source_slices.append([slice(start, stop) for start, stop in zip(starts, stops)])
+
+        return source_groups, source_slices
+
+    def _make_hdf_group_with_slicing(self, source_groups, source_slices, target_group):
+        total_len = 0
+        for take_slices in source_slices:
+            for s in take_slices:
+                assert s.step is None
+                total_len += s.stop - s.start
+
+        for array_name in source_groups[0]:
+            if isinstance(source_groups[0][array_name], h5py.Group):
+                # e.g. EAGLE element abundances are stored in a subgroup
+                self._make_hdf_group_with_slicing([g[array_name] for g in source_groups], source_slices,
+                                                  target_group.create_group(array_name))
+                continue
+
+            offset = 0
+            target_dims = (total_len,) + source_groups[0][array_name].shape[1:]
+            layout = h5py.VirtualLayout(shape=target_dims, dtype=source_groups[0][array_name].dtype)
+
+            for source_group, take_slices in zip(source_groups, source_slices):
+                source = h5py.VirtualSource(source_group[array_name])
+                for s in take_slices:
+                    layout[slice(offset, offset+s.stop-s.start)] = source[s]
+                    offset += s.stop-s.start
+
+            target_group.create_virtual_dataset(array_name, layout)
+
     def get_header_attrs(self):
         return self[0].parent['Header'].attrs
 
@@ -168,22 +424,72 @@ class GadgetHDFSnap(SimSnap):
     _size_from_hdf5_key = "ParticleIDs"
     _namemapper_config_section = "gadgethdf-name-mapping"
 
-    def __init__(self, filename, ):
+    reader_pool = None
+
+    def __init__(self, filename, take_region=None, take=None):
+        """Initialise a GadgetHDF snapshot
+
+        Parameters
+        ----------
+        filename : str
+            The filename of a single HDF5 file, or the stem of a set of files snap.0.hdf5, snap.1.hdf5, ...
+        take_region : pynbody.filt.Filter, optional
+            If set, load only particles in Peano-Hilbert hash cells intersecting the region described by the
+            filter (e.g. a Sphere or Cuboid). The filter must be specified in the units of positions on disk.
+            Some particles outside the region are also loaded, since whole hash cells are read. This is only
+            possible for snapshots carrying an EAGLE-style hash table.
+        take : array-like, optional
+            If set, load only the particles with these indices (relative to the full snapshot). The selection is
+            applied as each array is loaded, reading only those parts of each dataset around the selected
+            particles.
+        """
         super().__init__()
 
+        if take_region is not None and take is not None:
+            raise ValueError("Either take_region or take must be specified, not both")
+
         self._filename = filename
+        self._take_region = take_region
+        self._take = None if take is None else np.unique(np.asarray(take, dtype=np.int64))
+        self.partial_load = take is not None or take_region is not None
 
         self._init_hdf_filemanager(filename)
+        self.__setup_parallel_reading()
 
         self._translate_array_name = namemapper.AdaptiveNameMapper(self._namemapper_config_section)
         self._init_unit_information()
         self.__init_family_map()
         self.__init_file_map()
+        self._take_per_hdf_group = None
+        if take is not None:
+            self.__take_particles(self._take)
         self.__init_loadable_keys()
         self.__infer_mass_dtype()
         self._init_properties()
         self._decorate()
 
+    def __setup_parallel_reading(self):
+        if multiprocess_num > 1 and len(self._hdf_files) > 1:
+            # arrays must be in shared memory so that the worker processes can write into them
+            self._shared_arrays = True
+            if GadgetHDFSnap.reader_pool is None:
+                GadgetHDFSnap.reader_pool = multiprocessing.Pool(multiprocess_num)
+
+    def _iterate_chunks_from_disk(self, chunk_size):
+        """Yield snapshots of at most *chunk_size* consecutive particles, each partially loaded from disk with *take*.
+
+        If this snapshot was itself loaded with *take*, each chunk loads the corresponding part of the same selection.
+        A *take_region* cannot be combined with *take*, so in that case the snapshot is instead sliced in memory."""
+        if self._take_region is not None:
+            yield from super()._iterate_chunks_from_disk(chunk_size)
+            return
+
+        num_particles = len(self)
+        for i0 in range(0, num_particles, chunk_size):
+            i1 = min(i0 + chunk_size, num_particles)
+            take = np.arange(i0, i1) if self._take is None else self._take[i0:i1]
+            yield type(self)(self._filename, take=take)
+
     def _get_hdf_header_attrs(self):
         return self._hdf_files.get_header_attrs()
 
@@ -194,7 +500,7 @@ class GadgetHDFSnap(SimSnap):
         return self._hdf_files.get_unit_attrs()
 
     def _init_hdf_filemanager(self, filename):
-        self._hdf_files = self._multifile_manager_class(filename)
+        self._hdf_files = self._multifile_manager_class(filename, take_region=self._take_region)
 
     def __init_loadable_keys(self):
 
@@ -242,6 +548,32 @@ class GadgetHDFSnap(SimSnap):
 
         self._num_particles = family_slice_start
 
+    def __take_particles(self, take):
+        """Restrict the snapshot to the particles with the specified sorted, unique indices.
+
+        The indices within each HDF particle group are stored for use by _load_array, which reads only those
+        particles, and the family slices are updated to match."""
+        self._take_per_hdf_group = {}
+        family_slice_start = 0
+
+        for fam in self._families_ordered():
+            fam_slice = self._family_slice[fam]
+            take_this_fam = take[np.searchsorted(take, fam_slice.start):
+                                 np.searchsorted(take, fam_slice.stop)] - fam_slice.start
+            take_per_group = []
+            i0 = 0
+            for hdf in self._all_hdf_groups_in_family(fam):
+                i1 = i0 + hdf[self._size_from_hdf5_key].size
+                take_per_group.append(take_this_fam[np.searchsorted(take_this_fam, i0):
+                                                    np.searchsorted(take_this_fam, i1)] - i0)
+                i0 = i1
+
+            self._take_per_hdf_group[fam] = take_per_group
+            self._family_slice[fam] = slice(family_slice_start, family_slice_start + len(take_this_fam))
+            family_slice_start += len(take_this_fam)
+
+        self._num_particles = family_slice_start
+
     def __infer_mass_dtype(self):
         """Some files have a mixture of header-based masses and, for other partile types, explicit mass
         arrays. This routine decides in advance the correct dtype to assign to the mass array, whichever
@@ -299,6 +631,9 @@ class GadgetHDFSnap(SimSnap):
         raise RuntimeError("Not implemented")
 
     def write_array(self, array_name, fam=None, overwrite=False):
+        if self.partial_load:
+            raise RuntimeError("Writing back to partially loaded files not yet supported")
+
         translated_name = self._translate_array_name(array_name)
 
         self._hdf_files.reopen_in_mode('r+')
@@ -492,21 +827,46 @@ class GadgetHDFSnap(SimSnap):
             else:
                 target[array_name].set_default_units()
 
+            remote_reads = []
+
             for loading_fam in all_fams_to_load:
                 i0 = 0
-                for hdf in self._all_hdf_groups_in_family(loading_fam):
-                    npart = hdf['ParticleIDs'].size
+                for hdf_index, hdf in enumerate(self._all_hdf_groups_in_family(loading_fam)):
+                    if self._take_per_hdf_group is None:
+                        take = None
+                        npart = hdf['ParticleIDs'].size
+                    else:
+                        take = self._take_per_hdf_group[loading_fam][hdf_index]
+                        npart = len(take)
                     i1 = i0+npart
 
                     dataset = self._get_hdf_dataset(hdf, translated_name)
 
                     target_array = self[loading_fam][array_name][i0:i1]
-                    assert target_array.size == dataset.size
+                    assert take is not None or target_array.size == dataset.size
 
-                    dataset.read_direct(target_array.reshape(dataset.shape))
+                    if take is not None:
+                        _read_hdf_dataset_rows(dataset, take, target_array)
+                    elif self._can_read_remotely(dataset):
+                        remote_reads.append((target_array, dataset.file.filename, dataset.name))
+                    else:
+                        dataset.read_direct(target_array.reshape(dataset.shape))
 
                     i0 = i1
 
+            if len(remote_reads) > 0:
+                logger.info("Reading %s from %d files in parallel" % (array_name, len(remote_reads)))
+                shared.remote_map(self.reader_pool, _read_hdf_dataset_into, *zip(*remote_reads))
+
+    def _can_read_remotely(self, dataset):
+        """Returns True if the dataset can be read into a shared array by a worker process"""
+        if self.reader_pool is None or not self._shared_arrays:
+            return False
+        if isinstance(dataset, DummyHDFData) or dataset.is_virtual or dataset.size == 0:
+            return False
+        # the worker needs to be able to open the file for itself
+        return os.path.exists(dataset.file.filename)
+
     def __get_dtype_dims_and_units(self, fam, translated_name):
         if fam is None:
             fam = self.families()[0]
@@ -35,6 +35,8 @@ logger = logging.getLogger('pynbody.snapshot.ramses')
 multiprocess_num = int(config_parser.get('ramses', "parallel-read"))
 multiprocess = (multiprocess_num > 1)
 
+_cache_amr_index = config_parser.getboolean('ramses', 'cache-amr-index')
+
 if multiprocess:
     import multiprocessing
 
@@ -62,6 +64,76 @@ def _cpu_id(i):
     return str(i).rjust(5, "0")
 
 
+# The state diagram for the Hilbert curve used by RAMSES to order its domain decomposition, indexed by
+# [state, 0 for the next state or 1 for the Hilbert digit, binary digit]. This is transcribed from the
+# hilbert3d routine in RAMSES.
+_hilbert3d_state_diagram = np.array([
+    1, 2, 3, 2, 4, 5, 3, 5,   0, 1, 3, 2, 7, 6, 4, 5,
+    2, 6, 0, 7, 8, 8, 0, 7,   0, 7, 1, 6, 3, 4, 2, 5,
+    0, 9, 10, 9, 1, 1, 11, 11,   0, 3, 7, 4, 1, 2, 6, 5,
+    6, 0, 6, 11, 9, 0, 9, 8,   2, 3, 1, 0, 5, 4, 6, 7,
+    11, 11, 0, 7, 5, 9, 0, 7,   4, 3, 5, 2, 7, 0, 6, 1,
+    4, 4, 8, 8, 0, 6, 10, 6,   6, 5, 1, 2, 7, 4, 0, 3,
+    5, 7, 5, 3, 1, 1, 11, 11,   4, 7, 3, 0, 5, 6, 2, 1,
+    6, 1, 6, 10, 9, 4, 9, 10,   6, 7, 5, 4, 1, 0, 2, 3,
+    10, 3, 1, 1, 10, 3, 5, 9,   2, 5, 3, 4, 1, 6, 0, 7,
+    4, 4, 8, 8, 2, 7, 2, 3,   2, 1, 5, 6, 3, 0, 4, 7,
+    7, 2, 11, 2, 7, 5, 8, 5,   4, 5, 7, 6, 3, 2, 0, 1,
+    10, 3, 2, 6, 10, 3, 4, 4,   6, 1, 7, 0, 5, 2, 4, 3]).reshape((12, 2, 8))
+
+# The refinement level of the grid used to identify which Hilbert domains intersect a region (see
+# RamsesSnap's take_region argument). Higher levels give a tighter selection, at the cost of testing
+# 8**level cells for intersection with the region.
+_region_selection_level = 6
+
+
+def _hilbert3d(x, y, z, bit_length):
+    """Return the Hilbert keys of the cells with integer coordinates x, y, z (each from 0 to 2**bit_length-1),
+    as calculated by the hilbert3d routine in RAMSES"""
+    x, y, z = (np.asarray(q, dtype=np.int64) for q in (x, y, z))
+    state = np.zeros(x.shape, dtype=np.int64)
+    order = np.zeros(x.shape, dtype=np.int64)
+    for i in range(bit_length - 1, -1, -1):
+        digit = (((x >> i) & 1) << 2) | (((y >> i) & 1) << 1) | ((z >> i) & 1)
+        order = (order << 3) | _hilbert3d_state_diagram[state, 1, digit]
+        state = _hilbert3d_state_diagram[state, 0, digit]
+    return order
+
+
+def _hilbert_domains_intersecting_region(region, bound_keys, levelmax, boxlen, level=None):
+    """Return the (1-based) CPU numbers whose Hilbert domains intersect the region described by a filter.
+
+    *bound_keys* are the ncpu+1 domain boundaries from the RAMSES info file, and *boxlen* is the box size in
+    the units in which the filter is specified (i.e. RAMSES code units)."""
+
+    if level is None:
+        level = _region_selection_level
+    level = min(level, levelmax + 1)
+
+    ncell = 2 ** level
+    cell_x, cell_y, cell_z = (q.ravel() for q in np.meshgrid(*([np.arange(ncell)] * 3), indexing='ij'))
+    centroids = (np.stack((cell_x, cell_y, cell_z), axis=1) + 0.5) * (boxlen / ncell)
+
+    intersecting = np.where(region.cubic_cell_intersection(centroids))[0]
+
+    # each cell at this level covers a contiguous range of keys at the finest level, in which RAMSES
+    # specifies the domain boundaries
+    cell_keys = _hilbert3d(cell_x[intersecting], cell_y[intersecting], cell_z[intersecting], level)
+    dkey = (2.0 ** (levelmax + 1) / ncell) ** 3
+    key_min = cell_keys.astype(np.float64) * dkey
+    key_max = (cell_keys + 1).astype(np.float64) * dkey
+
+    ncpu = len(bound_keys) - 1
+    cpu_min = np.clip(np.searchsorted(bound_keys, key_min, side='right'), 1, ncpu)
+    cpu_max = np.clip(np.searchsorted(bound_keys, key_max, side='left'), 1, ncpu)
+
+    # mark every cpu between cpu_min and cpu_max (inclusive) for each cell
+    marks = np.zeros(ncpu + 2, dtype=np.int64)
+    np.add.at(marks, cpu_min, 1)
+    np.add.at(marks, cpu_max + 1, -1)
+    return list(np.where(np.cumsum(marks)[1:ncpu + 1] > 0)[0] + 1)
+
+
 @remote_exec
 def _cpui_count_particles_with_implicit_families(filename, distinguisher_field, distinguisher_type):
 
@@ -189,12 +261,62 @@ def _cpui_level_iterator(cpu, amr_filename, bisection_order, maxlevel, ndim):
                     f.skip(3 + ndim + 1 + 2 * ndim + 3 * 2 ** ndim)
 
 
-@remote_exec
-def _cpui_count_gas_cells(level_iterator_args):
-    ncell = 0
+def _cpui_leaf_cell_index_from_walk(level_iterator_args):
+    grids_per_level = []
+    leaf_masks = []
     for coords, refine, cpu, level in _cpui_level_iterator(*level_iterator_args):
-        ncell += (refine == 0).sum()
-    return ncell
+        while len(grids_per_level) <= level:
+            grids_per_level.append(0)
+        grids_per_level[level] += refine.shape[1]
+        leaf_masks.append(refine == 0)
+
+    ncell_per_grid = 2 ** level_iterator_args[4]
+    if len(leaf_masks) > 0:
+        leaf_mask = np.concatenate(leaf_masks, axis=1)
+    else:
+        leaf_mask = np.zeros((ncell_per_grid, 0), dtype=bool)
+    return np.array(grids_per_level, dtype=np.int64), leaf_mask
+
+
+def _leaf_cell_index_validation(amr_filename):
+    """Return values that must match between a saved leaf cell index and the AMR file for it to be reused"""
+    stat = os.stat(amr_filename)
+    return {'file_size': stat.st_size, 'file_mtime': stat.st_mtime}
+
+
+@remote_exec
+def _cpui_leaf_cell_index(level_iterator_args, index_filename=None):
+    """Return the index of leaf cells for one CPU, walking the AMR tree on disk only if necessary.
+
+    The index is a tuple of the number of grids at each level, and a boolean array of shape
+    (2**ndim, ngrids) which is True for cells that are not refined. Grids are in the order they appear
+    on disk, which is the same in the hydro, gravity and RT files. If *index_filename* is specified, the
+    index is read from that file if it exists and the AMR file has not changed since it was written (according
+    to its size and modification time), or otherwise written to it for future use."""
+
+    amr_filename = level_iterator_args[1]
+
+    if index_filename is not None and os.path.exists(index_filename):
+        try:
+            with np.load(index_filename) as data:
+                if all(data[k] == v for k, v in _leaf_cell_index_validation(amr_filename).items()):
+                    return data['grids_per_level'], data['leaf_mask']
+                logger.debug("AMR leaf cell index %s is out of date", index_filename)
+        except (OSError, ValueError, KeyError):
+            logger.warning("Unable to read AMR leaf cell index from %s; regenerating it", index_filename)
+
+    grids_per_level, leaf_mask = _cpui_leaf_cell_index_from_walk(level_iterator_args)
+
+    if index_filename is not None:
+        try:
+            tmp_filename = index_filename + ".tmp.npz"
+            np.savez(tmp_filename, grids_per_level=grids_per_level, leaf_mask=leaf_mask,
+                     **_leaf_cell_index_validation(amr_filename))
+            os.replace(tmp_filename, index_filename)
+        except OSError:
+            logger.warning("Unable to save AMR leaf cell index to %s", index_filename)
+
+    return grids_per_level, leaf_mask
 
 
 @remote_exec
@@ -230,13 +352,14 @@ _gv_load_rt = 2
 
 
 @remote_exec
-def _cpui_load_gas_vars(dims, maxlevel, ndim, filename, cpu, lia, i1,
+def _cpui_load_gas_vars(dims, maxlevel, ndim, filename, cpu, leaf_cell_index, i1,
                         mode=_gv_load_hydro):
 
     logger.info("Loading data from CPU %d", cpu)
 
     nvar = len(dims)
-    grid_info_iter = _cpui_level_iterator(*lia)
+    grids_per_level, leaf_mask = leaf_cell_index
+    grid_offset = 0
 
     with FortranFile(filename) as f:
         exact_nvar = False
@@ -273,20 +396,17 @@ def _cpui_load_gas_vars(dims, maxlevel, ndim, filename, cpu, lia, i1,
 
                 if ncache > 0:
                     if cpuf == cpu:
+                        assert level < len(grids_per_level) and grids_per_level[level] == ncache
+                        leaf = leaf_mask[:, grid_offset:grid_offset + ncache]
+                        grid_offset += ncache
 
-                        coords, refine, gi_cpu, gi_level = next(grid_info_iter)
-                        mark = np.where(refine == 0)
-
-                        assert gi_level == level
-                        assert gi_cpu == cpu
-
-                    if cpuf == cpu and len(mark[0]) > 0:
+                    if cpuf == cpu and leaf.any():
                         for icel in range(2 ** ndim):
                             i0 = i1
-                            i1 = i0 + (refine[icel] == 0).sum()
+                            i1 = i0 + leaf[icel].sum()
                             for ar in dims:
                                 ar[i0:i1] = f.read_vector(
-                                    _float_type)[(refine[icel] == 0)]
+                                    _float_type)[leaf[icel]]
 
                             f.skip(nvar_file - nvar)
 
@@ -389,6 +509,7 @@ class RamsesSnap(SimSnap):
         with_gas=True,
         force_gas=False,
         times_are_proper=None,
+        take_region=None,
     ):
         """
         Initialize a RamsesSnap.
@@ -415,6 +536,14 @@ class RamsesSnap(SimSnap):
             times. If False, they are assumed to be conformal. If
             unset, assume proper for non-cosmological simulations
             and conformal for cosmological ones.
+        take_region : pynbody.filt.Filter, optional
+            If set, load only the CPU domains which intersect the
+            region described by the filter (e.g. a Sphere), according
+            to the Hilbert domain decomposition recorded in the info
+            file. The filter must be specified in RAMSES code units
+            (i.e. the units of positions as loaded). All particles and
+            cells in the selected domains are loaded, so some lie
+            outside the region. Cannot be combined with cpus.
         """
 
         global config
@@ -443,7 +572,12 @@ class RamsesSnap(SimSnap):
 
         self._ndim = self._info['ndim']
         self.ncpu = self._info['ncpu']
-        if cpus is not None:
+        if cpus is not None and take_region is not None:
+            raise ValueError("Either cpus or take_region must be specified, not both")
+
+        if take_region is not None:
+            self._cpus = self._cpus_intersecting_region(take_region)
+        elif cpus is not None:
             self._cpus = cpus
         else:
             self._cpus = list(range(1, self.ncpu + 1))
@@ -477,6 +611,13 @@ class RamsesSnap(SimSnap):
         self._decorate()
         self._transfer_sink_data_to_family_array()
 
+    def _iterate_chunks_from_disk(self, chunk_size):
+        # each CPU's domain is loaded as a separate snapshot, regardless of chunk_size
+        has_gas = family.gas in self.families()
+        for cpu in self._cpus:
+            yield type(self)(self._filename, cpus=[cpu], maxlevel=self._maxlevel, with_gas=has_gas,
+                             force_gas=has_gas, times_are_proper=self.times_are_proper)
+
     def __setup_parallel_reading(self):
         if multiprocess:
             self._shared_arrays = True
@@ -516,6 +657,37 @@ class RamsesSnap(SimSnap):
         for block in self._rt_blocks:
             self._rt_blocks_3d.add(self._array_name_1D_to_ND(block) or block)
 
+    def _load_hilbert_bound_keys(self):
+        """Read the Hilbert key boundaries of the CPU domains from the info file"""
+        info_fname = os.path.join(self._filename, f"info_{self._timestep_id}.txt")
+        bound_keys = []
+        with open(info_fname) as f:
+            in_domain_table = False
+            for line in f:
+                words = line.split()
+                if in_domain_table and len(words) == 3:
+                    if len(bound_keys) == 0:
+                        bound_keys.append(float(words[1]))
+                    bound_keys.append(float(words[2]))
+                elif len(words) > 0 and words[0] == 'DOMAIN':
+                    in_domain_table = True
+        return np.array(bound_keys)
+
+    def _cpus_intersecting_region(self, region):
+        if self._info.get('ordering type') != 'hilbert':
+            raise ValueError("take_region is only supported for RAMSES outputs with Hilbert domain ordering")
+        if self._info['ndim'] != 3:
+            raise ValueError("take_region is only supported for three-dimensional RAMSES outputs")
+
+        bound_keys = self._load_hilbert_bound_keys()
+        if len(bound_keys) != self.ncpu + 1:
+            raise ValueError("Unable to read the Hilbert domain boundaries from the info file")
+
+        cpus = _hilbert_domains_intersecting_region(region, bound_keys, self._info['levelmax'],
+                                                    self._info['boxlen'])
+        logger.info("Loading %d of %d CPU domains intersecting %r" % (len(cpus), self.ncpu, region))
+        return cpus
+
     def _load_info_from_specified_file(self, lines):
         for line in lines:
             if '=' in line:
@@ -849,11 +1021,20 @@ class RamsesSnap(SimSnap):
 
         return npart - nstar, nstar
 
+    def _leaf_cell_index_filename(self, cpu):
+        if not _cache_amr_index:
+            return None
+        return self._amr_filename(cpu) + f".leafcells-{self._maxlevel or 'all'}.npz"
+
     def _count_gas_cells(self):
-        ncells = remote_map(self.reader_pool, _cpui_count_gas_cells,
-                            [self._cpui_level_iterator_args(xcpu) for xcpu in self._cpus])
-        self._gas_i0 = np.cumsum([0] + ncells)[:-1]
-        return np.sum(ncells)
+        # The AMR tree is walked once here, and the resulting leaf cell index re-used for all subsequent
+        # hydro, gravity and RT reads
+        self._gas_leaf_cell_index = remote_map(self.reader_pool, _cpui_leaf_cell_index,
+                                               [self._cpui_level_iterator_args(xcpu) for xcpu in self._cpus],
+                                               [self._leaf_cell_index_filename(xcpu) for xcpu in self._cpus])
+        self._gas_ncells = [int(leaf_mask.sum()) for _, leaf_mask in self._gas_leaf_cell_index]
+        self._gas_i0 = np.cumsum([0] + self._gas_ncells)[:-1]
+        return np.sum(self._gas_ncells)
 
     def _cpui_level_iterator_args(self, cpu=None):
         if cpu:
@@ -906,8 +1087,6 @@ class RamsesSnap(SimSnap):
             self.gas['rho'].set_default_units()
 
 
-        _grid_info_iter = self._level_iterator()
-
         logger.info("Loading %s files", ['hydro', 'grav', 'rt'][mode])
 
         filenamer = [self._hydro_filename, self._grav_filename, self._rt_filename][mode]
@@ -919,7 +1098,7 @@ class RamsesSnap(SimSnap):
                    [self._ndim] * len(self._cpus),
                    [filenamer(i) for i in self._cpus],
                    self._cpus,
-                   self._cpui_level_iterator_args(),
+                   self._gas_leaf_cell_index,
                    self._gas_i0,
                    [mode] * len(self._cpus))
 
@@ -993,12 +1172,8 @@ class RamsesSnap(SimSnap):
 
     def _load_gas_cpuid(self):
         gas_cpu_ar = self.gas['cpu']
-        i1 = 0
-        for coords, refine, cpu, level in self._level_iterator():
-            for cell in range(2 ** self._ndim):
-                i0 = i1
-                i1 = i0 + (refine[cell] == 0).sum()
-                gas_cpu_ar[i0:i1] = cpu
+        for cpu, i0, ncells in zip(self._cpus, self._gas_i0, self._gas_ncells):
+            gas_cpu_ar[i0:i0 + ncells] = cpu
 
     def loadable_keys(self, fam=None):
 
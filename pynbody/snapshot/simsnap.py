@@ -91,6 +91,9 @@ class SimSnap(ContainerWithPhysicalUnitsOption, iter_subclasses.IterableSubclass
     _loadable_keys_registry = {}
     _persistent = ["kdtree", "_immediate_cache", "_kdtree_derived_smoothing"]
 
+    # persistent objects which are only valid until the positions are next modified
+    _persistent_position_dependent = ["kdtree"]
+
     # These 3D arrays get four views automatically created, one reflecting the
     # full Nx3 data, the others reflecting Nx1 slices of it
     #
@@ -177,8 +180,18 @@ class SimSnap(ContainerWithPhysicalUnitsOption, iter_subclasses.IterableSubclass
         self._dependency_tracker = dependencytracker.DependencyTracker()
         self._immediate_cache_lock = threading.RLock()
 
+        # names of arrays which have been modified in memory since they were loaded; used to decide
+        # whether derived arrays can be stored in or retrieved from the on-disk cache
+        self._arrays_modified_since_load = set()
+
+        self.converting_units = util.ExecutionControl()
+        # used by SimArray.convert_units to flag that a modification does not change the physical values
+
         self._persistent_objects = {}
 
+        self._positions_version = 0
+        # incremented whenever positions are modified, to invalidate position-dependent persistent objects
+
         self._unifamily = None
 
         # If True, when new arrays are created they are in shared memory by
@@ -382,6 +395,9 @@ class SimSnap(ContainerWithPhysicalUnitsOption, iter_subclasses.IterableSubclass
         if name in self.family_keys():
             self.__load_remaining_families_if_loadable(name)
 
+        if name in self.family_keys():
+            self.__promote_family_array_if_complete(name)
+
         if name in self.family_keys():
             in_fam, out_fam = self.__get_included_and_excluded_families_for_array(name)
             raise KeyError("""{!r} is a family-level array for {}. To use it over the whole simulation you need either to delete it first, or create it separately for {}.""".format(
@@ -403,6 +419,16 @@ class SimSnap(ContainerWithPhysicalUnitsOption, iter_subclasses.IterableSubclass
             del self.ancestor[name]
 
 
+    def __promote_family_array_if_complete(self, name):
+        # Family arrays are normally promoted as soon as all families have them, but promotion can be deferred
+        # (see _create_family_array), in which case it is performed now that a simulation-level array is needed
+        anc = self.ancestor
+        name = self._array_name_1D_to_ND(name) or name
+        family_arrays = anc._family_arrays.get(name, {})
+        if all(fam in family_arrays for fam in anc.families()):
+            example = next(iter(family_arrays.values()))
+            anc._promote_family_array(name, ndim=example.shape[1] if example.ndim > 1 else 1)
+
     def __load_remaining_families_if_loadable(self, name):
         in_fam, out_fam = self.__get_included_and_excluded_families_for_array(name)
         try:
@@ -415,15 +441,32 @@ class SimSnap(ContainerWithPhysicalUnitsOption, iter_subclasses.IterableSubclass
 
     def _get_persist(self, hash, name):
         try:
-            return self._persistent_objects[hash][name]
+            obj = self._persistent_objects[hash][name]
         except Exception:
             return None
 
+        if name in self._persistent_position_dependent:
+            obj, positions_version = obj
+            if positions_version != self._positions_version:
+                del self._persistent_objects[hash][name]
+                return None
+
+        return obj
+
     def _set_persist(self, hash, name, obj=None):
         if hash not in self._persistent_objects:
             self._persistent_objects[hash] = {}
+        if name in self._persistent_position_dependent:
+            obj = (obj, self._positions_version)
         self._persistent_objects[hash][name] = obj
 
+    def _discard_stale_persistent_objects(self):
+        """Free position-dependent persistent objects (e.g. kdtrees) made stale by changes to the positions"""
+        for v in self._persistent_objects.values():
+            for name in self._persistent_position_dependent:
+                if name in v and v[name][1] != self._positions_version:
+                    del v[name]
+
     def _clear_immediate_mode(self):
         for k, v in self._persistent_objects.items():
             if '_immediate_cache' in v:
@@ -538,6 +581,17 @@ class SimSnap(ContainerWithPhysicalUnitsOption, iter_subclasses.IterableSubclass
         an auxiliary file."""
         return []
 
+    def _iterate_chunks_from_disk(self, chunk_size):
+        """Yield snapshots which together contain all particles in this snapshot, in order, each of roughly
+        *chunk_size* particles or fewer.
+
+        This is used by out-of-core analysis (e.g. :class:`pynbody.analysis.profile.StreamingProfile`). Formats
+        which support partial loading override this so that each chunk is loaded separately from disk, and is freed
+        once the caller has finished with it. This default implementation simply slices the snapshot, so that
+        arrays are loaded in their entirety."""
+        for i0 in range(0, len(self), chunk_size):
+            yield self[i0:i0 + chunk_size]
+
     def derivable_keys(self):
         """Returns a list of arrays which can be lazy-evaluated."""
         res = []
@@ -857,11 +911,15 @@ class SimSnap(ContainerWithPhysicalUnitsOption, iter_subclasses.IterableSubclass
                            for fami in family._registry}
         pre_fam_keys = fk()
 
-        with self.delay_promotion:
+        with self.delay_promotion, self.auto_propagate_off:
             # delayed promotion is required here, otherwise units get messed up when
             # a simulation array gets promoted mid-way through our loading process.
             #
             # see the gadget unit test, test_unit_persistence
+            #
+            # auto-propagation is switched off because freshly-loaded data cannot invalidate
+            # anything; but derived arrays retrieved from the on-disk cache may already be
+            # registered as depending on arrays that have not yet been loaded.
             if fam is not None:
                 self._load_array(array_name, fam)
             else:
@@ -889,6 +947,13 @@ class SimSnap(ContainerWithPhysicalUnitsOption, iter_subclasses.IterableSubclass
                         anc[f][v].units = anc._default_units_for(v)
                     anc._autoconvert_array_unit(anc[f][v])
 
+            # Writing the loaded data into the new arrays flagged them as modified, but they are of course
+            # now identical to what is on disk
+            for v in new_keys:
+                anc._arrays_modified_since_load.discard(self._array_name_1D_to_ND(v) or v)
+            for vals in new_fam_keys.values():
+                anc._arrays_modified_since_load.difference_update(vals)
+
 
 
     ############################################
@@ -1108,10 +1173,16 @@ class SimSnap(ContainerWithPhysicalUnitsOption, iter_subclasses.IterableSubclass
                 self._arrays[a]._name = a
 
     def _create_family_array(self, array_name, family, ndim=1, dtype=None, derived=False, shared=None,
-                             source_array=None):
+                             source_array=None, promote=True):
         """Create a single array of dimension len(self.<family.name>) x ndim,
         with a given numpy dtype, belonging to the specified family. For arguments
-        other than *family*, see the documentation for :func:`~pynbody.snapshot.SimSnap._create_array`.
+        other than *family* and *promote*, see the documentation for
+        :func:`~pynbody.snapshot.SimSnap._create_array`.
+
+        If *promote* is False, the family array is created even if all families then have an array
+        of this name. The family arrays are only conjoined into a simulation-level array if that is
+        accessed. This is used when the family arrays are views that should not be copied unless
+        necessary (e.g. memory-mapped files).
 
         Warning: Do not assume that the family array will be available after
         calling this funciton, because it might be a 'completion' of existing
@@ -1134,7 +1205,7 @@ class SimSnap(ContainerWithPhysicalUnitsOption, iter_subclasses.IterableSubclass
         NDname = self._array_name_1D_to_ND(array_name)
         if NDname:
             self._create_family_array(
-                NDname, family, ndim=3, dtype=dtype, derived=derived)
+                NDname, family, ndim=3, dtype=dtype, derived=derived, promote=promote)
             return
 
         self_families = self.families()
@@ -1169,7 +1240,7 @@ class SimSnap(ContainerWithPhysicalUnitsOption, iter_subclasses.IterableSubclass
             raise ValueError("Requested data type {!r} is not consistent with existing data type {!r} for family array {!r}".format(
                 str(dtype), str(dtx), array_name))
 
-        if all([x in fams for x in self_families]):
+        if promote and all([x in fams for x in self_families]):
             # If, once we created this array, *all* families would have
             # this array, just create a simulation-level array
             if self._promote_family_array(array_name, ndim=ndim, derived=derived, shared=shared) is not None:
@@ -1470,7 +1541,7 @@ class SimSnap(ContainerWithPhysicalUnitsOption, iter_subclasses.IterableSubclass
             logger.info("Deriving array %s" % name)
             with self.auto_propagate_off:
                 if fam is None:
-                    result = fn(self)
+                    result = self._calculate_or_retrieve_derived_array(fn, name)
                     ndim = result.shape[-1] if len(
                         result.shape) > 1 else 1
                     self._create_array(
@@ -1478,7 +1549,7 @@ class SimSnap(ContainerWithPhysicalUnitsOption, iter_subclasses.IterableSubclass
                     write_array = self._get_array(
                         name, always_writable=True)
                 else:
-                    result = fn(self[fam])
+                    result = self._calculate_or_retrieve_derived_array(fn, name, fam)
                     ndim = result.shape[-1] if len(
                         result.shape) > 1 else 1
 
@@ -1504,6 +1575,36 @@ class SimSnap(ContainerWithPhysicalUnitsOption, iter_subclasses.IterableSubclass
                 if units.has_units(result):
                     write_array.units = result.units
 
+                if self._depends_on_modified_array(name):
+                    self.ancestor._arrays_modified_since_load.add(name)
+                else:
+                    self.ancestor._arrays_modified_since_load.discard(name)
+
+    def _depends_on_modified_array(self, name):
+        """Returns True if any array that the named array depends on, directly or indirectly, has been modified
+        since it was loaded from disk"""
+        modified = self.ancestor._arrays_modified_since_load
+        return any((self._array_name_1D_to_ND(d) or d) in modified
+                   for d in self._dependency_tracker.get_all_dependencies(name))
+
+    def _calculate_or_retrieve_derived_array(self, fn, name, fam=None):
+        """Call the deriving function *fn* for array *name*, or retrieve its result from the derived array cache.
+
+        For more information see :mod:`pynbody.snapshot.derived_array_cache`."""
+        from .derived_array_cache import DerivedArrayCache
+
+        cache = DerivedArrayCache.for_snapshot(self)
+        if cache is not None:
+            result = cache.retrieve(self, name, fam)
+            if result is not None:
+                return result
+
+        result = fn(self if fam is None else self[fam])
+
+        if cache is not None:
+            cache.store(self, name, fam, result)
+
+        return result
 
 
 
@@ -1513,10 +1614,12 @@ class SimSnap(ContainerWithPhysicalUnitsOption, iter_subclasses.IterableSubclass
         quantities which depend on it"""
 
         name = self._array_name_1D_to_ND(name) or name
+        if not self.converting_units:
+            self.ancestor._arrays_modified_since_load.add(name)
+
         if name=='pos':
-            for v in self.ancestor._persistent_objects.values():
-                if 'kdtree' in v:
-                    del v['kdtree']
+            self.ancestor._positions_version += 1
+            self.ancestor._discard_stale_persistent_objects()
 
         if not self.auto_propagate_off:
             for d_ar in self._dependency_tracker.get_dependents(name):
@@ -1598,7 +1701,7 @@ class SimSnap(ContainerWithPhysicalUnitsOption, iter_subclasses.IterableSubclass
     # KD-Tree
     ############################################
 
-    def build_tree(self, num_threads=None, shared_mem=None):
+    def build_tree(self, num_threads=None, shared_mem=None, cache_path=None):
         """Build a kdtree for SPH operations and for accelerating geometrical filters
 
         Parameters
@@ -1611,16 +1714,57 @@ class SimSnap(ContainerWithPhysicalUnitsOption, iter_subclasses.IterableSubclass
             Whether to use shared memory for the tree. This is used by the tangos library to
             share a kdtree between different processes. It is not recommended for general use,
             and defaults to False.
+        cache_path : str, pathlib.Path or bool, optional
+            If specified, the tree is stored in this directory once built. When a tree is next requested with
+            the same *cache_path*, it is memory-mapped from disk instead of being rebuilt, provided that the
+            particle positions are unchanged (which is verified by a checksum). If True, a sidecar directory
+            alongside the snapshot file is used, named ``<filename>.kdtree`` for the full snapshot and
+            ``<filename>.kdtree-<hash>`` for a sub-snapshot (where the hash identifies the particles it contains).
+            Cannot be combined with *shared_mem*.
         """
         if not hasattr(self, 'kdtree'):
             from .. import kdtree
             from ..configuration import config
             boxsize = self._get_boxsize_for_kdtree()
+            leafsize = config['sph']['tree-leafsize']
+
+            if cache_path is not None and cache_path is not False:
+                if shared_mem:
+                    raise ValueError("A cached kdtree cannot be placed in shared memory")
+                cache_path = self._get_kdtree_cache_path(cache_path)
+                checksum = kdtree.positions_checksum(self['pos'], leafsize, boxsize)
+                try:
+                    self.kdtree = kdtree.KDTree.load(cache_path, self['pos'], self['mass'], checksum=checksum,
+                                                     num_threads=num_threads, boxsize=boxsize)
+                    return
+                except (OSError, ValueError) as e:
+                    logger.info("Unable to use cached kdtree from %s (%s); building a new one" % (cache_path, e))
+            else:
+                cache_path = None
+
             self.kdtree = kdtree.KDTree(self['pos'], self['mass'],
-                                        leafsize=config['sph']['tree-leafsize'],
+                                        leafsize=leafsize,
                                         boxsize=boxsize, num_threads=num_threads,
                                         shared_mem=shared_mem)
 
+            if cache_path is not None:
+                try:
+                    self.kdtree.save(cache_path, checksum)
+                except OSError as e:
+                    logger.warning("Unable to save kdtree to %s: %s" % (cache_path, e))
+
+    def _get_kdtree_cache_path(self, cache_path):
+        if cache_path is True:
+            filename = self.ancestor._filename
+            if not filename or not pathlib.Path(filename).exists():
+                raise ValueError("Cannot choose a kdtree cache path for a snapshot that was not loaded from disk")
+            path = str(filename) + ".kdtree"
+            if self is not self.ancestor:
+                # sub-snapshots each get their own tree, so must not share a directory with the ancestor's
+                path += "-" + self._inclusion_hash.hex()
+            return pathlib.Path(path)
+        return pathlib.Path(cache_path)
+
     def import_tree(self, serialized_tree, num_threads=None):
         """Import a precomputed kdtree from a serialized form.
 
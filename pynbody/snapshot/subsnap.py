@@ -9,7 +9,7 @@ class ExposedBaseSnapshotMixin:
     _inherited = ["_immediate_cache_lock",
                   "lazy_off", "lazy_derive_off", "lazy_load_off", "auto_propagate_off",
                   "properties", "_derived_array_names", "_family_derived_array_names",
-                  "_dependency_tracker", "immediate_mode", "delay_promotion"]
+                  "_dependency_tracker", "immediate_mode", "delay_promotion", "converting_units"]
 
     def __init__(self, base, *args, **kwargs):
         self.base = base
@@ -6,6 +6,7 @@ import h5py
 import numpy as np
 
 from .. import halo, units, util
+from . import SimSnap
 from .gadgethdf import GadgetHdfMultiFileManager, GadgetHDFSnap
 
 
@@ -53,11 +54,6 @@ class SwiftMultiFileManager(GadgetHdfMultiFileManager):
     def is_virtual(self):
         return self[0].parent['Header'].attrs['Virtual'][0] == 1
 
-    def iter_particle_groups_with_name(self, hdf_family_name):
-        if hdf_family_name in self._hdf_vfile:
-            if self._size_from_hdf5_key in self._hdf_vfile[hdf_family_name]:
-                yield self._hdf_vfile[hdf_family_name]
-
     def _all_group_names(self):
         return self[0]['Cells/Counts'].keys()
 
@@ -114,26 +110,6 @@ class SwiftMultiFileManager(GadgetHdfMultiFileManager):
 
         return source_groups, source_slices
 
-    def _make_hdf_group_with_slicing(self, source_groups, source_slices, target_group):
-        total_len = 0
-        for take_slices in source_slices:
-            for s in take_slices:
-                assert s.step is None
-                total_len += s.stop - s.start
-
-        for array_name in source_groups[0]:
-            offset = 0
-            target_dims = (total_len,) + source_groups[0][array_name].shape[1:]
-            layout = h5py.VirtualLayout(shape=target_dims, dtype=source_groups[0][array_name].dtype)
-
-            for source_group, take_slices in zip(source_groups, source_slices):
-                source = h5py.VirtualSource(source_group[array_name])
-                for s in take_slices:
-                    layout[slice(offset, offset+s.stop-s.start)] = source[s]
-                    offset += s.stop-s.start
-
-            target_group.create_virtual_dataset(array_name, layout)
-
 
 class ExtractScalarWrapper:
     def __init__(self, underlying):
@@ -157,10 +133,19 @@ class SwiftSnap(GadgetHDFSnap):
 
     _namemapper_config_section = 'swift-name-mapping'
 
-    def __init__(self, filename, take_swift_cells=None, take_region=None):
+    def __init__(self, filename, take_swift_cells=None, take_region=None, take=None):
+        if take_swift_cells is not None and take is not None:
+            raise ValueError("Either take_swift_cells or take must be specified, not both")
         self._take_swift_cells = take_swift_cells
-        self._take_region = take_region
-        super().__init__(filename)
+        super().__init__(filename, take_region=take_region, take=take)
+        self.partial_load = self.partial_load or take_swift_cells is not None
+
+    def _iterate_chunks_from_disk(self, chunk_size):
+        if self._take_swift_cells is not None:
+            # a selection of cells cannot be combined with take, so fall back to slicing the snapshot in memory
+            yield from SimSnap._iterate_chunks_from_disk(self, chunk_size)
+        else:
+            yield from super()._iterate_chunks_from_disk(chunk_size)
 
 
     def _init_hdf_filemanager(self, filename):
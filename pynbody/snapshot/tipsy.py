@@ -15,6 +15,17 @@ automatically via pynbody.load.
 specified, the loader will look for a file `*.param` in the current and
 parent directories.
 
+*memmap*: if True, the main file is memory-mapped rather than read into
+memory. Each family's arrays are then views onto the mapped file, so that
+only the parts of the file actually used are read from disk. Writing to
+the arrays is permitted, but changes stay in memory and are never saved
+to the file. Arrays keep the precision they have on disk (usually single
+precision). Simulation-level arrays (e.g. ``f['pos']`` rather than
+``f.dm['pos']``) are assembled into ordinary in-memory arrays when first
+accessed. Memory-mapping is only possible for uncompressed files with the
+native byte order; otherwise a warning is issued and the file is loaded
+normally.
+
 """
 
 import copy
@@ -55,8 +66,13 @@ class TipsySnap(SimSnap):
 
         must_have_paramfile = kwargs.get('must_have_paramfile', False)
         take = kwargs.get('take', None)
+        memmap = kwargs.get('memmap', False)
 
         self.partial_load = take is not None
+        self._take = None if take is None else np.asarray(take)
+
+        # retained so that chunks loaded by _iterate_chunks_from_disk are opened with the same options
+        self._constructor_kwargs = {k: v for k, v in kwargs.items() if k not in ('take', 'only_header')}
 
         self._filename = str(util.cutgz(filename))
 
@@ -82,6 +98,9 @@ class TipsySnap(SimSnap):
                                   family.star: slice(nd + ng, ng + nd + ns)})
 
         self._load_control = chunk.LoadControl(disk_family_slice, 10240, take)
+        self._disk_family_slice = disk_family_slice
+
+        self._memmap = memmap and self._can_memmap(filename, take)
 
         self._family_slice = self._load_control.mem_family_slice
         self._num_particles = self._load_control.mem_num_particles
@@ -129,7 +148,25 @@ class TipsySnap(SimSnap):
         if time_unit is not None:
             self.properties['time'] *= time_unit
 
+    def _can_memmap(self, filename, take):
+        reason = None
+        if take is not None:
+            reason = "partial loading is in use"
+        elif self._byteswap:
+            reason = "the file byte order is not native"
+        elif str(filename).endswith(".gz") or not os.path.exists(self._filename):
+            reason = "the file is compressed"
+
+        if reason is not None:
+            warnings.warn("Cannot memory-map %s because %s; loading normally instead" % (filename, reason),
+                          RuntimeWarning)
+            return False
+        return True
+
     def _load_main_file(self):
+        if self._memmap:
+            self._map_main_file()
+            return
 
         logger.info("Loading data from main file %s", self._filename)
 
@@ -209,6 +246,56 @@ class TipsySnap(SimSnap):
 
         f.close()
 
+    def _map_main_file(self):
+        """Expose the main file arrays as per-family views on a copy-on-write memory map of the file"""
+
+        logger.info("Memory-mapping data from main file %s", self._filename)
+
+        vector_fields = {'pos': ('x', 'y', 'z'), 'vel': ('vx', 'vy', 'vz')}
+        scalar_fields = ('mass', 'eps', 'phi', 'rho', 'temp', 'metals', 'tform')
+
+        offset = 32
+        for fam, dtype in ((family.gas, self._g_dtype), (family.dm, self._d_dtype), (family.star, self._s_dtype)):
+            num_particles = self._disk_family_slice[fam].stop - self._disk_family_slice[fam].start
+            if num_particles == 0:
+                continue
+
+            mapped = np.memmap(self._filename, dtype=dtype, mode='c', offset=offset, shape=(num_particles,))
+            offset += num_particles * dtype.itemsize
+
+            self_fam = self[fam]
+            existing_keys = self_fam.keys()
+
+            views = {}
+            for name, components in vector_fields.items():
+                first_component = mapped[components[0]]
+                views[name] = np.lib.stride_tricks.as_strided(first_component, shape=(num_particles, 3),
+                                                              strides=(dtype.itemsize, first_component.itemsize))
+            for name in scalar_fields:
+                if name in dtype.names:
+                    views[name] = mapped[name]
+
+            for name, view in views.items():
+                if name in existing_keys:
+                    continue
+                view = view.view(array.SimArray)
+                self._create_family_array(name, fam, ndim=view.shape[1] if view.ndim > 1 else 1,
+                                          dtype=view.dtype, source_array=view, promote=False)
+                ar = self_fam[name]
+                if name == 'temp':
+                    ar.units = "K"
+                else:
+                    ar.set_default_units(quiet=True)
+                if name == 'phi' and 'h' in self.properties:
+                    ar.units = ar.units * units.a ** -3
+
+    def _iterate_chunks_from_disk(self, chunk_size):
+        num_particles = len(self) if self._take is None else len(self._take)
+        for i0 in range(0, num_particles, chunk_size):
+            i1 = min(i0 + chunk_size, num_particles)
+            take = np.arange(i0, i1) if self._take is None else self._take[i0:i1]
+            yield type(self)(self._filename, take=take, **self._constructor_kwargs)
+
     def _update_loadable_keys(self):
         def is_readable_array(x):
             try:
@@ -38,6 +38,14 @@ def _get_threaded_image():
 
 _threaded_image = _get_threaded_image()
 _approximate_image = config_parser.getboolean('sph', 'approximate-fast-images')
+_tiled_image = config_parser.getboolean('sph', 'tiled-image')
+
+# the width and height, in pixels, of the tiles used by the tiled renderer
+_image_tile_size = 64
+
+# the number of slabs per thread used by the slab-decomposed 3D grid renderer; more than one allows
+# the work to be balanced between threads when particles are unevenly distributed
+_grid_slabs_per_thread = 4
 
 def _kernel_suitable_for_denoise(kernel):
     if type(kernel) is not Kernel:
@@ -189,6 +197,89 @@ class TopHatKernel:
         return code
 
 
+def interpolate(snap, qty, points, kernel=Kernel(), nsmooth=None, out_units=None):
+    """Interpolate an SPH quantity to arbitrary positions, using a 'gather' scheme.
+
+    At each point, the smoothing length is taken to be half the distance to the *nsmooth*-th nearest particle
+    (consistent with the definition of the ``smooth`` array), and the (mass/rho)-weighted kernel sum over those
+    neighbours is returned. The cost therefore scales as the number of points times the number of neighbours,
+    independent of the total volume spanned by the points, making this suitable for sightlines or adaptively
+    placed samples where a full :func:`render_image` or :func:`to_3d_grid` would be wasteful.
+
+    The neighbour search uses the snapshot's KD-tree (built if necessary) and runs on multiple threads.
+
+    **Arguments:**
+
+    *snap*: The snapshot (or sub-snapshot, e.g. ``f.gas``) containing the SPH particles
+
+    *qty*: The name of the array to interpolate
+
+    *points*: Nx3 array of positions. If it has units, it is converted into the units of the snapshot positions;
+      otherwise it is assumed to be in those units already.
+
+    **Keyword arguments:**
+
+    *kernel*: The 3D Kernel object to use (default Kernel(), a 3D spline kernel)
+
+    *nsmooth*: The number of neighbours to gather at each point (default from the configuration, as used for
+      the ``smooth`` array)
+
+    *out_units*: The units to convert the output into (default: no conversion)
+    """
+
+    if kernel.h_power != 3:
+        raise ValueError("Interpolation requires a 3D kernel")
+
+    if nsmooth is None:
+        nsmooth = config['sph']['smooth-particles']
+
+    snap.build_tree()
+
+    pos = snap['pos']
+    qty_ar = snap[qty]
+    mass = snap['mass']
+    rho = snap['rho']
+
+    if units.has_units(points):
+        points = points.in_units(pos.units, **pos.conversion_context())
+    points = np.asarray(points)
+    if points.ndim != 2 or points.shape[1] != 3:
+        raise ValueError("Points must be an Nx3 array")
+
+    # per-particle weight (m/rho) q, in the original units; the unit correction is applied at the end
+    weighted_qty = (mass.view(np.ndarray) / rho.view(np.ndarray))
+    weighted_qty = weighted_qty.reshape(weighted_qty.shape + (1,) * (qty_ar.ndim - 1)) * qty_ar.view(np.ndarray)
+
+    # get_samples tabulates the kernel at (d/h)^2 = 0, 0.02, ..., 4
+    samples = kernel.get_samples(dtype=np.float64)
+    sample_d2_over_h2 = np.linspace(0, 4.0, len(samples))
+
+    result = np.empty((len(points),) + qty_ar.shape[1:], dtype=np.float64)
+
+    for start in range(0, len(points), _interpolate_chunk_size):
+        end = min(start + _interpolate_chunk_size, len(points))
+        neighbours, distances = snap.kdtree.query(points[start:end], nsmooth)
+        h = distances[:, -1].astype(np.float64) / kernel.max_d
+        h[h == 0] = np.finfo(np.float64).tiny
+        weights = np.interp((distances / h[:, np.newaxis]) ** 2, sample_d2_over_h2, samples, right=0.0)
+        weights /= h[:, np.newaxis] ** 3
+        result[start:end] = np.einsum('ij,ij...->i...', weights, weighted_qty[neighbours])
+
+    result = result.view(array.SimArray)
+
+    # as for render_image, there is a factor of (M_u/rho_u)/h_u^3 which is dimensionless but may not be 1
+    result *= (mass.units / rho.units).ratio(pos.units ** 3, **pos.conversion_context())
+    result.units = qty_ar.units
+    result.sim = snap
+
+    if out_units is not None:
+        result.convert_units(out_units)
+
+    return result
+
+_interpolate_chunk_size = 100000
+
+
 def render_spherical_image(snap, qty='rho', nside=8, distance=10.0, kernel=Kernel(),
                            kstep=0.5, denoise=None, out_units=None, threaded=None):
     """Render an SPH image on a spherical surface. Requires healpy libraries.
@@ -372,7 +463,12 @@ def _interpolated_renderer(fn, levels):
             kwargs['res_downgrade'] = sub
             new_im = fn(*args, **kwargs)
             zoom = [float(x)/y for x,y in zip(base.shape, new_im.shape)]
-            base += scipy.ndimage.zoom(new_im, zoom, order=1)
+            if new_im.ndim == 3 and zoom[0] == 1:
+                # a stack of images (see render_images); zooming each separately is equivalent, but faster
+                for base_slice, new_slice in zip(base, new_im):
+                    base_slice += scipy.ndimage.zoom(new_slice, zoom[1:], order=1)
+            else:
+                base += scipy.ndimage.zoom(new_im, zoom, order=1)
         return base
     return render_fn
 
@@ -395,7 +491,8 @@ def render_image(snap, qty='rho', x2=100, nx=500, y2=None, ny=None, x1=None,
                  force_quiet=False,
                  approximate_fast=_approximate_image,
                  threaded=None,
-                 denoise=None):
+                 denoise=None,
+                 tiled=None):
     """
     Render an SPH image using a typical (mass/rho)-weighted 'scatter'
     scheme.
@@ -452,6 +549,13 @@ def render_image(snap, qty='rho', x2=100, nx=500, y2=None, ny=None, x1=None,
      *threaded*: if False (or None), render on a single core. Otherwise,
       the number of threads to use (defaults to a value specified in your
       configuration files).
+
+     *tiled*: if True, sort the particles spatially (in Morton order) and divide the
+      image into tiles, each of which is rendered by a single thread. Unlike the
+      default threaded renderer, only one copy of the image is held in memory and
+      the threads do not need to hold the GIL, so this scales better to large images
+      and many cores. Not available for perspective (z_camera) images. Defaults to
+      the tiled-image option in your configuration file.
     """
 
     if denoise is None:
@@ -470,7 +574,19 @@ def render_image(snap, qty='rho', x2=100, nx=500, y2=None, ny=None, x1=None,
     if threaded is None:
         threaded = _get_threaded_image()
 
-    if threaded:
+    if tiled is None:
+        tiled = _tiled_image
+
+    if tiled and z_camera:
+        # perspective images have a different pixel scale for each particle, which the tiled renderer does
+        # not support
+        tiled = False
+
+    if tiled:
+        im = base_renderer(snap, qty, x2, nx, y2, ny, x1, y1, z_plane,
+                           out_units, xy_units, kernel, z_camera, smooth,
+                           smooth_in_pixels, False, tiled_num_threads=int(threaded or 1))
+    elif threaded:
         im = _threaded_render_image(base_renderer, snap, qty, x2, nx, y2, ny, x1, y1, z_plane,
                                     out_units, xy_units, kernel, z_camera, smooth,
                                     smooth_in_pixels, True,
@@ -485,7 +601,7 @@ def render_image(snap, qty='rho', x2=100, nx=500, y2=None, ny=None, x1=None,
         snap['__denoise_one'] = 1
         im2 = render_image(snap, '__denoise_one', x2, nx, y2, ny, x1, y1, z_plane, None,
                            xy_units, kernel, z_camera, smooth, smooth_in_pixels,
-                           force_quiet, approximate_fast, threaded, False)
+                           force_quiet, approximate_fast, threaded, False, tiled)
         del snap.ancestor['__denoise_one']
         im2 = im / im2
         im2.units = im.units
@@ -495,13 +611,210 @@ def render_image(snap, qty='rho', x2=100, nx=500, y2=None, ny=None, x1=None,
         return im
 
 
+def render_images(snap, qtys, x2=100, nx=500, y2=None, ny=None, x1=None,
+                  y1=None, z_plane=0.0, out_units=None, xy_units=None,
+                  kernel=Kernel(),
+                  z_camera=None,
+                  smooth='smooth',
+                  smooth_in_pixels=False,
+                  force_quiet=False,
+                  approximate_fast=_approximate_image,
+                  threaded=None,
+                  denoise=None,
+                  tiled=None):
+    """
+    Render SPH images of several quantities at once.
+
+    The result is the same as calling :func:`render_image` for each quantity, but the particles are
+    visited only once, with the kernel footprint of each particle being calculated once and then deposited
+    for all quantities. This is useful for e.g. multi-band images or weighted averages.
+
+    **Keyword arguments:**
+
+    *qtys*: A list of the names of the arrays within the simulation to render
+
+    *out_units* (no conversion): The units to convert the output images into. Either a single unit,
+      applied to all images, or a list of units (or None) of the same length as *qtys*.
+
+    *denoise*: if True, divide each image through by an estimate of the discreteness noise,
+      which is rendered in the same pass as the images.
+
+    The remaining arguments are as for :func:`render_image`. The tiled renderer is always used (so
+    *tiled* is ignored), except for perspective images (i.e. if *z_camera* is specified), for which each
+    quantity is rendered separately using :func:`render_image`.
+
+    **Returns:** A list of images (SimArrays), one for each quantity, which are views on a single
+    stacked array.
+    """
+
+    qtys = list(qtys)
+
+    if out_units is None or isinstance(out_units, (str, units.UnitBase)):
+        out_units = [out_units] * len(qtys)
+    elif len(out_units) != len(qtys):
+        raise ValueError("out_units must be a single unit or a list of the same length as qtys")
+
+    out_units = [units.Unit(u) if isinstance(u, str) else u for u in out_units]
+
+    if z_camera:
+        return [render_image(snap, qty, x2, nx, y2, ny, x1, y1, z_plane, qty_out_units, xy_units, kernel,
+                             z_camera, smooth, smooth_in_pixels, force_quiet, approximate_fast, threaded, denoise,
+                             tiled)
+                for qty, qty_out_units in zip(qtys, out_units)]
+
+    if denoise is None:
+        denoise = _auto_denoise(snap, kernel)
+
+    if denoise and not _kernel_suitable_for_denoise(kernel):
+        raise ValueError("Denoising not supported with this kernel type. Re-run with denoise=False")
+
+    if threaded is None:
+        threaded = _get_threaded_image()
+
+    if xy_units is None:
+        xy_units = snap['x'].units
+
+    sm_units = snap[smooth].units if smooth_in_pixels else xy_units
+    mass_units = snap['mass'].units
+    rho_units = snap['rho'].units
+
+    # the units of each image, and the ratio by which the raw image must be multiplied to express it
+    # in those units (see _render_image)
+    image_units = []
+    ratios = []
+    for qty, qty_out_units in zip(qtys, out_units):
+        if qty_out_units is None:
+            image_units.append(snap[qty].units * snap['x'].units ** (3 - kernel.h_power))
+            ratios.append((mass_units / rho_units).ratio(snap['x'].units ** 3, **snap['x'].conversion_context()))
+        else:
+            image_units.append(qty_out_units)
+            ratios.append((snap[qty].units * mass_units / (rho_units * sm_units ** kernel.h_power)).ratio(
+                qty_out_units, **snap.conversion_context()))
+
+    if denoise:
+        snap['__denoise_one'] = 1
+        qtys.append('__denoise_one')
+        ratios.append(1.0)
+
+    try:
+        if approximate_fast:
+            renderer = _interpolated_renderer(_render_images, int(np.floor(np.log2(nx / 20))))
+        else:
+            renderer = _render_images
+
+        particles = _prepare_particles_for_images(snap, qtys, x2, nx, y2, ny, x1, y1, xy_units, smooth,
+                                                  smooth_in_pixels)
+        result = renderer(snap, particles, x2, nx, y2, ny, x1, y1, z_plane, ratios, xy_units, kernel,
+                          num_threads=int(threaded or 1))
+    finally:
+        if denoise:
+            del snap.ancestor['__denoise_one']
+
+    if denoise:
+        result = result[:-1] / result[-1]
+
+    images = []
+    for i, im_units in enumerate(image_units):
+        # view each image separately, so that each has its own units
+        im = np.asarray(result)[i].view(array.SimArray)
+        im.units = im_units
+        im.sim = snap
+        images.append(im)
+
+    return images
+
+
+def render_image_chunked(sim, qty='rho', family=None, chunk_size=10000000, physical_units=False, cen=None,
+                         smooth='smooth', **kwargs):
+    """
+    Render an SPH image of a snapshot which is too large to hold in memory, by rendering chunks of
+    particles in turn and summing the results.
+
+    For Tipsy and GadgetHDF files, chunks of up to *chunk_size* particles are partially loaded from disk
+    in turn, with the same loading options as *sim*. For RAMSES outputs each CPU's domain is loaded in turn,
+    regardless of *chunk_size*. Each chunk is freed before the next is loaded. For other formats, the snapshot
+    is rendered in slices, but all arrays used are loaded into memory.
+
+    Because each chunk is rendered separately, the smoothing lengths and densities must be stored on disk
+    (for example, in Tipsy auxiliary files or as gas arrays in GadgetHDF or RAMSES outputs); a ValueError
+    is raised if they would need to be calculated from an individual chunk.
+
+    **Keyword arguments:**
+
+    *sim*: a filename, or a snapshot loaded from disk. If a snapshot is given, it should not already have the
+      required arrays loaded (otherwise there is no benefit over using :func:`render_image`).
+
+    *qty* ('rho'): The name of the array within the simulation to render
+
+    *family*: if specified, only particles of this family are rendered
+
+    *chunk_size* (10000000): the maximum number of particles to load at once, where the format supports it
+
+    *physical_units* (False): if True, each chunk is converted to physical units before being rendered
+
+    *cen*: if specified, the position to place at the centre of the image, in the units of each chunk
+      (i.e. the file's units unless *physical_units* is True)
+
+    *smooth* ('smooth'): The name of the array which contains the smoothing lengths
+
+    Other keyword arguments are passed to :func:`render_image`, except that *denoise* is not supported.
+    """
+
+    if kwargs.get('denoise', False):
+        raise ValueError("Denoising is not supported by render_image_chunked")
+    kwargs['denoise'] = False
+
+    if not isinstance(sim, snapshot.SimSnap):
+        sim = pynbody.load(sim)
+
+    result = None
+
+    for i, chunk in enumerate(sim._iterate_chunks_from_disk(chunk_size)):
+        if family is not None:
+            chunk = chunk[family]
+        if len(chunk) == 0:
+            continue
+
+        logger.info("render_image_chunked processing chunk %d with %d particles" % (i, len(chunk)))
+
+        if chunk.ancestor is not sim.ancestor:
+            # values derived from a chunk in isolation would be wrong near its edges, so these must be loaded
+            with chunk.lazy_derive_off:
+                for name in smooth, 'rho':
+                    try:
+                        chunk[name]
+                    except KeyError:
+                        raise ValueError("Chunked rendering requires %r to be stored on disk" % name) from None
+
+        if physical_units:
+            chunk.physical_units()
+        if cen is not None:
+            pynbody.transformation.inverse_translate(chunk, cen)
+
+        im = render_image(chunk, qty, smooth=smooth, **kwargs)
+
+        if result is None:
+            result = im
+        else:
+            result += im.in_units(result.units)
+
+        del chunk, im
+
+    if result is None:
+        raise ValueError("No particles found to render")
+
+    result.sim = sim
+    return result
+
+
 def _render_image(snap, qty, x2, nx, y2, ny, x1,
                   y1, z_plane, out_units, xy_units, kernel, z_camera,
                   smooth, smooth_in_pixels,  force_quiet,
                   smooth_range=None, res_downgrade=None, snap_slice=None,
-                  __threaded=False):
-    """The single-threaded image rendering core function. External calls
-    should be made to the render_image function."""
+                  __threaded=False, tiled_num_threads=None):
+    """The image rendering core function. This is single-threaded unless tiled_num_threads is
+    specified, in which case the tiled renderer is used. External calls should be made to the
+    render_image function."""
 
     global config
 
@@ -519,38 +832,8 @@ def _render_image(snap, qty, x2, nx, y2, ny, x1,
 
     in_time = time.time()
 
-    if y2 is None:
-        if ny is not None:
-            y2 = x2 * float(ny) / nx
-        else:
-            y2 = x2
-
-    if ny is None:
-        ny = nx
-    if x1 is None:
-        x1 = -x2
-    if y1 is None:
-        y1 = -y2
-
-    if res_downgrade is not None:
-        # calculate original resolution
-        dx = float(x2 - x1) / nx
-        dy = float(y2 - y1) / ny
-
-        # degrade resolution
-        nx //= res_downgrade
-        ny //= res_downgrade
-
-        # shift boundaries (since x1, x2 etc refer to centres of pixels,
-        # not edges, but we want the *edges* to remain invariant)
-        sx = dx * float(res_downgrade - 1) / 2
-        sy = dy * float(res_downgrade - 1) / 2
-        x1 -= sx
-        y1 -= sy
-        x2 += sx
-        y2 += sy
-
-    x1, x2, y1, y2, z1 = (float(q) for q in (x1, x2, y1, y2, z_plane))
+    x1, x2, y1, y2, nx, ny = _image_extent(x2, nx, y2, ny, x1, y1, res_downgrade)
+    z1 = float(z_plane)
 
     if smooth_range is not None:
         smooth_lo = float(smooth_range[0])
@@ -559,9 +842,6 @@ def _render_image(snap, qty, x2, nx, y2, ny, x1,
         smooth_lo = 0.0
         smooth_hi = 100000.0
 
-    nx = int(nx + .5)
-    ny = int(ny + .5)
-
     result = np.zeros((ny, nx), dtype=np.float32)
 
     n_part = len(snap)
@@ -592,10 +872,21 @@ def _render_image(snap, qty, x2, nx, y2, ny, x1,
     if z_camera is None:
         z_camera = 0.0
 
-    result = _render.render_image(nx, ny, x, y, z, sm, x1, x2, y1, y2, z_camera, 0.0, qty, mass, rho,
-                                  smooth_lo, smooth_hi, kernel,
-                                  _calculate_wrapping_repeat_array(snap, x1, x2, xy_units),
-                                  _calculate_wrapping_repeat_array(snap, y1, y2, xy_units))
+    if tiled_num_threads is not None:
+        order = _morton_order(x, y, x1, x2, y1, y2)
+        qty_weighted = np.asarray(qty, dtype=np.float64) * mass.view(np.ndarray) / rho.view(np.ndarray)
+        x, y, z, sm, qty_weighted = (np.ascontiguousarray(np.asarray(a)[order], dtype=np.float64)
+                                     for a in (x, y, z, sm, qty_weighted))
+        result = _render.render_image_tiled(nx, ny, x, y, z, sm, qty_weighted[np.newaxis, :], x1, x2, y1, y2, z1,
+                                            smooth_lo, smooth_hi, kernel,
+                                            _calculate_wrapping_repeat_array(snap, x1, x2, xy_units),
+                                            _calculate_wrapping_repeat_array(snap, y1, y2, xy_units),
+                                            _image_tile_size, tiled_num_threads)[0]
+    else:
+        result = _render.render_image(nx, ny, x, y, z, sm, x1, x2, y1, y2, z_camera, z1, qty, mass, rho,
+                                      smooth_lo, smooth_hi, kernel,
+                                      _calculate_wrapping_repeat_array(snap, x1, x2, xy_units),
+                                      _calculate_wrapping_repeat_array(snap, y1, y2, xy_units))
 
     result = result.view(array.SimArray)
 
@@ -619,6 +910,114 @@ def _render_image(snap, qty, x2, nx, y2, ny, x1,
     return result
 
 
+def _render_images(snap, particles, x2, nx, y2, ny, x1, y1, z_plane, ratios, xy_units, kernel,
+                   smooth_range=None, res_downgrade=None, num_threads=1):
+    """The multi-quantity image rendering core function, returning an (n_qty, ny, nx) array in which each image
+    has been multiplied by the corresponding element of *ratios*. The particle data are supplied as
+    returned by _prepare_particles_for_images. External calls should be made to the render_images function."""
+
+    x1, x2, y1, y2, nx, ny = _image_extent(x2, nx, y2, ny, x1, y1, res_downgrade)
+
+    if smooth_range is not None:
+        smooth_lo = float(smooth_range[0])
+        smooth_hi = float(smooth_range[1])
+    else:
+        smooth_lo = 0.0
+        smooth_hi = 100000.0
+
+    x, y, z, sm, qty_weighted = particles
+
+    result = _render.render_image_tiled(nx, ny, x, y, z, sm, qty_weighted, x1, x2, y1, y2, float(z_plane),
+                                        smooth_lo, smooth_hi, kernel,
+                                        _calculate_wrapping_repeat_array(snap, x1, x2, xy_units),
+                                        _calculate_wrapping_repeat_array(snap, y1, y2, xy_units),
+                                        _image_tile_size, num_threads)
+    result *= np.asarray(ratios, dtype=np.float32)[:, np.newaxis, np.newaxis]
+    return result
+
+
+def _prepare_particles_for_images(snap, qtys, x2, nx, y2, ny, x1, y1, xy_units, smooth, smooth_in_pixels):
+    """Return the positions, smoothing lengths and (mass/rho)-weighted quantities of the particles, in Morton order
+    over the image, ready for _render_images"""
+
+    x1, x2, y1, y2, nx, ny = _image_extent(x2, nx, y2, ny, x1, y1, None)
+
+    x = snap['x'].in_units(xy_units)
+    y = snap['y'].in_units(xy_units)
+    z = snap['z'].in_units(xy_units)
+
+    sm = snap[smooth]
+
+    if sm.units != x.units and not smooth_in_pixels:
+        sm = sm.in_units(x.units)
+
+    order = _morton_order(x, y, x1, x2, y1, y2)
+    weight = (snap['mass'].view(np.ndarray) / snap['rho'].view(np.ndarray)).astype(np.float64)[order]
+    qty_weighted = np.empty((len(qtys), len(order)))
+    for i, qty in enumerate(qtys):
+        qty_weighted[i] = np.asarray(snap[qty], dtype=np.float64)[order] * weight
+
+    x, y, z, sm = (np.ascontiguousarray(np.asarray(a)[order], dtype=np.float64) for a in (x, y, z, sm))
+
+    return x, y, z, sm, qty_weighted
+
+
+def _image_extent(x2, nx, y2, ny, x1, y1, res_downgrade):
+    """Return x1, x2, y1, y2, nx, ny for an image, filling in defaults for unspecified values and, if res_downgrade
+    is specified, reducing the resolution while keeping the edges of the image fixed"""
+    if y2 is None:
+        if ny is not None:
+            y2 = x2 * float(ny) / nx
+        else:
+            y2 = x2
+
+    if ny is None:
+        ny = nx
+    if x1 is None:
+        x1 = -x2
+    if y1 is None:
+        y1 = -y2
+
+    if res_downgrade is not None:
+        # calculate original resolution
+        dx = float(x2 - x1) / nx
+        dy = float(y2 - y1) / ny
+
+        # degrade resolution
+        nx //= res_downgrade
+        ny //= res_downgrade
+
+        # shift boundaries (since x1, x2 etc refer to centres of pixels,
+        # not edges, but we want the *edges* to remain invariant)
+        sx = dx * float(res_downgrade - 1) / 2
+        sy = dy * float(res_downgrade - 1) / 2
+        x1 -= sx
+        y1 -= sy
+        x2 += sx
+        y2 += sy
+
+    x1, x2, y1, y2 = (float(q) for q in (x1, x2, y1, y2))
+
+    return x1, x2, y1, y2, int(nx + .5), int(ny + .5)
+
+
+def _morton_order(x, y, x1, x2, y1, y2, bits=16):
+    """Return the permutation that sorts points into Morton (Z-curve) order within the rectangle x1<x<x2, y1<y<y2.
+
+    Points outside the rectangle are clamped to its edges."""
+
+    def spread_bits(v, v1, v2):
+        scale = (1 << bits) - 1
+        v = (np.clip((np.asarray(v, dtype=np.float64) - v1) / (v2 - v1), 0.0, 1.0) * scale).astype(np.uint32)
+        v = (v | (v << 8)) & 0x00FF00FF
+        v = (v | (v << 4)) & 0x0F0F0F0F
+        v = (v | (v << 2)) & 0x33333333
+        v = (v | (v << 1)) & 0x55555555
+        return v
+
+    return np.argsort(spread_bits(x, x1, x2) | (spread_bits(y, y1, y2) << 1), kind='stable')
+
+
 def _calculate_wrapping_repeat_array(snap, x1, x2, xy_units):
     if 'boxsize' in snap.properties:
         boxsize = snap.properties['boxsize'].in_units(xy_units, **snap.conversion_context())
@@ -635,7 +1034,7 @@ def _calculate_wrapping_repeat_array(snap, x1, x2, xy_units):
 
 def to_3d_grid(snap, qty='rho', nx=None, ny=None, nz=None, x2=None, out_units=None,
                xy_units=None, kernel=Kernel(), smooth='smooth', approximate_fast=_approximate_image,
-               threaded=None, snap_slice=None, denoise=None):
+               threaded=None, snap_slice=None, denoise=None, out=None):
     """
 
     Project SPH onto a grid using a typical (mass/rho)-weighted 'scatter'
@@ -665,6 +1064,18 @@ def to_3d_grid(snap, qty='rho', nx=None, ny=None, nz=None, x2=None, out_units=No
       can be useful to reduce noise especially when rendering AMR grids which
       often introduce problematic edge effects.
 
+    *threaded*: if False (or None), render on a single core. Otherwise,
+      the number of threads to use (defaults to a value specified in your
+      configuration files). The grid is divided into slabs along its first axis,
+      each of which is filled by a single thread, so that only one copy of the grid
+      is held in memory.
+
+    *out*: if specified, a C-contiguous float32 array of shape (nx, ny, nz), into which
+      the grid is written; for example, a ``np.memmap`` can be used to make grids larger
+      than the available memory. The returned array is then a view on *out*.
+      Note that *approximate_fast* and *denoise* still require temporary grids of the
+      same size.
+
     """
     global config
 
@@ -700,6 +1111,10 @@ def to_3d_grid(snap, qty='rho', nx=None, ny=None, nz=None, x2=None, out_units=No
     x1, x2, y1, y2, z1, z2 = (float(q) for q in (x1, x2, y1, y2, z1, z2))
     nx, ny, nz = (int(q) for q in (nx, ny, nz))
 
+    if out is not None:
+        if out.shape != (nx, ny, nz) or out.dtype != np.float32 or not out.flags['C_CONTIGUOUS']:
+            raise ValueError("out must be a C-contiguous float32 array of shape (%d, %d, %d)" % (nx, ny, nz))
+
     if approximate_fast:
         renderer = _interpolated_renderer(
             _to_3d_grid, int(np.floor(np.log2(nx / 20))))
@@ -709,9 +1124,9 @@ def to_3d_grid(snap, qty='rho', nx=None, ny=None, nz=None, x2=None, out_units=No
     if threaded is None:
         threaded = _get_threaded_image()
 
-    if threaded:
-        im = _threaded_render_image(renderer, snap, qty, nx, ny, nz, x1, x2, y1, y2, z1, z2, out_units,
-                                    xy_units, kernel, smooth, num_threads=threaded)
+    if threaded or out is not None:
+        im = renderer(snap, qty, nx, ny, nz, x1, x2, y1, y2, z1, z2, out_units,
+                      xy_units, kernel, smooth, False, slab_num_threads=int(threaded or 1), out=out)
     else:
         im = renderer(snap, qty, nx, ny, nz, x1, x2, y1, y2, z1, z2, out_units,
                       xy_units, kernel, smooth, False)
@@ -724,9 +1139,9 @@ def to_3d_grid(snap, qty='rho', nx=None, ny=None, nz=None, x2=None, out_units=No
         im2 = to_3d_grid(snap, '__one', nx, ny, nz, x2, None, xy_units, kernel, smooth,
                          approximate_fast, threaded, snap_slice, False)
         del snap.ancestor['__one']
-        im2 = im / im2
-        im2.units = im.units
-        return im2
+        # divide in place, so that the result remains in out if it was specified
+        im.view(np.ndarray)[:] /= im2.view(np.ndarray)
+        return im
 
     else:
         return im
@@ -735,7 +1150,10 @@ def to_3d_grid(snap, qty='rho', nx=None, ny=None, nz=None, x2=None, out_units=No
 def _to_3d_grid(snap, qty, nx, ny, nz, x1, x2, y1, y2, z1, z2, out_units,
                 xy_units, kernel, smooth, __threaded=False, res_downgrade=None,
                 snap_slice=None,
-                smooth_range=None):
+                smooth_range=None, slab_num_threads=None, out=None):
+    """The grid rendering core function. This uses the original single-threaded renderer unless
+    slab_num_threads is specified, in which case the slab-decomposed renderer is used, writing into
+    out if that is specified. External calls should be made to the to_3d_grid function."""
 
     snap_proxy = {}
 
@@ -765,7 +1183,6 @@ def _to_3d_grid(snap, qty, nx, ny, nz, x1, x2, y1, y2, z1, z2, out_units,
         y2 += sy
         z2 += sz
 
-    result = np.zeros((nx, ny, nz), dtype=np.float32)
     n_part = len(snap)
 
     if xy_units is None:
@@ -800,11 +1217,32 @@ def _to_3d_grid(snap, qty, nx, ny, nz, x1, x2, y1, y2, z1, z2, out_units,
 
     logger.info("Gridding particles")
 
-    result = _render.to_3d_grid(nx,ny,nz,x,y,z,sm,x1,x2,y1,y2,z1,z2,
-                                qty,mass,rho,smooth_lo,smooth_hi,kernel,
-                                _calculate_wrapping_repeat_array(snap, x1, x2, xy_units),
-                                _calculate_wrapping_repeat_array(snap, y1, y2, xy_units),
-                                _calculate_wrapping_repeat_array(snap, z1, z2, xy_units))
+    if slab_num_threads is not None:
+        if out is None or res_downgrade not in (None, 1):
+            # lower-resolution passes of the interpolated renderer are added into the full-resolution
+            # grid by _interpolated_renderer
+            result = np.zeros((nx, ny, nz), dtype=np.float32)
+        else:
+            result = out
+            result[:] = 0
+
+        # sort particles along the slab axis so that each slab accesses a contiguous range of memory
+        order = np.argsort(x.view(np.ndarray), kind='stable')
+        qty_weighted = np.asarray(qty, dtype=np.float64) * mass.view(np.ndarray) / rho.view(np.ndarray)
+        x, y, z, sm, qty_weighted = (np.ascontiguousarray(np.asarray(a)[order], dtype=np.float64)
+                                     for a in (x, y, z, sm, qty_weighted))
+        result = _render.to_3d_grid_slabs(nx, ny, nz, x, y, z, sm, qty_weighted, x1, x2, y1, y2, z1, z2,
+                                          smooth_lo, smooth_hi, kernel, result,
+                                          _calculate_wrapping_repeat_array(snap, x1, x2, xy_units),
+                                          _calculate_wrapping_repeat_array(snap, y1, y2, xy_units),
+                                          _calculate_wrapping_repeat_array(snap, z1, z2, xy_units),
+                                          _grid_slabs_per_thread * slab_num_threads, slab_num_threads)
+    else:
+        result = _render.to_3d_grid(nx,ny,nz,x,y,z,sm,x1,x2,y1,y2,z1,z2,
+                                    qty,mass,rho,smooth_lo,smooth_hi,kernel,
+                                    _calculate_wrapping_repeat_array(snap, x1, x2, xy_units),
+                                    _calculate_wrapping_repeat_array(snap, y1, y2, xy_units),
+                                    _calculate_wrapping_repeat_array(snap, z1, z2, xy_units))
     result = result.view(array.SimArray)
 
     # The weighting works such that there is a factor of (M_u/rho_u)h_u^3
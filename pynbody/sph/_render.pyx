@@ -3,6 +3,8 @@ import numpy as np
 cimport cython
 cimport libc.math as cmath
 cimport numpy as np
+cimport openmp
+from cython.parallel cimport prange
 from libc.math cimport atan, pow
 from libc.stdlib cimport free, malloc
 
@@ -271,6 +273,189 @@ def render_image(int nx, int ny,
 
 
 
+@cython.cdivision(True)
+cdef inline bint _particle_pixel_range(double x_i, double y_i, double z_i, double sm_i,
+                                       int nx, int ny, double x1, double x2, double y1, double y2,
+                                       double z0, double pixel_dx, double pixel_dy,
+                                       double smooth_lo, double smooth_hi, double max_d_over_h, int use_z,
+                                       int* x_pix_start, int* x_pix_stop,
+                                       int* y_pix_start, int* y_pix_stop) nogil:
+    """Find the range of pixels to which a particle contributes, using exactly the same criteria as
+    render_image. Returns False if the particle does not contribute to the image."""
+
+    if sm_i<pixel_dx*smooth_lo or sm_i>pixel_dx*smooth_hi:
+        return False
+
+    if not ((use_z*cmath.fabs(z_i-z0)<max_d_over_h*sm_i)
+            and x_i>x1-2*sm_i and x_i<x2+2*sm_i and y_i>y1-2*sm_i and y_i<y2+2*sm_i):
+        return False
+
+    if max_d_over_h*sm_i/pixel_dx<1 and max_d_over_h*sm_i/pixel_dy<1:
+        x_pix_start[0] = <int>((x_i-x1)/pixel_dx)
+        y_pix_start[0] = <int>((y_i-y1)/pixel_dy)
+        if x_pix_start[0]<0 or x_pix_start[0]>=nx or y_pix_start[0]<0 or y_pix_start[0]>=ny:
+            return False
+        x_pix_stop[0] = x_pix_start[0]+1
+        y_pix_stop[0] = y_pix_start[0]+1
+    else:
+        x_pix_start[0] = <int>((x_i-max_d_over_h*sm_i-x1)/pixel_dx)
+        x_pix_stop[0] = <int>((x_i+max_d_over_h*sm_i-x1)/pixel_dx)
+        y_pix_start[0] = <int>((y_i-max_d_over_h*sm_i-y1)/pixel_dy)
+        y_pix_stop[0] = <int>((y_i+max_d_over_h*sm_i-y1)/pixel_dy)
+        if x_pix_start[0]<0: x_pix_start[0] = 0
+        if x_pix_stop[0]>nx: x_pix_stop[0] = nx
+        if y_pix_start[0]<0: y_pix_start[0] = 0
+        if y_pix_stop[0]>ny: y_pix_stop[0] = ny
+        if x_pix_start[0]>=x_pix_stop[0] or y_pix_start[0]>=y_pix_stop[0]:
+            return False
+
+    return True
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def render_image_tiled(int nx, int ny,
+                       np.ndarray[np.float64_t,ndim=1] x,
+                       np.ndarray[np.float64_t,ndim=1] y,
+                       np.ndarray[np.float64_t,ndim=1] z,
+                       np.ndarray[np.float64_t,ndim=1] sm,
+                       np.ndarray[np.float64_t,ndim=2] qty_weighted,
+                       double x1, double x2, double y1, double y2, double z0,
+                       double smooth_lo, double smooth_hi,
+                       kernel,
+                       wrap_offsets_x=[0], wrap_offsets_y=[0],
+                       int tile_size=64, int num_threads=1):
+    """Render an orthographic SPH image, with the image divided into square tiles that are processed in parallel.
+
+    The result is the same as render_image (up to floating point summation order). However, rather
+    than each thread rendering a subset of particles into its own copy of the image, each tile is
+    rendered by a single thread, so that only one copy of the image is needed. For cache efficiency,
+    the particles should already be sorted spatially (e.g. in Morton order).
+
+    *qty_weighted* is an (n_qty, n_part) array of the quantities to render, each multiplied by mass/rho.
+    The kernel footprint of each particle is calculated once and deposited for all quantities, and the
+    result is an (n_qty, ny, nx) stack of images.
+    """
+
+    cdef double pixel_dx = (x2-x1)/nx
+    cdef double pixel_dy = (y2-y1)/ny
+    cdef double x_start = x1+pixel_dx/2
+    cdef double y_start = y1+pixel_dy/2
+    cdef Py_ssize_t n_part = len(x)
+    cdef Py_ssize_t i, j, entry
+    cdef double x_i, y_i, z_i, sm_i, x_pixel, y_pixel, kernel_value
+    cdef int x_pos, y_pos, q
+    cdef int n_qty = qty_weighted.shape[0]
+    cdef int x_pix_start=0, x_pix_stop=0, y_pix_start=0, y_pix_stop=0
+    cdef int tile, tile_x, tile_y, tile_x_start, tile_x_stop, tile_y_start, tile_y_stop
+    cdef int n_tiles_x = (nx+tile_size-1)//tile_size
+    cdef int n_tiles_y = (ny+tile_size-1)//tile_size
+    cdef int n_tiles = n_tiles_x*n_tiles_y
+    cdef int wrap_index
+
+    cdef int kernel_dim = kernel.h_power
+    cdef double max_d_over_h = kernel.max_d
+    cdef int use_z = 1 if kernel_dim>=3 else 0
+
+    cdef np.ndarray[image_output_type,ndim=1] samples = kernel.get_samples(dtype=np_image_output_type)
+    cdef int num_samples = len(samples)
+    cdef image_output_type* samples_c = <image_output_type*>samples.data
+    cdef image_output_type sm_to_kdim
+    cdef double kernel_max_2
+
+    cdef np.ndarray[np.float64_t,ndim=1] offsets_x = np.repeat(np.asarray(wrap_offsets_x, dtype=np.float64),
+                                                               len(wrap_offsets_y))
+    cdef np.ndarray[np.float64_t,ndim=1] offsets_y = np.tile(np.asarray(wrap_offsets_y, dtype=np.float64),
+                                                             len(wrap_offsets_x))
+    cdef int n_wraps = len(offsets_x)
+
+    cdef np.ndarray[np.int64_t,ndim=1] tile_offsets = np.zeros(n_tiles+1, dtype=np.int64)
+    cdef np.ndarray[np.int64_t,ndim=1] tile_fill
+    cdef np.ndarray[np.int64_t,ndim=1] entry_particle
+    cdef np.ndarray[np.int32_t,ndim=1] entry_wrap
+
+    cdef np.ndarray[image_output_type,ndim=3] result = np.zeros((n_qty,ny,nx),dtype=np_image_output_type)
+
+    assert kernel_dim==2 or kernel_dim==3, "Only kernels of dimension 2 or 3 currently supported"
+    assert len(x) == len(y) == len(z) == len(sm) == qty_weighted.shape[1], "Inconsistent array lengths passed to render_image_tiled"
+    assert tile_size>0, "Tile size must be positive"
+
+    # First pass: count the number of (particle, wrap offset) entries overlapping each tile
+    with nogil:
+        for wrap_index in range(n_wraps):
+            for i in range(n_part):
+                if _particle_pixel_range(x[i]+offsets_x[wrap_index], y[i]+offsets_y[wrap_index], z[i], sm[i],
+                                         nx, ny, x1, x2, y1, y2, z0, pixel_dx, pixel_dy,
+                                         smooth_lo, smooth_hi, max_d_over_h, use_z,
+                                         &x_pix_start, &x_pix_stop, &y_pix_start, &y_pix_stop):
+                    for tile_y in range(y_pix_start//tile_size, (y_pix_stop-1)//tile_size+1):
+                        for tile_x in range(x_pix_start//tile_size, (x_pix_stop-1)//tile_size+1):
+                            tile_offsets[tile_y*n_tiles_x+tile_x+1]+=1
+
+    np.cumsum(tile_offsets, out=tile_offsets)
+    tile_fill = tile_offsets[:n_tiles].copy()
+    entry_particle = np.empty(tile_offsets[n_tiles], dtype=np.int64)
+    entry_wrap = np.empty(tile_offsets[n_tiles], dtype=np.int32)
+
+    # Second pass: fill in the entries for each tile, preserving the particle order within tiles
+    with nogil:
+        for wrap_index in range(n_wraps):
+            for i in range(n_part):
+                if _particle_pixel_range(x[i]+offsets_x[wrap_index], y[i]+offsets_y[wrap_index], z[i], sm[i],
+                                         nx, ny, x1, x2, y1, y2, z0, pixel_dx, pixel_dy,
+                                         smooth_lo, smooth_hi, max_d_over_h, use_z,
+                                         &x_pix_start, &x_pix_stop, &y_pix_start, &y_pix_stop):
+                    for tile_y in range(y_pix_start//tile_size, (y_pix_stop-1)//tile_size+1):
+                        for tile_x in range(x_pix_start//tile_size, (x_pix_stop-1)//tile_size+1):
+                            tile = tile_y*n_tiles_x+tile_x
+                            entry_particle[tile_fill[tile]] = i
+                            entry_wrap[tile_fill[tile]] = wrap_index
+                            tile_fill[tile]+=1
+
+    # Render each tile on a single thread, so that no two threads write to the same pixel
+    for tile in prange(n_tiles, nogil=True, schedule='dynamic', num_threads=num_threads):
+        tile_x_start = (tile % n_tiles_x)*tile_size
+        tile_x_stop = min(tile_x_start+tile_size, nx)
+        tile_y_start = (tile // n_tiles_x)*tile_size
+        tile_y_stop = min(tile_y_start+tile_size, ny)
+
+        for entry in range(tile_offsets[tile], tile_offsets[tile+1]):
+            j = entry_particle[entry]
+            wrap_index = entry_wrap[entry]
+            x_i = x[j]+offsets_x[wrap_index]
+            y_i = y[j]+offsets_y[wrap_index]
+            z_i = z[j]
+            sm_i = sm[j]
+
+            # assign explicitly so that cython makes these thread-private
+            x_pix_start = 0
+            x_pix_stop = 0
+            y_pix_start = 0
+            y_pix_stop = 0
+            _particle_pixel_range(x_i, y_i, z_i, sm_i, nx, ny, x1, x2, y1, y2, z0, pixel_dx, pixel_dy,
+                                  smooth_lo, smooth_hi, max_d_over_h, use_z,
+                                  &x_pix_start, &x_pix_stop, &y_pix_start, &y_pix_stop)
+
+            if kernel_dim==2:
+                sm_to_kdim = sm_i*sm_i
+            else:
+                sm_to_kdim = sm_i*sm_i*sm_i
+
+            kernel_max_2 = (sm_i*sm_i)*(max_d_over_h*max_d_over_h)
+
+            for x_pos in range(max(x_pix_start, tile_x_start), min(x_pix_stop, tile_x_stop)):
+                x_pixel = pixel_dx*<double>(x_pos)+x_start
+                for y_pos in range(max(y_pix_start, tile_y_start), min(y_pix_stop, tile_y_stop)):
+                    y_pixel = pixel_dy*<double>(y_pos)+y_start
+                    kernel_value = get_kernel_xyz(x_i-x_pixel, y_i-y_pixel, (z_i-z0)*use_z,
+                                                  kernel_max_2, sm_to_kdim, num_samples, samples_c)
+                    for q in range(n_qty):
+                        result[q,y_pos,x_pos]+=qty_weighted[q,j]*kernel_value
+
+    return result
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.cdivision(True)
@@ -399,3 +584,203 @@ def to_3d_grid(int nx, int ny, int nz,
                                         result[x_pos,y_pos,z_pos]+=qty_i*get_kernel_xyz(x_i-x_pixel, y_i-y_pixel, (z_i-z_pixel), kernel_max_2 ,sm_to_kdim,num_samples,samples_c)
 
     return result
+
+
+@cython.cdivision(True)
+cdef inline bint _particle_voxel_range(double x_i, double y_i, double z_i, double sm_i,
+                                       int nx, int ny, int nz, double x1, double x2, double y1, double y2,
+                                       double z1, double z2, double pixel_dx, double pixel_dy, double pixel_dz,
+                                       double smooth_lo, double smooth_hi, double max_d_over_h,
+                                       int* x_pix_start, int* x_pix_stop, int* y_pix_start, int* y_pix_stop,
+                                       int* z_pix_start, int* z_pix_stop) nogil:
+    """Find the range of voxels to which a particle contributes, using exactly the same criteria as
+    to_3d_grid. Returns False if the particle does not contribute to the grid."""
+
+    if sm_i<pixel_dx*smooth_lo or sm_i>pixel_dx*smooth_hi:
+        return False
+
+    if not (z_i>z1-2*sm_i and z_i<z2+2*sm_i
+            and x_i>x1-2*sm_i and x_i<x2+2*sm_i
+            and y_i>y1-2*sm_i and y_i<y2+2*sm_i):
+        return False
+
+    if max_d_over_h*sm_i/pixel_dx<1 and max_d_over_h*sm_i/pixel_dy<1:
+        x_pix_start[0] = <int>((x_i-x1)/pixel_dx)
+        y_pix_start[0] = <int>((y_i-y1)/pixel_dy)
+        z_pix_start[0] = <int>((z_i-z1)/pixel_dz)
+        if x_pix_start[0]<0 or x_pix_start[0]>=nx or y_pix_start[0]<0 or y_pix_start[0]>=ny \
+                or z_pix_start[0]<0 or z_pix_start[0]>=nz:
+            return False
+        x_pix_stop[0] = x_pix_start[0]+1
+        y_pix_stop[0] = y_pix_start[0]+1
+        z_pix_stop[0] = z_pix_start[0]+1
+    else:
+        x_pix_start[0] = <int>((x_i-max_d_over_h*sm_i-x1)/pixel_dx)
+        x_pix_stop[0] = <int>((x_i+max_d_over_h*sm_i-x1)/pixel_dx)
+        y_pix_start[0] = <int>((y_i-max_d_over_h*sm_i-y1)/pixel_dy)
+        y_pix_stop[0] = <int>((y_i+max_d_over_h*sm_i-y1)/pixel_dy)
+        z_pix_start[0] = <int>((z_i-max_d_over_h*sm_i-z1)/pixel_dz)
+        z_pix_stop[0] = <int>((z_i+max_d_over_h*sm_i-z1)/pixel_dz)
+        if x_pix_start[0]<0: x_pix_start[0] = 0
+        if x_pix_stop[0]>nx: x_pix_stop[0] = nx
+        if y_pix_start[0]<0: y_pix_start[0] = 0
+        if y_pix_stop[0]>ny: y_pix_stop[0] = ny
+        if z_pix_start[0]<0: z_pix_start[0] = 0
+        if z_pix_stop[0]>nz: z_pix_stop[0] = nz
+        if x_pix_start[0]>=x_pix_stop[0] or y_pix_start[0]>=y_pix_stop[0] or z_pix_start[0]>=z_pix_stop[0]:
+            return False
+
+    return True
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def to_3d_grid_slabs(int nx, int ny, int nz,
+                     np.ndarray[np.float64_t,ndim=1] x,
+                     np.ndarray[np.float64_t,ndim=1] y,
+                     np.ndarray[np.float64_t,ndim=1] z,
+                     np.ndarray[np.float64_t,ndim=1] sm,
+                     np.ndarray[np.float64_t,ndim=1] qty_weighted,
+                     double x1, double x2, double y1, double y2, double z1, double z2,
+                     double smooth_lo, double smooth_hi,
+                     kernel,
+                     np.ndarray[image_output_type,ndim=3] result,
+                     wrap_offsets_x=[0], wrap_offsets_y=[0], wrap_offsets_z=[0],
+                     int n_slabs=1, int num_threads=1):
+    """Deposit particles onto a 3D grid, with the grid divided into slabs along its first axis that are
+    processed in parallel.
+
+    The result is the same as to_3d_grid (up to floating point summation order). However, rather
+    than each thread depositing a subset of particles into its own copy of the grid, each slab is
+    filled by a single thread, so that only one copy of the grid is needed. The grid is written
+    into *result*, which must be a C-contiguous (nx, ny, nz) array, and may (for example) be a memmap.
+    For cache efficiency, the particles should already be sorted by x.
+
+    *qty_weighted* is the quantity to render, multiplied by mass/rho.
+    """
+
+    cdef double pixel_dx = (x2-x1)/nx
+    cdef double pixel_dy = (y2-y1)/ny
+    cdef double pixel_dz = (z2-z1)/ny # as in to_3d_grid
+    cdef double x_start = x1+pixel_dx/2
+    cdef double y_start = y1+pixel_dy/2
+    cdef double z_start = z1+pixel_dz/2
+    cdef Py_ssize_t n_part = len(x)
+    cdef Py_ssize_t i, j, entry
+    cdef double x_i, y_i, z_i, sm_i, qty_i, x_pixel, y_pixel, z_pixel
+    cdef int x_pos, y_pos, z_pos
+    cdef int x_pix_start=0, x_pix_stop=0, y_pix_start=0, y_pix_stop=0, z_pix_start=0, z_pix_stop=0
+    cdef int slab, slab_x_start, slab_x_stop
+    cdef int wrap_index
+
+    cdef double max_d_over_h = kernel.max_d
+
+    cdef np.ndarray[image_output_type,ndim=1] samples = kernel.get_samples(dtype=np_image_output_type)
+    cdef int num_samples = len(samples)
+    cdef image_output_type* samples_c = <image_output_type*>samples.data
+    cdef image_output_type sm_to_kdim
+    cdef double kernel_max_2
+
+    offsets = np.array(np.meshgrid(np.asarray(wrap_offsets_x, dtype=np.float64),
+                                   np.asarray(wrap_offsets_y, dtype=np.float64),
+                                   np.asarray(wrap_offsets_z, dtype=np.float64), indexing='ij')).reshape(3, -1)
+    cdef np.ndarray[np.float64_t,ndim=1] offsets_x = offsets[0].copy()
+    cdef np.ndarray[np.float64_t,ndim=1] offsets_y = offsets[1].copy()
+    cdef np.ndarray[np.float64_t,ndim=1] offsets_z = offsets[2].copy()
+    cdef int n_wraps = len(offsets_x)
+
+    # slab boundaries along the x axis; slab s covers x pixels slab_edges[s] to slab_edges[s+1]-1
+    cdef np.ndarray[np.int32_t,ndim=1] slab_edges
+    cdef np.ndarray[np.int32_t,ndim=1] pixel_slab
+
+    cdef np.ndarray[np.int64_t,ndim=1] slab_offsets
+    cdef np.ndarray[np.int64_t,ndim=1] slab_fill
+    cdef np.ndarray[np.int64_t,ndim=1] entry_particle
+    cdef np.ndarray[np.int32_t,ndim=1] entry_wrap
+
+    if kernel.h_power<3:
+        raise ValueError("Cannot render to 3D grid without 3-dimensional kernel or greater")
+
+    assert len(x) == len(y) == len(z) == len(sm) == len(qty_weighted), "Inconsistent array lengths passed to to_3d_grid_slabs"
+    assert result.shape[0]==nx and result.shape[1]==ny and result.shape[2]==nz, "Output grid has the wrong shape"
+    assert n_slabs>0, "Number of slabs must be positive"
+
+    n_slabs = min(n_slabs, nx)
+    slab_edges = np.linspace(0, nx, n_slabs+1).astype(np.int32)
+    pixel_slab = (np.searchsorted(slab_edges, np.arange(nx), side='right')-1).astype(np.int32)
+    slab_offsets = np.zeros(n_slabs+1, dtype=np.int64)
+
+    # First pass: count the number of (particle, wrap offset) entries overlapping each slab
+    with nogil:
+        for wrap_index in range(n_wraps):
+            for i in range(n_part):
+                if _particle_voxel_range(x[i]+offsets_x[wrap_index], y[i]+offsets_y[wrap_index],
+                                         z[i]+offsets_z[wrap_index], sm[i],
+                                         nx, ny, nz, x1, x2, y1, y2, z1, z2, pixel_dx, pixel_dy, pixel_dz,
+                                         smooth_lo, smooth_hi, max_d_over_h,
+                                         &x_pix_start, &x_pix_stop, &y_pix_start, &y_pix_stop,
+                                         &z_pix_start, &z_pix_stop):
+                    for slab in range(pixel_slab[x_pix_start], pixel_slab[x_pix_stop-1]+1):
+                        slab_offsets[slab+1]+=1
+
+    np.cumsum(slab_offsets, out=slab_offsets)
+    slab_fill = slab_offsets[:n_slabs].copy()
+    entry_particle = np.empty(slab_offsets[n_slabs], dtype=np.int64)
+    entry_wrap = np.empty(slab_offsets[n_slabs], dtype=np.int32)
+
+    # Second pass: fill in the entries for each slab, preserving the particle order within slabs
+    with nogil:
+        for wrap_index in range(n_wraps):
+            for i in range(n_part):
+                if _particle_voxel_range(x[i]+offsets_x[wrap_index], y[i]+offsets_y[wrap_index],
+                                         z[i]+offsets_z[wrap_index], sm[i],
+                                         nx, ny, nz, x1, x2, y1, y2, z1, z2, pixel_dx, pixel_dy, pixel_dz,
+                                         smooth_lo, smooth_hi, max_d_over_h,
+                                         &x_pix_start, &x_pix_stop, &y_pix_start, &y_pix_stop,
+                                         &z_pix_start, &z_pix_stop):
+                    for slab in range(pixel_slab[x_pix_start], pixel_slab[x_pix_stop-1]+1):
+                        entry_particle[slab_fill[slab]] = i
+                        entry_wrap[slab_fill[slab]] = wrap_index
+                        slab_fill[slab]+=1
+
+    # Fill each slab on a single thread, so that no two threads write to the same voxel
+    for slab in prange(n_slabs, nogil=True, schedule='dynamic', num_threads=num_threads):
+        slab_x_start = slab_edges[slab]
+        slab_x_stop = slab_edges[slab+1]
+
+        for entry in range(slab_offsets[slab], slab_offsets[slab+1]):
+            j = entry_particle[entry]
+            wrap_index = entry_wrap[entry]
+            x_i = x[j]+offsets_x[wrap_index]
+            y_i = y[j]+offsets_y[wrap_index]
+            z_i = z[j]+offsets_z[wrap_index]
+            sm_i = sm[j]
+            qty_i = qty_weighted[j]
+
+            # assign explicitly so that cython makes these thread-private
+            x_pix_start = 0
+            x_pix_stop = 0
+            y_pix_start = 0
+            y_pix_stop = 0
+            z_pix_start = 0
+            z_pix_stop = 0
+            _particle_voxel_range(x_i, y_i, z_i, sm_i, nx, ny, nz, x1, x2, y1, y2, z1, z2,
+                                  pixel_dx, pixel_dy, pixel_dz, smooth_lo, smooth_hi, max_d_over_h,
+                                  &x_pix_start, &x_pix_stop, &y_pix_start, &y_pix_stop,
+                                  &z_pix_start, &z_pix_stop)
+
+            sm_to_kdim = sm_i*sm_i*sm_i
+            kernel_max_2 = (sm_i*sm_i)*(max_d_over_h*max_d_over_h)
+
+            for x_pos in range(max(x_pix_start, slab_x_start), min(x_pix_stop, slab_x_stop)):
+                x_pixel = pixel_dx*<double>(x_pos)+x_start
+                for y_pos in range(y_pix_start, y_pix_stop):
+                    y_pixel = pixel_dy*<double>(y_pos)+y_start
+                    for z_pos in range(z_pix_start, z_pix_stop):
+                        z_pixel = pixel_dz*<double>(z_pos)+z_start
+                        result[x_pos,y_pos,z_pos]+=qty_i*get_kernel_xyz(x_i-x_pixel, y_i-y_pixel, z_i-z_pixel,
+                                                                        kernel_max_2, sm_to_kdim, num_samples,
+                                                                        samples_c)
+
+    return result
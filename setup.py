@@ -96,7 +96,9 @@ chunkscan = Extension('pynbody.chunk.scan',
 
 sph_render = Extension('pynbody.sph._render',
                   sources=['pynbody/sph/_render.pyx'],
-                  include_dirs=incdir)
+                  include_dirs=incdir,
+                  extra_compile_args=openmp_args,
+                  extra_link_args=openmp_args)
 
 halo_pyx = Extension('pynbody.analysis._com',
                      sources=['pynbody/analysis/_com.pyx'],
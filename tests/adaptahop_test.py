@@ -1,8 +1,11 @@
+import os
+
 import numpy as np
 import pytest
 from scipy.io import FortranFile as FF
 
 import pynbody
+from pynbody.extern.cython_fortran_utils import FortranFile
 from pynbody.halo.adaptahop import (
     AdaptaHOPCatalogue,
     BaseAdaptaHOPCatalogue,
@@ -232,3 +235,71 @@ def test_halo_iteration(halos):
     assert len(h) == len(halos)
     assert h[0] is halos[1]
     assert h[-1] is halos[len(halos)]
+
+
+def _write_synthetic_brick_file(fname, members, iord_dtype=np.int32):
+    with FF(fname, mode="w") as f:
+        f.write_record(np.array([sum(len(m) for m in members)], dtype=np.int32))
+        for _ in range(4):
+            f.write_record(np.array([1.0], dtype=np.float32))
+        f.write_record(np.array([len(members), 0], dtype=np.int32))
+        for i, m in enumerate(members):
+            f.write_record(np.array([len(m)], dtype=np.int32))
+            f.write_record(np.asarray(m, dtype=iord_dtype))
+            f.write_record(np.array([i + 1], dtype=np.int32))
+            f.write_record(np.array([1], dtype=np.int32))
+            f.write_record(np.array([0, 0, 0, 0, 0], dtype=np.int32))
+            for n in 1, 3, 3, 3, 4, 3, 1, 4, 2:
+                f.write_record(np.full(n, float(i), dtype=np.float32))
+
+
+class _FortranFileWithoutScan(pynbody.halo.adaptahop.FortranFile):
+    def scan_records(self, *args, **kwargs):
+        raise AssertionError("The brick file should not have been scanned")
+
+
+@pytest.mark.filterwarnings("ignore:Accessing multiple halos")
+@pytest.mark.parametrize("iord_dtype", [np.int32, np.int64])
+@pytest.mark.parametrize("num_threads", [1, 3])
+def test_load_all_synthetic(tmp_path, monkeypatch, num_threads, iord_dtype):
+    monkeypatch.setitem(pynbody.config, 'number_of_threads', num_threads)
+    monkeypatch.setattr(pynbody.halo.adaptahop, '_max_block_bytes', 100) # force reading in many blocks
+    monkeypatch.setattr(pynbody.halo.adaptahop, '_cache_offsets', True)
+
+    np.random.seed(1)
+    f = pynbody.new(dm=1000)
+    f['iord'] = (np.random.permutation(1000) + 1).astype(iord_dtype)
+    if iord_dtype == np.int64:
+        f['iord'] += 2 ** 40 # ids that only fit in 64 bits
+    f.properties['boxsize'] = pynbody.units.Unit('10 Mpc')
+    lengths = np.random.randint(0, 30, 20)
+    members = [np.random.choice(f['iord'], length, replace=False) for length in lengths]
+
+    fname = str(tmp_path / "tree_bricks001")
+    _write_synthetic_brick_file(fname, members, iord_dtype)
+
+    def check_members(halos):
+        halos.load_all()
+        assert halos._index_lists is not None
+        for i in range(20):
+            assert (halos[i + 1]['iord'] == members[i]).all()
+
+    halos = AdaptaHOPCatalogue(f, fname=fname)
+    assert len(halos) == 20
+    assert os.path.exists(fname + ".offsets.npz")
+    check_members(halos)
+
+    # the offsets saved alongside the brick file are used in place of scanning it...
+    monkeypatch.setattr(pynbody.halo.adaptahop, 'FortranFile', _FortranFileWithoutScan)
+    check_members(AdaptaHOPCatalogue(f, fname=fname))
+
+    # ...unless the brick file has changed since they were saved
+    stat = os.stat(fname)
+    os.utime(fname, (stat.st_atime, stat.st_mtime + 10))
+    with pytest.raises(AssertionError, match="should not have been scanned"):
+        AdaptaHOPCatalogue(f, fname=fname)
+
+    monkeypatch.setattr(pynbody.halo.adaptahop, 'FortranFile', FortranFile)
+    check_members(AdaptaHOPCatalogue(f, fname=fname))
+    with np.load(fname + ".offsets.npz") as index:
+        assert index['file_mtime'] == os.stat(fname).st_mtime
@@ -270,3 +270,56 @@ def test_ahf_dosort_kwarg(snap_with_non_sequential_halos):
     assert len(h)==1411
     assert len(h[1])==502300
     assert len(h[20])==3272
+
+def _write_synthetic_ahf_files(basename, members, hosts):
+    with open(basename + "halos", "w") as f:
+        f.write("#npart(1)	Mvir(2)	hostHalo(3)\n")
+        for i, (m, host) in enumerate(zip(members, hosts)):
+            f.write(f"{len(m)}	{1.5e10 * (i + 1):e}	{host}\n")
+    with open(basename + "particles", "w") as f:
+        f.write(f"{len(members)}\n")
+        for i, m in enumerate(members):
+            f.write(f"{len(m)} {i}\n")
+            for particle_id in m:
+                f.write(f"{particle_id} 1\n")
+
+@pytest.mark.filterwarnings("ignore:Accessing multiple halos")
+def test_ahf_binary_sidecar(tmp_path):
+    f = pynbody.new(dm=1000)
+    np.random.seed(1)
+    members = [np.random.choice(1000, n, replace=False) for n in (300, 120, 40, 0, 7)]
+    hosts = [-1, 0, 0, -1, 1]
+    basename = str(tmp_path / "snapshot.z0.000.AHF_")
+    _write_synthetic_ahf_files(basename, members, hosts)
+
+    def load(binary_sidecar):
+        return pynbody.halo.ahf.AHFCatalogue(f, ahf_basename=basename, use_iord=False, write_fpos=False,
+                                             binary_sidecar=binary_sidecar)
+
+    h_text = load(False)
+    h_text.load_all()
+
+    h = load(True)
+    assert not os.path.exists(basename + "index.npz") # only created once particles are needed
+    for i in range(len(members)):
+        assert (h[i].get_index_list(f) == np.sort(members[i])).all()
+        assert (h[i].get_index_list(f) == h_text[i].get_index_list(f)).all()
+    assert os.path.exists(basename + "members.npy")
+    assert os.path.exists(basename + "index.npz")
+
+    h = load(True)
+    assert isinstance(h._sidecar_members, np.memmap)
+    properties = h.get_properties_all_halos()
+    for k, v in h_text.get_properties_all_halos().items():
+        npt.assert_equal(properties[k], v)
+    h.load_all()
+    for i in range(len(members)):
+        assert (h[i].get_index_list(f) == h_text[i].get_index_list(f)).all()
+
+    # changing the text files must invalidate the sidecar
+    members[1] = members[1][:50]
+    _write_synthetic_ahf_files(basename, members, hosts)
+    os.utime(basename + "particles", (0, 0))
+    h = load(True)
+    assert len(h[1]) == 50
+    assert h[1].properties['npart'] == 50
@@ -124,3 +124,33 @@ def test_fuzzy_match_only_one_family():
     # Test that it also works with only_family:
     assert b.fuzzy_match_catalog(only_family=pynbody.family.gas, groups_1=h, groups_2=h2)[1] == [(1, 1.0)]
     assert b.fuzzy_match_catalog(only_family=pynbody.family.dm, groups_1=h, groups_2=h2)[1] == [(1, 0.6), (2, 0.4)]
+
+
+def test_sparse_transfer_matrix():
+    np.random.seed(1)
+    f1 = pynbody.new(dm=10000)
+    f2 = pynbody.new(dm=10000)
+    f1['iord'] = np.arange(10000)
+    f2['iord'] = np.random.permutation(10000)
+
+    f1['grp'] = np.random.randint(-1, 50, size=10000)
+    # most particles stay in the same group, others move to a random group
+    f2['grp'] = np.where(np.random.uniform(size=10000) < 0.8, f1['grp'][f2['iord']],
+                         np.random.randint(-1, 50, size=10000))
+
+    b = pynbody.bridge.OrderBridge(f1, f2, monotonic=False)
+    h1 = pynbody.halo.number_array.HaloNumberCatalogue(f1)
+    h2 = pynbody.halo.number_array.HaloNumberCatalogue(f2)
+
+    dense = b.catalog_transfer_matrix(1, 40, h1, h2)
+    sparse = b.catalog_transfer_matrix(1, 40, h1, h2, sparse=True)
+    assert sparse.shape == dense.shape
+    assert (sparse.toarray() == dense).all()
+    assert sparse.nnz == np.count_nonzero(dense)
+
+    # with max_index=None the whole catalogue is matched
+    cat = b.match_catalog(groups_1=h1, groups_2=h2, max_index=None)
+    assert len(cat) == 50
+    assert (cat[:1] == -2).all()
+    assert (cat[1:] == np.arange(1, 50)).all()
+    assert (cat[:41] == b.match_catalog(groups_1=h1, groups_2=h2, max_index=40)).all()
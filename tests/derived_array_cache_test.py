@@ -0,0 +1,117 @@
+import pathlib
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+import pynbody
+
+
+@pytest.fixture
+def snap_filename(tmp_path):
+    f = pynbody.new(dm=1000, gas=500, order='gas,dm')
+    np.random.seed(1)
+    f['pos'] = np.random.normal(size=(1500, 3))
+    f['mass'] = np.random.uniform(1.0, 2.0, size=1500)
+    f['eps'] = np.ones(1500)
+    f['phi'] = np.ones(1500)
+    for name in 'rho', 'temp', 'metals':
+        f.gas[name] = np.ones(500)
+    f.properties['a'] = 1.0
+    filename = str(tmp_path / "snapshot.tipsy")
+    f.write(fmt=pynbody.snapshot.tipsy.TipsySnap, filename=filename)
+    return filename
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    settings = pynbody.config['derived-array-cache']
+    old_settings = dict(settings)
+    path = tmp_path / "cache"
+    settings.update({'enabled': True, 'path': str(path), 'max-size-mb': 100.0})
+    yield path
+    settings.update(old_settings)
+
+
+def _load(filename):
+    with pytest.warns(RuntimeWarning):
+        return pynbody.load(filename)
+
+
+def test_derived_array_retrieved_from_cache(snap_filename, cache_path):
+    f = _load(snap_filename)
+    smooth = np.array(f['smooth'])
+    assert hasattr(f, 'kdtree')
+    assert len(list(cache_path.glob("*.npy"))) == 1
+
+    f2 = _load(snap_filename)
+    npt.assert_equal(f2['smooth'], smooth)
+    assert f2['smooth'].units == f['smooth'].units
+    assert not hasattr(f2, 'kdtree') # retrieved from cache, not recalculated
+
+
+def test_cached_array_dependencies(snap_filename, cache_path):
+    f = _load(snap_filename)
+    r = np.array(f['r'])
+
+    f2 = _load(snap_filename)
+    npt.assert_equal(f2['r'], r)
+    assert f2.is_derived_array('r')
+
+    # the dependencies should have been restored, so that modifying pos still invalidates r
+    f2['pos'] *= 2
+    assert 'r' not in f2
+    npt.assert_allclose(f2['r'], 2 * r)
+    assert len(list(cache_path.glob("*.npy"))) == 1
+
+
+def test_modified_dependencies_not_cached(snap_filename, cache_path):
+    f = _load(snap_filename)
+    f['pos'] *= 2
+    f['r']
+    assert len(list(cache_path.glob("*.npy"))) == 0
+
+    # unit conversions are not modifications
+    f = _load(snap_filename)
+    f.physical_units()
+    f['r']
+    assert len(list(cache_path.glob("*.npy"))) == 1
+
+
+@pynbody.derived_array
+def r2test(sim):
+    return sim['r'] ** 2
+
+
+def test_modified_indirect_dependencies_not_cached(snap_filename, cache_path):
+    f = _load(snap_filename)
+    r = np.array(f['r'])
+    f['pos'] *= 10
+    f['r'] # derived from the modified positions, so must not be treated as pristine
+    assert 'r' in f._arrays_modified_since_load
+    f['r2test'] # depends on pos only through the already-existing intermediate array r
+    assert 'r2test' in f._arrays_modified_since_load
+    assert len(list(cache_path.glob("*.npy"))) == 1 # only the r derived before modifying pos
+
+    f2 = _load(snap_filename)
+    npt.assert_allclose(f2['r2test'], r ** 2)
+
+
+def test_family_derived_array_cache(snap_filename, cache_path):
+    f = _load(snap_filename)
+    r_gas = np.array(f.gas['r'])
+    f2 = _load(snap_filename)
+    f2['pos'] # load before tracking whether r is calculated or retrieved
+    f2.gas['r']
+    assert 'r' in f2.gas
+    assert 'r' not in f2.dm
+    npt.assert_equal(f2.gas['r'], r_gas)
+
+
+def test_cache_eviction(snap_filename, cache_path):
+    pynbody.config['derived-array-cache']['max-size-mb'] = 2e-2 # room for only one 1500-element float64 array
+    f = _load(snap_filename)
+    f['r']
+    f['rxy']
+    assert len(list(cache_path.glob("*.npy"))) == 1
+    assert len(list(cache_path.glob("*.json"))) == 1
@@ -95,6 +95,37 @@ def test_cuboid(snap, with_kdtree):
         assert (c.get_index_list(f) == np.where(
             (f['x'] > x1) * (f['x'] < x2) * (f['y'] > y1) * (f['y'] < y2) * (f['z'] > z1) * (f['z'] < z2))[0]).all()
 
+def test_filters_on_subsnap_use_ancestor_kdtree(snap):
+    f = snap
+    sub = f[::3]
+    sphere_without_tree = sub[pynbody.filt.Sphere(0.5)].get_index_list(f)
+    cuboid_without_tree = sub[pynbody.filt.Cuboid(-0.4, -0.3, -0.2, 0.3, 0.4, 0.5)].get_index_list(f)
+
+    f.build_tree()
+    assert not hasattr(sub, 'kdtree')
+
+    npt.assert_equal(sub[pynbody.filt.Sphere(0.5)].get_index_list(f), sphere_without_tree)
+    npt.assert_equal(sub[pynbody.filt.Cuboid(-0.4, -0.3, -0.2, 0.3, 0.4, 0.5)].get_index_list(f),
+                     cuboid_without_tree)
+
+    # unsorted index lists must also be mapped correctly
+    shuffled = f[np.random.permutation(len(f))[:500]]
+    expected = np.where(shuffled['r'] < 0.5)[0]
+    npt.assert_equal(np.sort(shuffled[pynbody.filt.Sphere(0.5)].get_index_list(shuffled)), expected)
+
+def test_kdtree_invalidated_by_position_change(snap):
+    f = snap
+    f.build_tree()
+    sub = f[::2]
+    sub.build_tree()
+    assert f[::2].kdtree is sub.kdtree
+
+    f['pos'] += 0.1
+    assert not hasattr(f, 'kdtree')
+    assert not hasattr(f[::2], 'kdtree')
+
+    npt.assert_equal(f[pynbody.filt.Sphere(0.5)].get_index_list(f), np.where(f['r'] < 0.5)[0])
+
 def test_wrapping_cuboid(wrapping_snap):
     snap, origin = wrapping_snap
 
@@ -1,4 +1,5 @@
 import shutil
+import warnings
 
 import h5py
 import numpy as np
@@ -138,3 +139,186 @@ def test_arepo_style_units():
     with pytest.warns(UserWarning, match="Unable to infer units from HDF attributes"):
         assert f.st['EMP_BirthTemperature'].units == units.NoUnit()
     # here is a case where no unit information is recorded in the file (who knows why)
+
+@pytest.fixture
+def multifile_snapshot(tmp_path):
+    np.random.seed(1)
+    nfiles, npart_per_file = 4, 1000
+    for i in range(nfiles):
+        with h5py.File(tmp_path / f"snap.{i}.hdf5", "w") as f:
+            header = f.create_group("Header")
+            header.attrs['NumFilesPerSnapshot'] = nfiles
+            header.attrs['NumPart_ThisFile'] = np.array([0, npart_per_file, 0, 0, 0, 0])
+            header.attrs['NumPart_Total'] = np.array([0, npart_per_file * nfiles, 0, 0, 0, 0])
+            header.attrs['MassTable'] = np.array([0.0, 1.0, 0.0, 0.0, 0.0, 0.0])
+            header.attrs['Time'] = 1.0
+            header.attrs['Redshift'] = 0.0
+            header.attrs['BoxSize'] = 100.0
+            header.attrs['HubbleParam'] = 0.7
+            header.attrs['Omega0'] = 0.3
+            header.attrs['OmegaLambda'] = 0.7
+            dm = f.create_group("PartType1")
+            dm['ParticleIDs'] = np.arange(i * npart_per_file, (i + 1) * npart_per_file)
+            dm['Coordinates'] = np.random.uniform(size=(npart_per_file, 3))
+            dm['Velocities'] = np.random.normal(size=(npart_per_file, 3)).astype(np.float32)
+    return str(tmp_path / "snap")
+
+def test_parallel_read(multifile_snapshot, monkeypatch):
+    with warnings.catch_warnings():
+        # the synthetic files carry no unit information
+        warnings.simplefilter('ignore')
+
+        serial = pynbody.load(multifile_snapshot)
+        assert not serial._shared_arrays
+
+        monkeypatch.setattr(pynbody.snapshot.gadgethdf, "multiprocess_num", 2)
+        parallel = pynbody.load(multifile_snapshot)
+        assert parallel._shared_arrays
+
+        for name in 'pos', 'vel', 'iord', 'mass':
+            npt.assert_equal(parallel[name], serial[name])
+            assert parallel[name].dtype == serial[name].dtype
+
+
+def test_peano_hilbert_key():
+    from pynbody.snapshot.gadgethdf import _peano_hilbert_key
+
+    bits = 3
+    n = 2 ** bits
+    x, y, z = (q.ravel() for q in np.meshgrid(*([np.arange(n)] * 3), indexing='ij'))
+    keys = _peano_hilbert_key(x, y, z, bits)
+
+    # every cell has a unique key, and cells consecutive along the curve are neighbours
+    assert (np.sort(keys) == np.arange(n ** 3)).all()
+    order = np.argsort(keys)
+    steps = np.abs(np.diff(np.stack((x[order], y[order], z[order]), axis=1), axis=0)).sum(axis=1)
+    assert (steps == 1).all()
+
+    # the curve is hierarchical: the leading digits of a key are the key of the parent cell
+    npt.assert_equal(keys >> 3, _peano_hilbert_key(x >> 1, y >> 1, z >> 1, bits - 1))
+
+
+@pytest.fixture
+def hashed_multifile_snapshot(tmp_path):
+    from pynbody.snapshot.gadgethdf import _peano_hilbert_key
+
+    np.random.seed(1)
+    nfiles, npart, bits, boxsize = 3, 5000, 3, 10.0
+    types = {'PartType0': npart, 'PartType1': 2 * npart}
+    data = {}
+    for ptype, n in types.items():
+        pos = np.random.uniform(0, boxsize, size=(n, 3))
+        cell = (pos * 2 ** bits / boxsize).astype(int)
+        keys = _peano_hilbert_key(cell[:, 0], cell[:, 1], cell[:, 2], bits)
+        order = np.argsort(keys, kind='stable')
+        data[ptype] = pos[order], keys[order], np.arange(n)[order]
+
+    nkeys = 8 ** bits
+    key_boundaries = np.linspace(0, nkeys, nfiles + 1).astype(int)
+
+    for i in range(nfiles):
+        with h5py.File(tmp_path / f"snap.{i}.hdf5", "w") as f:
+            header = f.create_group("Header")
+            header.attrs['NumFilesPerSnapshot'] = nfiles
+            header.attrs['NumPart_Total'] = np.array([npart, 2 * npart, 0, 0, 0, 0])
+            header.attrs['MassTable'] = np.array([0.0, 1.0, 0.0, 0.0, 0.0, 0.0])
+            header.attrs['Time'] = 1.0
+            header.attrs['Redshift'] = 0.0
+            header.attrs['BoxSize'] = boxsize
+            header.attrs['HubbleParam'] = 0.7
+            header.attrs['Omega0'] = 0.3
+            header.attrs['OmegaLambda'] = 0.7
+            hash_table = f.create_group("HashTable")
+            hash_table.attrs['HashBits'] = bits
+            num_this_file = []
+            for ptype, (pos, keys, iord) in data.items():
+                k0, k1 = key_boundaries[i], key_boundaries[i + 1]
+                mask = (keys >= k0) & (keys < k1)
+                num_this_file.append(mask.sum())
+                group = f.create_group(ptype)
+                group['ParticleIDs'] = iord[mask]
+                group['Coordinates'] = pos[mask]
+                if ptype == 'PartType0':
+                    group['Masses'] = np.ones(mask.sum())
+                    group.create_group('ElementAbundance')['Oxygen'] = iord[mask] * 0.01
+                table = hash_table.create_group(ptype)
+                table['FirstKeyInFile'] = key_boundaries[:-1]
+                table['LastKeyInFile'] = key_boundaries[1:] - 1
+                table['NumKeysInFile'] = np.diff(key_boundaries)
+                table['NumParticleInCell'] = np.bincount(keys[mask] - k0, minlength=k1 - k0)
+            header.attrs['NumPart_ThisFile'] = np.array(num_this_file + [0, 0, 0, 0])
+    return str(tmp_path / "snap")
+
+
+@pytest.mark.parametrize('region', [pynbody.filt.Sphere(2.0, (3.0, 4.0, 5.0)),
+                                    pynbody.filt.Cuboid(1.0, 1.0, 1.0, 3.0, 6.0, 9.0)])
+def test_take_region_from_hash_table(hashed_multifile_snapshot, region):
+    with warnings.catch_warnings():
+        # the synthetic files carry no unit information
+        warnings.simplefilter('ignore')
+        f_full = pynbody.load(hashed_multifile_snapshot)
+        f = pynbody.load(hashed_multifile_snapshot, take_region=region)
+
+        assert len(f) < len(f_full)
+        for fam in f_full.families():
+            assert set(f_full[fam][region]['iord']) <= set(f[fam]['iord'])
+            assert len(f[fam][region]) == len(f_full[fam][region])
+
+        npt.assert_equal(f.dm['mass'], 1.0)
+        npt.assert_allclose(f.gas['O'], f.gas['iord'] * 0.01)
+
+
+def test_take_region_without_hash_table(multifile_snapshot):
+    with pytest.raises(ValueError, match="hash table"):
+        pynbody.load(multifile_snapshot, take_region=pynbody.filt.Sphere(0.1, (0.5, 0.5, 0.5)))
+
+
+@pytest.mark.parametrize("read_gap, max_block_rows", [(4096, 1024 ** 2), (0, 1024 ** 2), (10, 7)])
+def test_partial_load(hashed_multifile_snapshot, monkeypatch, read_gap, max_block_rows):
+    # small gaps and blocks force the selected particles to be read in many separate blocks
+    monkeypatch.setattr(pynbody.snapshot.gadgethdf, "_take_read_gap", read_gap)
+    monkeypatch.setattr(pynbody.snapshot.gadgethdf, "_take_max_block_rows", max_block_rows)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        f_full = pynbody.load(hashed_multifile_snapshot)
+        take = np.unique(np.random.randint(0, len(f_full), 2000))
+        f = pynbody.load(hashed_multifile_snapshot, take=take)
+
+        assert f.partial_load
+        assert len(f) == len(take)
+        assert len(f.gas) == (take < len(f_full.gas)).sum()
+        for name in 'iord', 'pos', 'mass':
+            npt.assert_equal(f[name], f_full[name][take])
+        npt.assert_equal(f.gas['O'], f_full.gas['O'][take[take < len(f_full.gas)]])
+
+        with pytest.raises(RuntimeError):
+            f.write_array('pos')
+
+
+def test_iterate_chunks_from_disk(hashed_multifile_snapshot):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        f_full = pynbody.load(hashed_multifile_snapshot)
+        chunks = list(f_full._iterate_chunks_from_disk(1500))
+        assert all(c.partial_load and len(c) <= 1500 for c in chunks)
+        npt.assert_equal(np.concatenate([c['iord'] for c in chunks]), f_full['iord'])
+
+        # chunks of a partially-loaded snapshot load the corresponding part of the same selection
+        take = np.unique(np.random.randint(0, len(f_full), 2000))
+        f = pynbody.load(hashed_multifile_snapshot, take=take)
+        chunks = list(f._iterate_chunks_from_disk(500))
+        assert [len(c) for c in chunks] == [500] * (len(take) // 500) + [len(take) % 500] * (len(take) % 500 > 0)
+        npt.assert_equal(np.concatenate([c['iord'] for c in chunks]), f_full['iord'][take])
+
+
+def test_halo_load_copy(hashed_multifile_snapshot):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        f_full = pynbody.load(hashed_multifile_snapshot)
+        f_full['grp'] = np.asarray(f_full['pos'][:, 0] // 2.0).astype(int)
+        h = pynbody.halo.number_array.HaloNumberCatalogue(f_full, array='grp')
+
+        h2 = h.load_copy(2)
+        assert h2.properties['halo_number'] == 2
+        npt.assert_equal(h2['iord'], h[2]['iord'])
+        npt.assert_equal(h2['pos'], h[2]['pos'])
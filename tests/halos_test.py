@@ -3,6 +3,7 @@
 import warnings
 
 import numpy as np
+import numpy.testing as npt
 import pytest
 
 import pynbody
@@ -246,6 +247,39 @@ def test_halo_iterator():
     for i, this_h in enumerate(h, 1):
         assert this_h == h[i]
 
+def test_halo_cache():
+    f = pynbody.new(dm=100)
+    h = SimpleHaloCatalogue(f)
+    h.set_halo_cache_limits(max_halos=3)
+
+    h1 = h[1]
+    assert h[1] is h1
+    for i in range(2, 10):
+        h[i]
+    assert len(h.halo_cache) == 3
+    assert 1 not in h.halo_cache
+    assert h.halo_cache.hits == 1
+    assert h.halo_cache.misses == 9
+
+    # recently used halos are retained
+    h7 = h[7]
+    h[1]
+    assert h[7] is h7
+    assert 8 not in h.halo_cache
+
+    # limit on the size of the index arrays
+    h.set_halo_cache_limits(max_size_mb=(len(h[1]) + len(h[2])) * 8 * 2 / 1024 ** 2)
+    h[3]
+    assert len(h.halo_cache) < 3
+    assert h.halo_cache.nbytes <= h.halo_cache.max_bytes
+
+def test_halo_cache_iteration_constant_memory():
+    f = pynbody.new(dm=100)
+    h = SimpleHaloCatalogue(f)
+    h.set_halo_cache_limits(max_halos=1)
+    for this_h in h:
+        assert len(h.halo_cache) == 1
+
 def test_last_halo():
     f = pynbody.new(dm=100)
     h = SimpleHaloCatalogue(f)
@@ -270,6 +304,100 @@ def test_get_group_array():
     assert (f.dm['comparison_grp'] == dm_grp).all()
     assert (f.gas['comparison_grp'] == gas_grp).all()
 
+@pytest.mark.parametrize("dtype", [np.int16, np.int32, np.int64])
+def test_halo_number_per_particle_nested(dtype):
+    # halo 1 contains halo 2, which contains halo 3; halos 4 and 5 are the same size and overlap, so the later one wins
+    members = np.array([0, 1, 2, 3, 4, 5, 1, 2, 3, 4, 2, 3, 7, 8, 8, 9], dtype=np.int32)
+    boundaries = np.array([[0, 6], [6, 10], [10, 12], [12, 14], [14, 16]], dtype=np.int32)
+    index_lists = pynbody.halo.details.particle_indices.HaloParticleIndices(members, boundaries)
+    number_mapper = pynbody.halo.details.number_mapping.SimpleHaloNumberMapper(1, 5)
+
+    grp = index_lists.get_halo_number_per_particle(11, number_mapper, dtype=dtype)
+    assert grp.dtype == dtype
+    assert (grp == [1, 2, 3, 3, 2, 1, -1, 4, 5, 5, -1]).all()
+
+    with pytest.raises(IndexError):
+        index_lists.get_halo_number_per_particle(9, number_mapper)
+
+def test_group_array_cached(tmp_path):
+    f = pynbody.new(dm=100,gas=100)
+    h = SimpleHaloCatalogueWithMultiMembership(f)
+    grp = h.get_group_array()
+    assert h.get_group_array() is grp
+    assert grp.dtype == np.int32
+    assert not grp.flags.writeable
+    assert np.shares_memory(h.get_group_array(pynbody.family.gas), grp)
+
+    sidecar = tmp_path / "grp.npy"
+    h = SimpleHaloCatalogueWithMultiMembership(f)
+    h.set_group_array_sidecar(sidecar)
+    assert (h.get_group_array() == grp).all()
+    assert sidecar.exists()
+
+    h = SimpleHaloCatalogueWithMultiMembership(f)
+    h.set_group_array_sidecar(sidecar)
+    h._calculate_group_array = None # must not be called
+    assert (h.get_group_array() == grp).all()
+
+@pytest.mark.parametrize("family", [None, pynbody.family.gas])
+@pytest.mark.parametrize("catalogue_class", [SimpleHaloCatalogue, SimpleHaloCatalogueWithMultiMembership])
+def test_reduce(family, catalogue_class):
+    f = pynbody.new(dm=500, gas=500)
+    np.random.seed(1)
+    f['pos'] = np.random.normal(size=(1000, 3))
+    f['pos'].units = 'kpc'
+    f['mass'] = np.random.uniform(1.0, 2.0, size=1000)
+    f['mass'].units = 'Msol'
+    h = catalogue_class(f)
+
+    index_lists = h._get_all_particle_indices_cached()
+    halos = [f[np.sort(index_lists.get_particle_index_list_for_halo(i))] for i in range(len(h))]
+    if family is not None:
+        halos = [halo[family] for halo in halos]
+
+    mass = h.reduce('mass', family=family)
+    assert mass.units == 'Msol'
+    npt.assert_allclose(mass, [halo['mass'].sum() for halo in halos])
+
+    com = h.reduce('pos', 'mean', weight='mass', family=family)
+    assert com.units == 'kpc'
+    for halo, com_one_halo in zip(halos, com):
+        if len(halo) > 0:
+            npt.assert_allclose(com_one_halo, np.average(halo['pos'], weights=halo['mass'], axis=0))
+        else:
+            assert np.isnan(com_one_halo).all()
+
+    mass_weighted_x = h.reduce('x', 'sum', weight='mass', family=family)
+    assert mass_weighted_x.units == 'kpc Msol'
+    npt.assert_allclose(mass_weighted_x, [(halo['x'] * halo['mass']).sum() for halo in halos], atol=1e-10)
+
+    for op, reference in ('std', np.std), ('min', np.min), ('max', np.max):
+        result = h.reduce('x', op, family=family)
+        for halo, result_one_halo in zip(halos, result):
+            if len(halo) > 0:
+                npt.assert_allclose(result_one_halo, reference(halo['x']), atol=1e-10)
+            else:
+                assert np.isnan(result_one_halo)
+
+    with pytest.raises(ValueError):
+        h.reduce('x', 'median')
+
+def test_compute_properties():
+    f = pynbody.new(dm=1000)
+    np.random.seed(1)
+    f['pos'] = np.random.normal(size=(1000, 3))
+    f['vel'] = np.random.normal(size=(1000, 3))
+    f['mass'] = np.random.uniform(1.0, 2.0, size=1000)
+    h = SimpleHaloCatalogue(f)
+
+    props = h.compute_properties(['mass', 'com', 'com_vel', ('x', 'max'), ('vx', 'std', 'mass')])
+    assert set(props.keys()) == {'mass', 'com', 'com_vel', 'x_max', 'vx_std'}
+    npt.assert_allclose(props['mass'], h.reduce('mass'))
+    npt.assert_allclose(props['com'], h.reduce('pos', 'mean', weight='mass'))
+    npt.assert_allclose(props['com_vel'], h.reduce('vel', 'mean', weight='mass'))
+    npt.assert_allclose(props['x_max'], h.reduce('x', 'max'))
+    npt.assert_allclose(props['vx_std'], h.reduce('vx', 'std', weight='mass'))
+
 
 
 @pytest.fixture
@@ -121,3 +121,68 @@ def test_with_group_cat(halos, subfind_groups):
 
     properties = combined_catalogue.get_properties_all_halos()
     assert (properties['children'][0] == children_of_0).all()
+
+@pytest.mark.filterwarnings("ignore:Accessing multiple halos")
+def test_bulk_ingestion_synthetic(tmp_path):
+    import h5py
+    import numpy as np
+
+    np.random.seed(1)
+    npart = 1000
+    f = pynbody.new(dm=npart)
+    f['iord'] = np.random.permutation(npart) * 3 + 7
+
+    nhalos = 20
+    lengths = np.random.randint(0, 40, nhalos)
+    members = [np.random.choice(f['iord'], length, replace=False) for length in lengths]
+    nested = [np.array([], dtype=np.int64) for _ in range(nhalos)]
+    nested[0] = np.array([3, 5, 11])
+    nested[5] = np.array([7])
+    host = np.random.randint(-1, 4, nhalos)
+
+    subhalo_dtype = np.dtype([('TrackId', np.int64), ('Nbound', np.int64), ('HostHaloId', np.int64),
+                              ('ComovingAveragePosition', np.float32, (3,))])
+    subhalos = np.zeros(nhalos, dtype=subhalo_dtype)
+    subhalos['TrackId'] = np.arange(nhalos) * 2
+    subhalos['Nbound'] = lengths
+    subhalos['HostHaloId'] = host
+    subhalos['ComovingAveragePosition'] = np.random.uniform(size=(nhalos, 3))
+
+    filename = tmp_path / "SubSnap_000.0.hdf5"
+    with h5py.File(filename, 'w') as hbt:
+        hbt['NumberOfFiles'] = [1]
+        hbt['NumberOfSubhalosInAllFiles'] = [nhalos]
+        hbt['Subhalos'] = subhalos
+        vlen_int = h5py.vlen_dtype(np.int64)
+        hbt.create_dataset('SubhaloParticles', (nhalos,), dtype=vlen_int)[:] = members
+        hbt.create_dataset('NestedSubhalos', (nhalos,), dtype=vlen_int)[:] = nested
+
+    h = pynbody.halo.hbtplus.HBTPlusCatalogue(f, hbt_filename=filename)
+
+    for load_all in False, True:
+        if load_all:
+            h.load_all()
+        for i in range(nhalos):
+            assert (np.sort(h[i]['iord']) == np.sort(members[i])).all()
+
+    assert (h[0].properties['children'] == [3, 5, 11]).all()
+    assert len(h[1].properties['children']) == 0
+    assert h[3].properties['parent'] == 0
+    assert h[7].properties['parent'] == 5
+    assert h[0].properties['parent'] == -1
+    assert h[4].properties['TrackId'] == 8
+    npt.assert_allclose(h[4].properties['ComovingAveragePosition'], subhalos['ComovingAveragePosition'][4])
+
+    properties = h.get_properties_all_halos()
+    assert (properties['Nbound'] == lengths).all()
+    assert len(properties['children']) == nhalos
+    assert (properties['children'][5] == [7]).all()
+    assert all(len(properties['children'][i]) == 0 for i in range(nhalos) if i not in (0, 5))
+    assert properties['parent'][11] == 0
+
+    f['grp'] = np.random.randint(0, 4, npart)
+    groups = pynbody.halo.number_array.HaloNumberCatalogue(f, array='grp')
+    with_groups = h.with_groups_from(groups)
+    for group in range(4):
+        expected = np.where(host == group)[0]
+        assert (with_groups.get_properties_one_halo(group)['children'] == expected).all()
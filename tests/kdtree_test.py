@@ -282,3 +282,94 @@ def test_kdtree_shared_mem(npart=1000):
     gc.collect()
     shared._ensure_shared_memory_clean()
     assert shared.get_num_shared_arrays() == n
+
+
+def test_kdtree_cache_path(tmp_path, npart=1000):
+    cache_path = tmp_path / "tree"
+
+    f = _make_test_gaussian(npart)
+    f.build_tree(cache_path=cache_path)
+    assert (cache_path / "meta.json").exists()
+    smooth = np.array(f['smooth'])
+
+    f = _make_test_gaussian(npart)
+    f.build_tree(cache_path=cache_path)
+    assert isinstance(f.kdtree.kdnodes, np.memmap) # loaded, not rebuilt
+    npt.assert_allclose(f['smooth'], smooth)
+
+    # positions have changed, so the stored tree is stale and must be replaced
+    f = _make_test_gaussian(npart)
+    f['pos'] *= 2
+    f.build_tree(cache_path=cache_path)
+    assert not isinstance(f.kdtree.kdnodes, np.memmap)
+    npt.assert_allclose(f['smooth'], 2 * smooth, rtol=1e-6)
+
+    f = _make_test_gaussian(npart)
+    f['pos'] *= 2
+    f.build_tree(cache_path=cache_path)
+    assert isinstance(f.kdtree.kdnodes, np.memmap)
+
+    with pytest.raises(ValueError):
+        f = _make_test_gaussian(npart)
+        f.build_tree(cache_path=cache_path, shared_mem=True)
+
+
+@pytest.mark.filterwarnings("ignore:No readable param file:RuntimeWarning")
+def test_kdtree_default_cache_path_per_subsnap(tmp_path, npart=1000):
+    f = pynbody.new(dm=npart, gas=npart)
+    np.random.seed(1337)
+    f['pos'] = np.random.normal(1.0, size=(2 * npart, 3))
+    for name in 'mass', 'eps', 'phi':
+        f[name] = np.ones(2 * npart)
+    for name in 'rho', 'temp', 'metals':
+        f.gas[name] = np.ones(npart)
+    f.properties['a'] = 1.0
+    filename = str(tmp_path / "snap")
+    f.write(fmt=pynbody.snapshot.tipsy.TipsySnap, filename=filename)
+
+    f = pynbody.load(filename)
+    f.dm.build_tree(cache_path=True)
+    f.gas.build_tree(cache_path=True)
+    f.build_tree(cache_path=True)
+    cache_paths = {f.dm._get_kdtree_cache_path(True), f.gas._get_kdtree_cache_path(True),
+                   f._get_kdtree_cache_path(True)}
+    assert len(cache_paths) == 3
+    assert all((p / "meta.json").exists() for p in cache_paths)
+    assert f._get_kdtree_cache_path(True) == tmp_path / "snap.kdtree"
+
+    f = pynbody.load(filename)
+    for subsnap in f.dm, f.gas, f:
+        subsnap.build_tree(cache_path=True)
+        assert isinstance(subsnap.kdtree.kdnodes, np.memmap) # each tree was kept, not overwritten
+        assert len(subsnap.kdtree.particle_offsets) == len(subsnap)
+
+
+@pytest.mark.parametrize("boxsize", [None, 1.0])
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_query(boxsize, dtype, npart=5000, nquery=100):
+    f = pynbody.new(dm=npart)
+    np.random.seed(1337)
+    f['pos'] = np.random.uniform(size=(npart, 3)).astype(dtype)
+    f['mass'] = np.ones(npart, dtype=dtype)
+    if boxsize is not None:
+        f.properties['boxsize'] = boxsize
+    f.build_tree()
+
+    points = np.random.uniform(size=(nquery, 3))
+    offsets = np.asarray(f['pos'], dtype=np.float64)[np.newaxis, :, :] - points[:, np.newaxis, :]
+    if boxsize is not None:
+        offsets -= boxsize * np.round(offsets / boxsize)
+    all_distances = np.sqrt((offsets ** 2).sum(axis=2))
+
+    indices, distances = f.kdtree.query(points, k=10)
+    assert indices.shape == distances.shape == (nquery, 10)
+    npt.assert_equal(indices, np.argsort(all_distances, axis=1)[:, :10])
+    npt.assert_allclose(distances, np.sort(all_distances, axis=1)[:, :10], rtol=1e-5)
+
+    radii = np.random.uniform(0.0, 0.2, size=nquery)
+    indptr, indices, distances = f.kdtree.query_ball(points, radii)
+    assert len(indptr) == nquery + 1
+    for i in range(nquery):
+        found = indices[indptr[i]:indptr[i + 1]]
+        npt.assert_equal(np.sort(found), np.where(all_distances[i] <= radii[i])[0])
+        npt.assert_allclose(distances[indptr[i]:indptr[i + 1]], all_distances[i, found], rtol=1e-5)
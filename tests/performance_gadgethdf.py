@@ -0,0 +1,98 @@
+import contextlib
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import h5py
+import numpy as np
+
+import pynbody
+
+
+@contextlib.contextmanager
+def timer(name):
+    start = time.time()
+    yield
+    end = time.time()
+    print(f"{name} took {end-start:.2f}s")
+
+print("""performance_gadgethdf.py
+
+This script is designed to test the performance of reading GadgetHDF snapshots that span multiple files,
+and of partially loading scattered particles (as for the members of a halo) with take. It does not test the
+correctness, for which the normal unit tests should be used.
+
+You can test with different numbers of reader processes by passing the number as an argument to this script.
+The default is to compare serial reading against 4 processes.
+
+""")
+
+try:
+    num_processes = [int(sys.argv[1])]
+except Exception:
+    num_processes = [1, 4]
+
+np.random.seed(1337)
+
+Nfiles = 16
+Npart_per_file = 1000000
+
+Npart_single_file = 400000
+Ntake = [10000, 50000]
+
+def write_snapshot(basename, Nfiles=Nfiles, Npart_per_file=Npart_per_file):
+    for i in range(Nfiles):
+        with h5py.File(f"{basename}.{i}.hdf5", "w") as f:
+            header = f.create_group("Header")
+            header.attrs['NumFilesPerSnapshot'] = Nfiles
+            header.attrs['NumPart_ThisFile'] = np.array([0, Npart_per_file, 0, 0, 0, 0])
+            header.attrs['NumPart_Total'] = np.array([0, Npart_per_file * Nfiles, 0, 0, 0, 0])
+            header.attrs['MassTable'] = np.array([0.0, 1.0, 0.0, 0.0, 0.0, 0.0])
+            header.attrs['Time'] = 1.0
+            header.attrs['Redshift'] = 0.0
+            header.attrs['BoxSize'] = 100.0
+            header.attrs['HubbleParam'] = 0.7
+            header.attrs['Omega0'] = 0.3
+            header.attrs['OmegaLambda'] = 0.7
+            dm = f.create_group("PartType1")
+            dm['ParticleIDs'] = np.arange(i * Npart_per_file, (i + 1) * Npart_per_file)
+            # compression makes reading CPU-bound, which is where parallel reading helps most
+            dm.create_dataset('Coordinates', data=np.random.uniform(size=(Npart_per_file, 3)),
+                              compression='gzip')
+            dm.create_dataset('Velocities', data=np.random.normal(size=(Npart_per_file, 3)).astype(np.float32),
+                              compression='gzip')
+
+warnings.simplefilter('ignore')
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    basename = os.path.join(tmpdir, "snap")
+    with timer(f"writing {Nfiles} files"):
+        write_snapshot(basename)
+
+    for n in num_processes:
+        pynbody.snapshot.gadgethdf.multiprocess_num = n
+        f = pynbody.load(basename)
+
+        with timer(f"pos with {n} process(es)"):
+            _ = f['pos']
+
+        with timer(f"vel with {n} process(es)"):
+            _ = f['vel']
+
+        del f
+
+    single_basename = os.path.join(tmpdir, "single")
+    with timer(f"writing a single file of {Npart_single_file} particles"):
+        write_snapshot(single_basename, 1, Npart_single_file)
+
+    with timer("loading the whole single-file snapshot"):
+        f = pynbody.load(single_basename)
+        _ = f['pos']
+
+    for n in Ntake:
+        take = np.sort(np.random.choice(Npart_single_file, n, replace=False))
+        with timer(f"loading {n} scattered particles with take"):
+            f = pynbody.load(single_basename, take=take)
+            _ = f['pos']
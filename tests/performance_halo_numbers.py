@@ -0,0 +1,105 @@
+import contextlib
+import sys
+import time
+
+import numpy as np
+
+from pynbody.halo.details.number_mapping import SimpleHaloNumberMapper
+from pynbody.halo.details.particle_indices import HaloParticleIndices
+
+
+@contextlib.contextmanager
+def timer(name):
+    start = time.time()
+    yield
+    end = time.time()
+    print(f"{name} took {end-start:.2f}s")
+
+print("""performance_halo_numbers.py
+
+This script is designed to test the performance of generating the halo number for each particle (as used by
+get_group_array) from a catalogue's particle index lists. It does not test the correctness, for which the normal
+unit tests should be used.
+
+A synthetic catalogue of subhalos nested inside parent halos is generated. The current implementation is compared
+with the previous one, which looped over halos in python. You can change the number of subhalos (in millions) by
+passing it as an argument to this script. Pass 0 as a second argument to skip the (slow) previous implementation.
+
+""")
+
+try:
+    Nsub = int(float(sys.argv[1]) * 1e6)
+except Exception:
+    Nsub = 10000000
+
+try:
+    run_legacy = bool(int(sys.argv[2]))
+except Exception:
+    run_legacy = True
+
+Nsub_per_parent = 10
+
+np.random.seed(1337)
+
+
+def legacy_halo_number_per_particle(index_lists, sim_length, number_mapper, fill_value=-1, dtype=int):
+    """The previous implementation of HaloParticleIndices.get_halo_number_per_particle"""
+    lengths = np.diff(index_lists.particle_index_list_boundaries, axis=1).ravel()
+    ordering = np.argsort(-lengths, kind='stable')
+
+    id_array = np.empty(sim_length, dtype=dtype)
+    id_array.fill(fill_value)
+
+    halo_numbers = number_mapper.index_to_number(ordering)
+    for halo_number, halo_index in zip(halo_numbers, ordering):
+        indexing_slice = index_lists._get_index_slice_for_halo(halo_index)
+        id_array[index_lists.particle_index_list[indexing_slice]] = halo_number
+
+    return id_array
+
+
+with timer("generate synthetic catalogue"):
+    # subhalos own contiguous runs of a random permutation of the particles; each parent halo contains the
+    # particles of Nsub_per_parent consecutive subhalos, followed by some particles of its own
+    Nparent = Nsub // Nsub_per_parent
+    Nsub = Nparent * Nsub_per_parent
+    sub_lengths = np.random.geometric(0.3, size=Nsub)
+    parent_own_lengths = np.random.geometric(0.1, size=Nparent)
+
+    sub_ptrs = np.concatenate(([0], np.cumsum(sub_lengths)))
+    Nin_sub = sub_ptrs[-1]
+    Nparent_own = parent_own_lengths.sum()
+    Npart = Nin_sub + Nparent_own + Nsub  # leave some particles outside any halo
+
+    particles = np.random.permutation(Npart)
+    sub_members = particles[:Nin_sub]
+    parent_own_members = particles[Nin_sub:Nin_sub + Nparent_own]
+
+    parent_sub_lengths = np.diff(sub_ptrs[::Nsub_per_parent])
+    parent_ptrs = np.concatenate(([0], np.cumsum(parent_sub_lengths + parent_own_lengths)))
+
+    is_own = np.zeros(parent_ptrs[-1], dtype=bool)
+    own_offset = np.arange(Nparent_own) - np.repeat(np.cumsum(parent_own_lengths) - parent_own_lengths,
+                                                    parent_own_lengths)
+    is_own[np.repeat(parent_ptrs[:-1] + parent_sub_lengths, parent_own_lengths) + own_offset] = True
+
+    parent_members = np.empty(parent_ptrs[-1], dtype=particles.dtype)
+    parent_members[~is_own] = sub_members
+    parent_members[is_own] = parent_own_members
+
+    members = np.concatenate((parent_members, sub_members))
+    starts = np.concatenate((parent_ptrs[:-1], len(parent_members) + sub_ptrs[:-1]))
+    stops = np.concatenate((parent_ptrs[1:], len(parent_members) + sub_ptrs[1:]))
+    index_lists = HaloParticleIndices(particle_ids=members, boundaries=np.vstack((starts, stops)).T)
+    number_mapper = SimpleHaloNumberMapper(1, len(index_lists))
+
+print(f"Using {Nsub} subhalos in {Nparent} parent halos, with {Npart} particles")
+
+with timer("current"):
+    current = index_lists.get_halo_number_per_particle(Npart, number_mapper)
+
+if run_legacy:
+    with timer("legacy"):
+        legacy = legacy_halo_number_per_particle(index_lists, Npart, number_mapper)
+
+    assert (current == legacy).all()
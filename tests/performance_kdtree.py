@@ -83,3 +83,12 @@ with timer("get smooth"):
 
 with timer("get rho"):
     _ = f['rho']
+
+Nquery = 1000000
+query_points = np.random.uniform(size=(Nquery, 3)) - 0.5
+
+with timer(f"nearest-neighbour queries for {Nquery} points"):
+    _ = f.kdtree.query(query_points, k=32)
+
+with timer(f"ball queries for {Nquery} points"):
+    _ = f.kdtree.query_ball(query_points, 0.005)
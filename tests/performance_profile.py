@@ -0,0 +1,109 @@
+import contextlib
+import sys
+import time
+from bisect import bisect
+
+import numpy as np
+
+import pynbody
+
+
+@contextlib.contextmanager
+def timer(name):
+    start = time.time()
+    yield
+    end = time.time()
+    print(f"{name} took {end-start:.2f}s")
+
+print("""performance_profile.py
+
+This script is designed to test the performance of constructing profiles.
+It does not test the correctness, for which the normal unit tests should be used.
+
+The current implementation is compared with the previous one, which looped over bins in python. You can
+change the number of particles (in millions) by passing it as an argument to this script.
+
+""")
+
+try:
+    Npart = int(float(sys.argv[1]) * 1e6)
+except Exception:
+    Npart = 10000000
+
+Nbins = 1000
+
+np.random.seed(1337)
+
+f = pynbody.new(dm=Npart)
+f['pos'] = np.random.normal(size=(Npart, 3))
+f['pos'].units = 'kpc'
+f['vel'] = np.random.normal(size=(Npart, 3))
+f['vel'].units = 'km s^-1'
+f['mass'] = np.random.uniform(1.0, 2.0, size=Npart)
+f['mass'].units = 'Msol'
+f['vr'] # derive before timing
+
+
+def legacy_binind(partbin, nbins):
+    """The previous implementation of Profile._setup_bins"""
+    binind = []
+    sortind = partbin.argsort()
+    sort_pind = partbin[sortind]
+    prev_index = bisect(sort_pind, 0)
+    for i in range(nbins):
+        new_index = bisect(sort_pind, i + 1)
+        binind.append(np.sort(sortind[prev_index:new_index]))
+        prev_index = new_index
+    return binind
+
+
+def legacy_auto_profile(sim, binind, name, weight, dispersion=False, median=False):
+    """The previous implementation of Profile._auto_profile"""
+    result = np.zeros(len(binind))
+    for i in range(len(binind)):
+        subs = sim[binind[i]]
+        name_array = subs[name].view(np.ndarray)
+        mass_array = subs['mass'].view(np.ndarray)
+        if dispersion:
+            sq_mean = (name_array ** 2 * mass_array).sum() / weight[i]
+            mean_sq = ((name_array * mass_array).sum() / weight[i]) ** 2
+            result[i] = np.sqrt(max(sq_mean - mean_sq, 0))
+        elif median:
+            result[i] = sorted(name_array)[len(name_array) // 2] if len(name_array) > 0 else np.nan
+        else:
+            result[i] = (name_array * mass_array).sum() / weight[i]
+    return result
+
+
+print(f"Using {Npart} particles and {Nbins} bins")
+
+with timer("construct profile"):
+    p = pynbody.analysis.profile.Profile(f, nbins=Nbins)
+
+with timer("current: mass"):
+    _ = p['mass']
+
+with timer("current: vr"):
+    _ = p['vr']
+
+with timer("current: vr_disp"):
+    _ = p['vr_disp']
+
+with timer("current: vr_med"):
+    _ = p['vr_med']
+
+with timer("legacy: bin indices"):
+    binind = legacy_binind(p.partbin, Nbins)
+
+with timer("legacy: mass"):
+    pmass = f['mass'].view(np.ndarray)
+    mass = np.array([pmass[b].sum() for b in binind])
+
+with timer("legacy: vr"):
+    _ = legacy_auto_profile(f, binind, 'vr', mass)
+
+with timer("legacy: vr_disp"):
+    _ = legacy_auto_profile(f, binind, 'vr', mass, dispersion=True)
+
+with timer("legacy: vr_med"):
+    _ = legacy_auto_profile(f, binind, 'vr', mass, median=True)
@@ -0,0 +1,89 @@
+import contextlib
+import sys
+import time
+
+import numpy as np
+
+import pynbody
+
+
+@contextlib.contextmanager
+def timer(name):
+    start = time.time()
+    yield
+    end = time.time()
+    print(f"{name} took {end-start:.2f}s")
+
+print("""performance_sph_image.py
+
+This script is designed to test the performance of rendering SPH images and 3D grids.
+It does not test the correctness, for which the normal unit tests should be used.
+
+The tiled image renderer and slab-decomposed grid renderer are compared with the single-threaded
+renderers. You can change the number of particles (in millions) by passing it as an argument to this
+script, and the number of threads by passing it as a second argument.
+
+""")
+
+try:
+    Npart = int(float(sys.argv[1]) * 1e6)
+except Exception:
+    Npart = 2000000
+
+try:
+    Nthreads = int(sys.argv[2])
+except Exception:
+    Nthreads = pynbody.config['number_of_threads']
+
+Npix = 2000
+
+np.random.seed(1337)
+
+f = pynbody.new(gas=Npart)
+f['pos'] = np.random.normal(size=(Npart, 3))
+f['pos'].units = 'kpc'
+f['mass'] = np.random.uniform(1.0, 2.0, size=Npart)
+f['mass'].units = 'Msol'
+
+with timer("smoothing lengths and densities"):
+    f['rho']
+
+print(f"Using {Npart} particles, {Npix}x{Npix} pixels and {Nthreads} threads")
+
+for approximate_fast in False, True:
+    label = "approximate" if approximate_fast else "exact"
+    kwargs = dict(x2=3.0, nx=Npix, approximate_fast=approximate_fast)
+
+    with timer(f"{label}: single-threaded"):
+        pynbody.sph.render_image(f, 'rho', threaded=False, tiled=False, **kwargs)
+
+    with timer(f"{label}: threaded"):
+        pynbody.sph.render_image(f, 'rho', threaded=Nthreads, tiled=False, **kwargs)
+
+    with timer(f"{label}: tiled"):
+        pynbody.sph.render_image(f, 'rho', threaded=Nthreads, tiled=True, **kwargs)
+
+f['temp'] = np.random.uniform(1.0, 2.0, size=Npart)
+f['temp'].units = 'K'
+f['metals'] = np.random.uniform(0.0, 0.02, size=Npart)
+
+for approximate_fast in False, True:
+    label = "approximate" if approximate_fast else "exact"
+    kwargs = dict(x2=3.0, nx=Npix, approximate_fast=approximate_fast, threaded=Nthreads)
+
+    with timer(f"{label}: three quantities in separate passes"):
+        for qty in 'rho', 'temp', 'metals':
+            pynbody.sph.render_image(f, qty, **kwargs)
+
+    with timer(f"{label}: three quantities in a single pass"):
+        pynbody.sph.render_images(f, ['rho', 'temp', 'metals'], **kwargs)
+
+Ngrid = 200
+
+print(f"Using {Ngrid}^3 grid cells")
+
+with timer("3d grid: single-threaded"):
+    pynbody.sph.to_3d_grid(f, 'rho', nx=Ngrid, x2=3.0, threaded=False, approximate_fast=False)
+
+with timer("3d grid: slab-decomposed"):
+    pynbody.sph.to_3d_grid(f, 'rho', nx=Ngrid, x2=3.0, threaded=Nthreads, approximate_fast=False)
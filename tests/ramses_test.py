@@ -505,3 +505,81 @@ def test_tipsy_conversion_for_cosmo_gas():
         # Clean up our namelist to avoid any other issues with other tests
         Path(path + os.sep + "namelist.txt").unlink(missing_ok=True)
         Path(tipsy_path + ".param").unlink(missing_ok=True)
+
+
+def test_hilbert_keys():
+    from pynbody.snapshot.ramses import _hilbert3d
+
+    bit_length = 3
+    n = 2 ** bit_length
+    x, y, z = (q.ravel() for q in np.meshgrid(*([np.arange(n)] * 3), indexing='ij'))
+    keys = _hilbert3d(x, y, z, bit_length)
+
+    # every cell has a unique key, and cells consecutive along the curve are neighbours
+    assert (np.sort(keys) == np.arange(n ** 3)).all()
+    order = np.argsort(keys)
+    steps = np.abs(np.diff(np.stack((x[order], y[order], z[order]), axis=1), axis=0)).sum(axis=1)
+    assert (steps == 1).all()
+
+
+def test_hilbert_domains_intersecting_region():
+    from pynbody.snapshot.ramses import _hilbert_domains_intersecting_region
+
+    levelmax = 7
+    ncpu = 8
+    max_key = 2.0 ** (3 * (levelmax + 1))
+    bound_keys = np.linspace(0, max_key, ncpu + 1)
+
+    # each of the eight octants of the box is one domain, since the curve visits them in turn
+    region = pynbody.filt.Sphere(0.1, (0.25, 0.25, 0.25))
+    assert _hilbert_domains_intersecting_region(region, bound_keys, levelmax, 1.0) == [1]
+
+    region = pynbody.filt.Sphere(0.1, (0.5, 0.5, 0.5))
+    assert _hilbert_domains_intersecting_region(region, bound_keys, levelmax, 1.0) == list(range(1, 9))
+
+    region = pynbody.filt.Cuboid(0.0, 0.0, 0.0, 1.0, 1.0, 1.0)
+    assert _hilbert_domains_intersecting_region(region, bound_keys, levelmax, 1.0) == list(range(1, 9))
+
+
+def test_take_region():
+    f_full = pynbody.load("testdata/ramses_partial_output_00250")
+    region = pynbody.filt.Sphere(2.0, np.asarray(f_full.dm['pos'][50]))
+    f = pynbody.load("testdata/ramses_partial_output_00250", take_region=region)
+
+    assert len(f) < len(f_full)
+    assert set(f_full.dm[region]['iord']) <= set(f.dm['iord'])
+    assert len(f.gas[region]) == len(f_full.gas[region])
+
+    with pytest.raises(ValueError):
+        pynbody.load("testdata/ramses_partial_output_00250", take_region=region, cpus=[1])
+
+
+def test_cached_amr_index(tmp_path, monkeypatch):
+    import shutil
+    path = tmp_path / "output_00250"
+    shutil.copytree("testdata/ramses_partial_output_00250", path)
+
+    f_ref = pynbody.load("testdata/ramses_partial_output_00250")
+
+    monkeypatch.setattr(pynbody.snapshot.ramses, "_cache_amr_index", True)
+    f = pynbody.load(str(path))
+    assert len(list(path.glob("amr_00250.out*.leafcells-all.npz"))) == len(f._cpus)
+
+    # a second load uses the saved index
+    monkeypatch.setattr(pynbody.snapshot.ramses, "_cpui_leaf_cell_index_from_walk", None)
+    f = pynbody.load(str(path))
+    assert len(f.gas) == len(f_ref.gas)
+    npt.assert_allclose(f.gas['rho'], f_ref.gas['rho'])
+    npt.assert_allclose(f.gas['phi'], f_ref.gas['phi'])
+    npt.assert_equal(f.gas['cpu'], f_ref.gas['cpu'])
+
+    # an index is not reused once its AMR file has been rewritten
+    amr_filename = path / "amr_00250.out00001"
+    stat = os.stat(amr_filename)
+    os.utime(amr_filename, (stat.st_atime, stat.st_mtime + 10))
+    monkeypatch.undo()
+    monkeypatch.setattr(pynbody.snapshot.ramses, "_cache_amr_index", True)
+    f = pynbody.load(str(path))
+    with np.load(str(amr_filename) + ".leafcells-all.npz") as index:
+        assert index['file_mtime'] == os.stat(amr_filename).st_mtime
+    npt.assert_allclose(f.gas['rho'], f_ref.gas['rho'])
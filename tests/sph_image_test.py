@@ -141,3 +141,155 @@ def intentional_circular_reference(sim):
 def test_exception_propagation():
     with pytest.raises(RuntimeError):
         pynbody.plot.sph.image(f.gas, qty='intentional_circular_reference')
+
+def test_interpolate():
+    np.random.seed(1337)
+    n = 10000
+    f_test = pynbody.new(gas=n)
+    f_test['pos'] = pynbody.array.SimArray(np.random.uniform(-1.0, 1.0, size=(n, 3)), 'kpc')
+    f_test['mass'] = pynbody.array.SimArray(np.ones(n) / n, 'Msol')
+    f_test['temp'] = pynbody.array.SimArray(np.random.uniform(1.0, 2.0, size=n), 'K')
+    f_test.properties['boxsize'] = pynbody.units.Unit("2 kpc")
+
+    # at the particle positions, a gather estimate of the density is the SPH density itself
+    rho = pynbody.sph.interpolate(f_test, 'rho', f_test['pos'][:100])
+    assert rho.units == f_test['rho'].units
+    npt.assert_allclose(rho, f_test['rho'][:100], rtol=1e-3)
+
+    points = pynbody.array.SimArray(np.random.uniform(-1000.0, 1000.0, size=(50, 3)), 'pc')
+    temp = pynbody.sph.interpolate(f_test, 'temp', points)
+    pos = pynbody.sph.interpolate(f_test, 'pos', points)
+    assert temp.shape == (50,)
+    assert pos.shape == (50, 3)
+
+    # brute-force gather estimate at the same points, allowing for periodic wrapping
+    offsets = f_test['pos'].view(np.ndarray)[np.newaxis, :, :] - points.in_units('kpc').view(np.ndarray)[:, np.newaxis, :]
+    offsets -= 2.0 * np.round(offsets / 2.0)
+    distances = np.sqrt((offsets ** 2).sum(axis=2))
+    h = np.sort(distances, axis=1)[:, pynbody.config['sph']['smooth-particles'] - 1] / 2
+    kernel = pynbody.sph.Kernel()
+    weights = np.vectorize(kernel.get_value)(distances / h[:, np.newaxis]) / h[:, np.newaxis] ** 3
+    expected = (weights * (f_test['mass'] * f_test['temp'] / f_test['rho']).view(np.ndarray)).sum(axis=1)
+    npt.assert_allclose(temp, expected, rtol=1e-2)
+
+    temp_mK = pynbody.sph.interpolate(f_test, 'temp', points, out_units='1e-3 K')
+    assert temp_mK.units == pynbody.units.Unit('1e-3 K')
+    npt.assert_allclose(np.asarray(temp_mK), 1000 * np.asarray(temp), rtol=1e-6)
+
+    with pytest.raises(ValueError):
+        pynbody.sph.interpolate(f_test, 'temp', points, kernel=pynbody.sph.Kernel2D())
+
+
+@pytest.mark.parametrize("boxsize", [None, "1.5 kpc"])
+def test_tiled_image(boxsize):
+    np.random.seed(1337)
+    n = 20000
+    f_test = pynbody.new(gas=n)
+    f_test['mass'] = pynbody.array.SimArray(np.ones(n) / n, 'Msol')
+    f_test['temp'] = pynbody.array.SimArray(np.random.uniform(1.0, 2.0, size=n), 'K')
+    if boxsize is None:
+        f_test['pos'] = pynbody.array.SimArray(np.random.normal(scale=0.5, size=(n, 3)), 'kpc')
+    else:
+        f_test['pos'] = pynbody.array.SimArray(np.random.uniform(-0.75, 0.75, size=(n, 3)), 'kpc')
+        f_test.properties['boxsize'] = pynbody.units.Unit(boxsize)
+
+    for qty in 'rho', 'temp':
+        # the second image has a number of pixels that is not a multiple of the tile size, and the third is a
+        # slice away from z = 0
+        for kwargs in dict(x2=1.0, nx=150), dict(x2=0.5, nx=37), dict(x2=1.0, nx=150, z_plane=0.3):
+            im = pynbody.sph.render_image(f_test, qty, approximate_fast=False, threaded=False, tiled=False,
+                                          **kwargs)
+            im_tiled = pynbody.sph.render_image(f_test, qty, approximate_fast=False, threaded=2, tiled=True,
+                                                **kwargs)
+            assert im_tiled.units == im.units
+            npt.assert_allclose(np.asarray(im_tiled), np.asarray(im), rtol=1e-5, atol=1e-6 * np.asarray(im).max())
+
+
+def test_3d_grid_slabs(tmp_path):
+    np.random.seed(1337)
+    n = 20000
+    f_test = pynbody.new(gas=n)
+    f_test['pos'] = pynbody.array.SimArray(np.random.uniform(-0.75, 0.75, size=(n, 3)), 'kpc')
+    f_test['mass'] = pynbody.array.SimArray(np.ones(n) / n, 'Msol')
+    f_test['temp'] = pynbody.array.SimArray(np.random.uniform(1.0, 2.0, size=n), 'K')
+    f_test.properties['boxsize'] = pynbody.units.Unit("1.5 kpc")
+
+    grid = pynbody.sph.to_3d_grid(f_test, 'temp', nx=30, ny=20, nz=25, x2=0.5, approximate_fast=False,
+                                  threaded=False)
+    grid_slabs = pynbody.sph.to_3d_grid(f_test, 'temp', nx=30, ny=20, nz=25, x2=0.5, approximate_fast=False,
+                                        threaded=3)
+    assert grid_slabs.units == grid.units
+    npt.assert_allclose(np.asarray(grid_slabs), np.asarray(grid), rtol=1e-5, atol=1e-6 * np.asarray(grid).max())
+
+    out = np.memmap(tmp_path / "grid.dat", dtype=np.float32, mode='w+', shape=(30, 20, 25))
+    grid_out = pynbody.sph.to_3d_grid(f_test, 'temp', nx=30, ny=20, nz=25, x2=0.5, approximate_fast=False,
+                                      threaded=False, out=out)
+    assert np.shares_memory(grid_out, out)
+    npt.assert_allclose(np.asarray(out), np.asarray(grid), rtol=1e-5, atol=1e-6 * np.asarray(grid).max())
+
+    with pytest.raises(ValueError):
+        pynbody.sph.to_3d_grid(f_test, 'temp', nx=30, x2=0.5, out=out)
+
+
+def test_render_image_chunked(tmp_path):
+    np.random.seed(1337)
+    f = pynbody.new(dm=1000, gas=2000, order='gas,dm')
+    f['pos'] = np.random.normal(scale=0.5, size=(3000, 3))
+    f['mass'] = np.random.uniform(1.0, 2.0, size=3000)
+    f['eps'] = np.ones(3000)
+    f['phi'] = np.ones(3000)
+    for name in 'temp', 'metals':
+        f.gas[name] = np.random.uniform(1.0, 2.0, size=2000)
+    # store a physical density; otherwise the file holds rho = 0 and the rendered images are not finite
+    rho = np.array(f.gas['rho'])
+    del f.gas['rho'], f.gas['smooth'] # smoothing lengths are written separately below
+    f.gas['rho'] = rho
+    f.properties['a'] = 1.0
+    filename = str(tmp_path / "snapshot.tipsy")
+    f.write(fmt=pynbody.snapshot.tipsy.TipsySnap, filename=filename)
+
+    with pytest.warns(RuntimeWarning):
+        f = pynbody.load(filename)
+    npt.assert_allclose(f.gas['rho'], rho, rtol=1e-6)
+
+    # smoothing lengths must be available on disk for chunked rendering
+    with pytest.raises(ValueError), pytest.warns(RuntimeWarning, match="No readable param file"):
+        pynbody.sph.render_image_chunked(filename, 'temp', family=pynbody.family.gas, chunk_size=700, x2=1.0,
+                                         nx=50)
+
+    f.gas['smooth'].write()
+    im = pynbody.sph.render_image(f.gas, 'temp', x2=1.0, nx=50, approximate_fast=False, denoise=False)
+
+    with pytest.warns(RuntimeWarning, match="No readable param file"):
+        im_chunked = pynbody.sph.render_image_chunked(filename, 'temp', family=pynbody.family.gas,
+                                                      chunk_size=700, x2=1.0, nx=50, approximate_fast=False)
+    assert im_chunked.units == im.units
+    im, im_chunked = np.asarray(im), np.asarray(im_chunked)
+    assert np.isfinite(im).all() and np.isfinite(im_chunked).all()
+    assert im.max() > 0
+    # chunks are summed in a different order to the single-pass render, so allow for float32 rounding
+    npt.assert_allclose(im_chunked, im, rtol=1e-3, atol=1e-6 * im.max())
+
+
+def test_render_images():
+    np.random.seed(1337)
+    n = 20000
+    f_test = pynbody.new(gas=n)
+    f_test['pos'] = pynbody.array.SimArray(np.random.normal(scale=0.5, size=(n, 3)), 'kpc')
+    f_test['mass'] = pynbody.array.SimArray(np.ones(n) / n, 'Msol')
+    f_test['temp'] = pynbody.array.SimArray(np.random.uniform(1.0, 2.0, size=n), 'K')
+
+    for kwargs in (dict(approximate_fast=False), dict(approximate_fast=True),
+                   dict(approximate_fast=False, denoise=True),
+                   dict(approximate_fast=False, kernel=pynbody.sph.Kernel2D(), out_units=[None, 'Msol pc^-2'])):
+        out_units = kwargs.pop('out_units', [None, None])
+        ims = pynbody.sph.render_images(f_test, ['temp', 'rho'], x2=1.0, nx=100, out_units=out_units, **kwargs)
+        assert len(ims) == 2
+        for im, qty, qty_out_units in zip(ims, ['temp', 'rho'], out_units):
+            im_ref = pynbody.sph.render_image(f_test, qty, x2=1.0, nx=100, out_units=qty_out_units,
+                                              tiled=False, **kwargs)
+            assert im.units == im_ref.units
+            npt.assert_allclose(np.asarray(im), np.asarray(im_ref), rtol=1e-5, atol=1e-6 * np.asarray(im_ref).max())
+
+    with pytest.raises(ValueError):
+        pynbody.sph.render_images(f_test, ['temp', 'rho'], out_units=['K'])
@@ -132,6 +132,18 @@ def test_swift_vds_partial_loading():
                       take_swift_cells=[0, 5, 20, 200][::-1])
     assert (f['iord'] == f2['iord']).all()
 
+def test_swift_take():
+    f_full = pynbody.load("testdata/SWIFT/snap_0150.hdf5")
+    take = np.arange(0, len(f_full), 7)
+    f = pynbody.load("testdata/SWIFT/snap_0150.hdf5", take=take)
+    assert f.partial_load
+    assert len(f) == len(take)
+    assert (f['iord'] == f_full['iord'][take]).all()
+    assert np.allclose(f['pos'], f_full['pos'][take])
+
+    with raises(ValueError):
+        pynbody.load("testdata/SWIFT/snap_0150.hdf5", take=take, take_swift_cells=[5])
+
 def test_swift_fof_groups():
     f = pynbody.load("testdata/SWIFT/snap_0150.hdf5")
     h = f.halos(priority = ['HaloNumberCatalogue'])
@@ -145,6 +157,14 @@ def test_swift_fof_groups():
 
     assert len(h) < 1000
 
+def test_swift_fof_load_copy():
+    f = pynbody.load("testdata/SWIFT/snap_0150.hdf5")
+    h = f.halos(priority = ['HaloNumberCatalogue'])
+    h1 = h.load_copy(1)
+    assert len(h1) == len(h[1])
+    assert len(h1.gas) == len(h[1].gas)
+    assert (np.sort(h1['iord']) == np.sort(h[1]['iord'])).all()
+
 def test_swift_dtypes():
     f = pynbody.load("testdata/SWIFT/snap_0150.hdf5")
     assert np.issubdtype(f['iord'].dtype, np.integer)
@@ -1,5 +1,6 @@
 import numpy as np
 import numpy.testing as npt
+import pytest
 
 import pynbody
 
@@ -90,3 +91,106 @@ def test_write_profile():
     npt.assert_allclose(read_profile.nbins, p.nbins)
     npt.assert_allclose(read_profile['rbins'], p['rbins'])
     npt.assert_allclose(read_profile['density'], p['density'])
+
+
+def test_profile_binning():
+    np.random.seed(2)
+    f = pynbody.new(dm=5000)
+    f['pos'] = np.random.normal(size=(5000, 3))
+    f['pos'].units = 'kpc'
+    f['vel'] = np.random.normal(size=(5000, 3))
+    f['vel'].units = 'km s^-1'
+    f['mass'] = np.random.uniform(1.0, 2.0, size=5000)
+    f['mass'].units = 'Msol'
+
+    # include bins beyond the outermost particle, which should be empty
+    p = pynbody.analysis.profile.Profile(f, nbins=40, rmin=0.5, rmax=10.0)
+    assert p['n'][-1] == 0
+
+    for i in range(p.nbins):
+        in_bin = np.where((p._x >= p['bin_edges'][i]) & (p._x < p['bin_edges'][i+1]))[0]
+        npt.assert_equal(p.binind[i], in_bin)
+        assert p['n'][i] == len(in_bin)
+        if len(in_bin) == 0:
+            assert np.isnan(p['vr'][i]) and np.isnan(p['vr_med'][i])
+            continue
+        vr = f['vr'][in_bin]
+        mass = f['mass'][in_bin]
+        npt.assert_allclose(p['mass'][i], mass.sum())
+        npt.assert_allclose(p['vr'][i], (vr * mass).sum() / mass.sum())
+        npt.assert_allclose(p['vr_rms'][i], np.sqrt((vr ** 2 * mass).sum() / mass.sum()))
+        npt.assert_allclose(p['vr_disp'][i], np.sqrt(np.cov(vr, aweights=mass, bias=True)))
+        assert p['vr_med'][i] == np.sort(vr)[len(vr) // 2]
+
+
+def test_streaming_profile(tmp_path):
+    np.random.seed(3)
+    f = pynbody.new(dm=15000, gas=5000, order='gas,dm')
+    f['pos'] = np.random.normal(size=(20000, 3))
+    f['vel'] = np.random.normal(size=(20000, 3))
+    f['mass'] = np.random.uniform(1.0, 2.0, size=20000)
+    f['eps'] = np.ones(20000)
+    f['phi'] = np.ones(20000)
+    for name in 'rho', 'temp', 'metals':
+        f.gas[name] = np.ones(5000)
+    f.properties['a'] = 1.0
+    filename = str(tmp_path / "snapshot.tipsy")
+    f.write(fmt=pynbody.snapshot.tipsy.TipsySnap, filename=filename)
+
+    with pytest.warns(RuntimeWarning, match="No readable param file"):
+        f = pynbody.load(filename)
+
+    cen = np.array([0.1, 0.0, -0.1])
+    with pynbody.transformation.inverse_translate(f, cen):
+        p = pynbody.analysis.profile.Profile(f.dm, nbins=30, rmin=0.0, rmax=3.0, ndim=3)
+
+        # a large sample size means the medians are exact
+        with pytest.warns(RuntimeWarning, match="No readable param file"):
+            sp = pynbody.analysis.profile.StreamingProfile(filename, ['vr'], nbins=30, rmax=3.0, cen=cen,
+                                                           family=pynbody.family.dm, chunk_size=3000,
+                                                           quantile_sample_size=20000)
+        assert len(sp) == 30
+
+        for name in 'n', 'mass', 'density', 'mass_enc', 'rbins', 'vr', 'vr_rms', 'vr_disp', 'vr_med':
+            npt.assert_allclose(np.asarray(sp[name]), np.asarray(p[name]), equal_nan=True)
+        assert sp['density'].units == p['density'].units
+        assert sp['vr'].units == p['vr'].units
+
+        # a small sample size gives approximate medians
+        with pytest.warns(RuntimeWarning, match="No readable param file"):
+            sp = pynbody.analysis.profile.StreamingProfile(filename, ['vr'], nbins=30, rmax=3.0, cen=cen,
+                                                           family=pynbody.family.dm, chunk_size=3000,
+                                                           quantile_sample_size=100)
+        npt.assert_allclose(np.asarray(sp['vr']), np.asarray(p['vr']), equal_nan=True)
+        in_sample = np.where(sp['n'] > 0)[0]
+        assert (np.abs(sp['vr_med'] - p['vr_med'])[in_sample] < 0.5).all()
+        assert (np.bincount(sp._sample_bin) <= 100).all()
+
+
+def test_streaming_chunks_keep_load_options(tmp_path):
+    np.random.seed(4)
+    f = pynbody.new(dm=1500, gas=500, order='gas,dm')
+    f['pos'] = np.random.normal(size=(2000, 3))
+    f['mass'] = np.random.uniform(1.0, 2.0, size=2000)
+    f['eps'] = np.ones(2000)
+    f['phi'] = np.ones(2000)
+    for name in 'rho', 'temp', 'metals':
+        f.gas[name] = np.ones(500)
+    f.properties['a'] = 1.0
+    (tmp_path / "run").mkdir()
+    filename = str(tmp_path / "run" / "snapshot.tipsy")
+    f.write(fmt=pynbody.snapshot.tipsy.TipsySnap, filename=filename)
+
+    # the param file is not in the run directory, so would not be found unless it is passed to each chunk
+    paramfile = str(tmp_path / "snapshot.param")
+    with open(paramfile, 'w') as pf:
+        pf.write("dKpcUnit = 2.0\ndMsolUnit = 3.0\n")
+
+    take = np.arange(100, 1900, 3)
+    f = pynbody.load(filename, paramfile=paramfile, take=take)
+    chunks = list(f._iterate_chunks_from_disk(250))
+    assert [len(c) for c in chunks] == [250, 250, 100]
+    for c in chunks:
+        assert c['pos'].units == f['pos'].units
+    npt.assert_array_equal(np.concatenate([c['pos'] for c in chunks]), f['pos'])
+    npt.assert_array_equal(np.concatenate([c['mass'] for c in chunks]), f['mass'])
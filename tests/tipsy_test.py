@@ -497,3 +497,61 @@ def test_load_without_paramfile(no_paramfile_snap):
         f = pynbody.load(no_paramfile_snap)
         assert isinstance(f, pynbody.snapshot.tipsy.TipsySnap)
         assert len(f) == 1717156
+
+@pytest.fixture
+def native_endian_tipsy(tmp_path):
+    f = pynbody.new(dm=1000, gas=500, star=200, order='gas,dm,star')
+    np.random.seed(1)
+    for name in 'pos', 'vel':
+        f[name] = np.random.normal(size=(len(f), 3))
+    for name in 'mass', 'eps', 'phi':
+        f[name] = np.random.uniform(size=len(f))
+    for name in 'rho', 'temp', 'metals':
+        f.gas[name] = np.random.uniform(size=len(f.gas))
+    for name in 'metals', 'tform':
+        f.star[name] = np.random.uniform(size=len(f.star))
+    f.properties['a'] = 1.0
+    f._byteswap = False # write in native byte order
+    filename = str(tmp_path / "native.tipsy")
+    f.write(fmt=pynbody.snapshot.tipsy.TipsySnap, filename=filename)
+    return filename
+
+def test_memmap_load(native_endian_tipsy):
+    with pytest.warns(RuntimeWarning, match="No readable param"):
+        f = pynbody.load(native_endian_tipsy)
+        f_mapped = pynbody.load(native_endian_tipsy, memmap=True)
+
+    for fam in f.families():
+        for name in f[fam].loadable_keys():
+            npt.assert_allclose(f_mapped[fam][name], f[fam][name], rtol=1e-6)
+            assert str(f_mapped[fam][name].units) == str(f[fam][name].units)
+
+    # arrays are views on the file, not copies, until they are needed at simulation level
+    assert 'pos' in f_mapped.family_keys()
+    assert not f_mapped.dm['pos'].flags['OWNDATA']
+    assert f_mapped.dm['pos'].dtype == np.float32
+
+    # writing to mapped arrays affects only memory, not the file
+    f_mapped.dm['pos'][0] = 100.0
+    assert (f_mapped.dm['x'][0] == 100.0)
+    with pytest.warns(RuntimeWarning, match="No readable param"):
+        f_mapped_again = pynbody.load(native_endian_tipsy, memmap=True)
+    npt.assert_allclose(f_mapped_again.dm['pos'][0], f.dm['pos'][0], rtol=1e-6)
+
+    # simulation-level arrays are assembled on demand
+    assert f_mapped['pos'].shape == (1700, 3)
+    assert 'pos' in f_mapped.keys()
+    assert 'pos' not in f_mapped.family_keys()
+    npt.assert_allclose(f_mapped.gas['pos'], f.gas['pos'], rtol=1e-6)
+    npt.assert_allclose(f_mapped.dm['pos'][0], 100.0)
+
+def test_memmap_byteswapped_fallback(tmp_path):
+    f = pynbody.new(dm=100)
+    f.properties['a'] = 1.0
+    f._byteswap = True
+    filename = str(tmp_path / "byteswapped.tipsy")
+    f.write(fmt=pynbody.snapshot.tipsy.TipsySnap, filename=filename)
+    with pytest.warns(RuntimeWarning) as record:
+        f_mapped = pynbody.load(filename, memmap=True)
+    assert any("Cannot memory-map" in str(w.message) for w in record)
+    npt.assert_allclose(f_mapped['pos'], f['pos'])